@@ -1,47 +1,115 @@
 from __future__ import annotations  # for type hinting
 
 import os
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, Any
 
 from uagents import Agent
 from uagents.setup import fund_agent_if_low
 
 from messages import (
+    BulkTemperatureRequest,
+    BulkTemperatureResponse,
+    HistoryRequest,
     SendsTo,
+    SubscriptionResult,
     TemperatureCondition,
+    TemperatureHistory,
     TemperatureRequest,
-    TemperatureWarn,
+    TemperatureWarnList,
     UAgentResponse,
     UAgentResponseType,
 )
+from utils.breaker import BreakerState
+from utils.cells import to_cell
 from utils.cooldown import Cooldown
-from utils.database import Database
-from utils.email import send_email, send_verifaction, verify_regex
+from utils.models import ScanRecord, subscription_key
+from utils.digest import Digest, render_email
+from utils.email import send_email, send_verifaction, smtp_pool, verify_regex
+from utils.geocode import GeocodeCache
+from utils.history import HistoryStore
+from utils.outbox import Outbox
+from utils.partition import Membership
+from utils.pool import run_concurrently
+from utils.registration import (
+    REGISTRATION_LEASE,
+    LatencyStats,
+    WorkerPool,
+    retry_delay,
+)
 from utils.requests import RequestHandler
+from utils.runner import ScanRunner
+from utils.scheduler import PollScheduler
+from utils.storage import create_database
+from utils.subscriptions import SubscriptionTable
 
 if TYPE_CHECKING:  # to avoid useless imports
     from uagents import Context
 
 TEMPERATURE_SEED = os.getenv("TEMPERATURE_SEED")  # get seed from .env file
-
-temperate_agent = Agent(name="temperature", seed=TEMPERATURE_SEED)
+# set to run several instances that split the cells between them
+INSTANCE_ID = os.getenv("INSTANCE_ID")
+PARTITION_HEARTBEAT = 10  # seconds between lease renewals
+PARTITION_RELOAD = 5 * 60  # seconds between table reloads, to see other instances' users
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "20"))  # users scanned at once
+SCAN_TICK = 60  # seconds between checks for cells that are due
+SCAN_CHUNK = int(os.getenv("SCAN_CHUNK", "200"))  # cells processed between two checkpoints
+REGISTRATION_TICK = 60  # seconds between checks for registrations that are due
+BULK_MAX_SUBSCRIPTIONS = 1000  # locations per BulkTemperatureRequest
+HISTORY_WARM = 6 * 60 * 60  # seconds of history replayed into the scheduler at startup
+
+if INSTANCE_ID:  # every instance needs its own identity
+    temperate_agent = Agent(
+        name=f"temperature-{INSTANCE_ID}", seed=f"{TEMPERATURE_SEED}-{INSTANCE_ID}"
+    )
+else:
+    temperate_agent = Agent(name="temperature", seed=TEMPERATURE_SEED)
 fund_agent_if_low(str(temperate_agent.wallet.address()))
 
 
 # creating instances of classes
-request_handler = RequestHandler()
-database = Database()
+database = create_database()  # mongodb or sqlite, see STORAGE_BACKEND
+request_handler = RequestHandler(geocode_cache=GeocodeCache(database))
+subscriptions = SubscriptionTable()  # in-memory copy of the database for scans
+scheduler = PollScheduler()  # next poll time of every cell
+history = HistoryStore()  # recent readings of every cell, kept on disk
+# owned slice of the cells, None when this is the only instance
+membership = Membership(database, INSTANCE_ID) if INSTANCE_ID else None
+last_reload = time.time()  # last time the table was reloaded for other instances
+# one scan pass at a time, per slice of the cells when running several instances
+scan_runner = ScanRunner(database, f"scan:{INSTANCE_ID}" if INSTANCE_ID else "scan")
+
+
+async def send_outbox_email(payload: dict):
+    """
+    This function is used to deliver an email queued to the outbox.
+
+    Args:
+        payload (dict): Receiver, subject and body of the email
+
+    Returns:
+        None
+
+    """
+    await send_email(payload["to"], payload["subject"], payload["body"])
+
+
+outbox = Outbox(database, send_outbox_email)  # delivers alert emails in the background
+
+registration_latency = LatencyStats()  # time spent in every stage of a registration
 
 # creating cooldowns
 update_cooldown = Cooldown(5 * 60)
-alert_cooldown = Cooldown(3 * 60 * 60)
+alert_cooldown = Cooldown(3 * 60 * 60, name="alert", database=database)
 
 
 @temperate_agent.on_event("startup")
 async def startup(ctx: Context):
     """
     This function is called when the agent starts up.
-    It is used to start the request handler.
+    It is used to start the request handler, the outbox and the registration workers,
+    load the subscription table, warm the caches from the reading history and resume
+    pending registrations.
 
     Args:
         ctx (Context): Context object
@@ -51,13 +119,34 @@ async def startup(ctx: Context):
     """
     ctx.logger.info("Starting up temperature agent")
     await request_handler.start()
+    outbox.start()
+    registrations.start()
+    if membership is not None:
+        await membership.heartbeat()  # join before the first scan
+    try:
+        await alert_cooldown.load()  # before the table, which copies alert times
+        await subscriptions.load(database, alert_cooldown)
+        ctx.logger.info(f"Loaded {len(subscriptions)} subscriptions")
+    except Exception as e:  # scans fall back to querying the database
+        ctx.logger.error(f"Unable to load subscriptions: {e}")
+
+    try:  # readings from before the restart spare api calls
+        history.open()
+        warm_from_history(subscriptions.cells if subscriptions.loaded else history.cells)
+    except Exception as e:
+        ctx.logger.error(f"Unable to load reading history: {e}")
+
+    # finish registrations interrupted by the last shutdown
+    await resume_registrations(ctx)
 
 
 @temperate_agent.on_event("shutdown")
 async def shutdown(ctx: Context):
     """
     This function is called when the agent shuts down.
-    It is used to stop the request handler.
+    It is used to stop the workers and the request handler, close the smtp sessions,
+    persist the alert cooldowns and write buffered database writes. Every step runs
+    even if an earlier one fails.
 
     Args:
         ctx (Context): Context object
@@ -66,14 +155,179 @@ async def shutdown(ctx: Context):
         None
     """
     ctx.logger.info("Shutting down temperature agent")
-    await request_handler.stop()
+    steps = []
+    if membership is not None:
+        steps.append(membership.leave)  # hand the cells over right away
+    steps += [
+        registrations.stop,
+        outbox.stop,
+        request_handler.stop,
+        smtp_pool.close,
+        alert_cooldown.persist,
+        database.flush,  # write buffered registrations and removals
+    ]
+    for step in steps:
+        try:
+            await step()
+        except Exception as e:  # a failing step must not skip the ones after it
+            ctx.logger.error(f"Unable to run {step.__qualname__} on shutdown: {e}")
+    history.close()
+
+
+def warm_from_history(cells: list[str]):
+    """
+    This function is used to restore the last readings and trends of cells from their history.
+    Readings still within the stale window of the temperature cache are cached again
+    and the scheduler gets back the rate of change of every cell.
+
+    Args:
+        cells (list[str]): Cells to warm
+
+    Returns:
+        None
+
+    """
+    now = time.time()
+    cache = request_handler.temperature_cache
+    for cell in cells:
+        readings = history.read(cell, now - HISTORY_WARM)
+        if not len(readings):
+            continue
+        scheduler.warm(
+            cell, readings["time"].tolist(), readings["temperature"].tolist()
+        )
+        observed, temperature = history.latest(cell)
+        if cache.peek(cell) is None and now - observed < cache.ttl + cache.stale_ttl:
+            cache.set(cell, round(temperature, 2), stored=observed)
+
+
+def evaluate(data: ScanRecord, temperature: float):
+    """
+    This function is used to check the temperature against the thresholds of a user.
+
+    Args:
+        data (ScanRecord): Record of the user
+        temperature (float): Current temperature of the user's location
+
+    Returns:
+        Optional[tuple[TemperatureCondition, str]]: Condition and alert body, None if temperature is in range
+
+    """
+    if temperature < data.minimum_temperature:
+        body = (
+            f"Current Temperature: {temperature}\n"
+            f"Temperature lower than the set minimum threshold of {data.minimum_temperature} Celsius\n"
+            f"Location: {data.location.title()}\n"
+        )
+        return TemperatureCondition.LOW, body
+    if temperature > data.maximum_temperature:
+        body = (
+            f"Current Temperature: {temperature}\n"
+            f"Temperature higher than the set maximum threshold of {data.maximum_temperature} Celsius\n"
+            f"Location: {data.location.title()}\n"
+        )
+        return TemperatureCondition.HIGH, body
+    return None
+
+
+async def deliver(ctx: Context, digest: Digest) -> set[str]:
+    """
+    This function is used to send the alerts of a scan, one per receiver.
+    Emails are queued to the outbox, agents get a TemperatureWarn for a single
+    alert or a TemperatureWarnList for several.
+
+    Args:
+        ctx (Context): Context object
+        digest (Digest): Alerts of the scan grouped by receiver
+
+    Returns:
+        set[str]: Emails whose digest could not be queued
+
+    """
+    failed: set[str] = set()
+    async def send_digest_email(email: str):
+        # the key names the alerts, so only a replay of the same scan is queued once
+        subject, body, key = render_email(digest.emails[email])
+        await outbox.enqueue(
+            f"alert:{email}:{key}",
+            {"to": email, "subject": subject, "body": body},
+        )
+
+    async def send_warnings(address: str):
+        warnings = digest.warnings[address]
+        if len(warnings) == 1:
+            await ctx.send(address, warnings[0])  # send TemperatureWarn message to user
+        else:
+            await ctx.send(address, TemperatureWarnList(warnings=warnings))
+
+    async def guard(send, receiver: str):
+        try:
+            await send(receiver)
+        except Exception as e:
+            ctx.logger.error(f"Unable to alert {receiver}: {e}")
+            if send is send_digest_email:
+                failed.add(receiver)
+
+    await run_concurrently(
+        [(send_digest_email, email) for email in digest.emails]
+        + [(send_warnings, address) for address in digest.warnings],
+        lambda item: guard(*item),
+        SCAN_CONCURRENCY,
+    )
+    return failed
+
+
+@temperate_agent.on_interval(period=PARTITION_HEARTBEAT)
+async def heartbeat(ctx: Context):
+    """
+    This function is called every PARTITION_HEARTBEAT seconds when running several instances.
+    It is used to renew the lease of this instance and rebalance the cells when
+    an instance joins or dies. The subscription table and the alert cooldowns are
+    reloaded on a rebalance, and every PARTITION_RELOAD seconds, to pick up the
+    users and alerts of the other instances. Users removed on another instance are
+    dropped sooner, by the scan, before they are alerted.
 
+    Args:
+        ctx (Context): Context object
+
+    Returns:
+        None
+    """
+    global last_reload
+    if membership is None:
+        return
 
-@temperate_agent.on_interval(period=30 * 60)
+    try:
+        changed = await membership.heartbeat()
+    except Exception as e:
+        ctx.logger.error(f"Unable to renew lease: {e}")
+        return
+    if changed:
+        ctx.logger.info(f"Rebalanced between {len(membership.ring.members)} instances")
+
+    if changed or time.time() - last_reload >= PARTITION_RELOAD:
+        last_reload = time.time()
+        await alert_cooldown.persist()
+        await alert_cooldown.load()
+        await subscriptions.reload(database, alert_cooldown)
+
+
+@temperate_agent.on_interval(period=SCAN_TICK)
 async def scan_all(ctx: Context):
     """
-    This function is called every 30 minutes.
-    It is used to scan all the users in the database and send them alerts if required.
+    This function is called every SCAN_TICK seconds.
+    It is used to scan the cells that are due and send alerts to their users if required.
+    Passes never overlap, see ScanRunner: a tick arriving during a pass is merged
+    into one follow-up pass and a pass is skipped while another process runs it.
+    The poll scheduler decides when every cell is due from its margin to the nearest
+    threshold and its rate of change, with jitter and a per tick cap so polls are
+    spread evenly. Due cells are fetched once, in batches where
+    possible, then the users whose thresholds are breached are found with vectorized
+    checks on the subscription table, or read from the database if the table is not
+    loaded. A user is alerted when its location goes out of range or changes side, and
+    again only once off cooldown if the temperature moved ALERT_CHANGE degrees since.
+    Alerts are grouped into one digest per receiver. Fetches and deliveries
+    run at most SCAN_CONCURRENCY at a time.
 
     Args:
         ctx (Context): Context object
@@ -81,58 +335,164 @@ async def scan_all(ctx: Context):
     Returns:
         None
     """
-    async for data in database.find_all():  # fetch all users from database
-        if alert_cooldown.on_waiting(data.address):
-            continue  # if user is on cooldown, skip this user
+    await scan_runner.run(lambda runner: scan_pass(ctx, runner))
 
-        # fetch temperature from openweathermap api
-        temperature = await request_handler.fetch_temperature(data.lat, data.lon)
 
-        # check if temperature is out of range
-        if temperature < data.minimum_temperature:
-            body = (
-                f"Current Temperature: {temperature}\n"
-                f"Temperature lower than the set minimum threshold of {data.minimum_temperature} Celsius\n"
-                f"Location: {data.location.title()}\n"
-            )
-            condition = TemperatureCondition.LOW
-        elif temperature > data.maximum_temperature:
-            body = (
-                f"Current Temperature: {temperature}\n"
-                f"Temperature lower than the set maximum threshold of {data.maximum_temperature} Celsius\n"
-                f"Location: {data.location.title()}\n"
-            )
-            condition = TemperatureCondition.HIGH
-        else:
-            continue
+async def scan_pass(ctx: Context, runner: ScanRunner):
+    """
+    This function is used to run one scan pass while holding the scan lease.
+    Cells left over by a pass that crashed go first, then the due cells are
+    processed SCAN_CHUNK at a time with a checkpoint after every chunk.
 
-        
-        if (SendsTo.EMAIL in data.sends_to) and data.email:
-            # check if user wants to receive email alerts
-            try:
-                await send_email(data.email, "TEMPERATURE ALERT !", body)
-            except Exception as e:
-                ctx.logger.error(str(e))
-        if SendsTo.AGENT in data.sends_to:
-            # check if user wants to receive agent alerts
-            await ctx.send(
-                data.address,
-                TemperatureWarn(
-                    location=data.location,
-                    temperature=temperature,
-                    condition=condition,
-                    minimum_temperature=data.minimum_temperature,
-                    maximum_temperature=data.maximum_temperature,
-                ),  # send TemperatureWarn message to user
-            )
-        alert_cooldown.update(data.address)  # update cooldown
+    Args:
+        ctx (Context): Context object
+        runner (ScanRunner): Runner holding the lease
+
+    Returns:
+        None
+    """
+    now = time.time()
+    cells = subscriptions.cells if subscriptions.loaded else await database.find_cells()
+    if membership is not None:  # only scan the cells of this instance
+        cells = [cell for cell in cells if membership.owns(cell)]
+    scheduler.sync(cells, now)
+    current = set(cells)
+    for cell in runner.resumed:
+        if cell in current:
+            scheduler.schedule(cell, 0)  # left over by the last pass, goes first
+    # cap the cells of a tick so the load stays flat over the interval
+    cells = scheduler.pop_due(now, scheduler.tick_limit(SCAN_TICK))
+    if not cells:
+        return  # nothing is due this tick
+
+    await runner.checkpoint(cells)
+    for start in range(0, len(cells), SCAN_CHUNK):
+        await scan_cells(ctx, cells[start : start + SCAN_CHUNK])
+        await runner.checkpoint(cells[start + SCAN_CHUNK :])
+
+    try:
+        history.flush()
+    except Exception as e:
+        ctx.logger.error(f"Unable to write reading history: {e}")
+    ctx.logger.info(f"Weather api: {request_handler.stats}")
+    ctx.logger.info(f"Registration latency: {registration_latency.summary}")
+
+
+async def scan_cells(ctx: Context, cells: list[str]):
+    """
+    This function is used to fetch the temperature of cells and alert their users.
+
+    Args:
+        ctx (Context): Context object
+        cells (list[str]): Cells to scan
+
+    Returns:
+        None
+    """
+    now = time.time()
+    if request_handler.breaker.state is BreakerState.OPEN:
+        ctx.logger.warning("Weather api circuit is open, using cached readings")
+    # fetch temperatures from openweathermap api, batched where possible
+    temperatures = await request_handler.fetch_temperatures(cells, SCAN_CONCURRENCY)
+    if len(temperatures) < len(cells):
+        ctx.logger.error(
+            f"Unable to fetch temperature for {len(cells) - len(temperatures)} cells"
+        )
+        for cell in cells:
+            if cell not in temperatures:
+                scheduler.retry(cell, now)
+
+    margins = subscriptions.cell_margins(temperatures) if subscriptions.loaded else {}
+    # cached readings keep the time they were observed, so they are counted once
+    observed = {
+        cell: request_handler.temperature_cache.stored_at(cell) or now
+        for cell in temperatures
+    }
+    for cell, temperature in temperatures.items():
+        scheduler.record(cell, temperature, margins.get(cell), now, observed[cell])
+    if history.opened:  # the history is optional, scans go on without it
+        try:
+            for cell, temperature in temperatures.items():
+                history.append(cell, observed[cell], temperature)
+        except Exception as e:
+            ctx.logger.error(f"Unable to store readings: {e}")
+
+    if subscriptions.loaded:
+        table = subscriptions
+    else:  # only the users that are breached or still alerted, read from the database
+        table = SubscriptionTable()
+        async for data in database.find_violations(temperatures):
+            table.add(data, alert_cooldown.last_used(data.key))
+    # alert on changes of condition, and on large moves once off cooldown
+    rows, states = table.check_alerts(temperatures, now, alert_cooldown.per)
+
+    # rows move when users are removed or the table is reloaded, so read them before any await
+    alerts = []
+    for row in rows:
+        data = table.records[row]
+        temperature = temperatures[data.cell]
+        result = evaluate(data, temperature)  # check if temperature is out of range
+        if result is not None:
+            alerts.append((data, temperature, result))
+    if membership is not None and alerts:
+        # users removed on another instance stay in the table until the next reload
+        existing = await database.find_keys([data.key for data, _, _ in alerts])
+        for data, _, _ in alerts:
+            if data.key not in existing:
+                states.pop(data.key, None)
+                subscriptions.discard(data.key)
+        alerts = [alert for alert in alerts if alert[0].key in existing]
+
+    digest = Digest()
+    alerted = []
+    for data, temperature, result in alerts:
+        alerted.append(data.key)
+        digest.add(data, temperature, *result, states[data.key][2])
+
+    failed = await deliver(ctx, digest)
+    for email in failed:  # not committed, so the next scan alerts them again
+        for key in digest.keys[email]:
+            states.pop(key, None)
+    table.apply_alerts(states, now)
+    for key in alerted:
+        if key in states:
+            alert_cooldown.update(key)  # update cooldown
+    # so alerts are not repeated after a restart
+    await database.save_alert_states(states)
+    await alert_cooldown.persist()
+
+
+def check_email(message: TemperatureRequest) -> bool:
+    """
+    This function is used to check the email of a request that wants email alerts.
+
+    Args:
+        message (TemperatureRequest): TemperatureRequest message sent by the user
+
+    Returns:
+        bool: True if the user wants email alerts, False otherwise
+
+    Raises:
+        Exception: Email is required for email alerts
+        ValueError: Invalid email address
+
+    """
+    if SendsTo.EMAIL not in message.sends_to:
+        return False
+    if message.email is None:  # check if email is provided
+        raise Exception("Email is required for email alerts !")
+    verify_regex(message.email)  # check if email has viable regex
+    return True
 
 
 @temperate_agent.on_message(model=TemperatureRequest, replies=UAgentResponse)
 async def add_user(ctx: Context, sender: str, message: TemperatureRequest):
     """ "
     This function is called when a user sends a TemperatureRequest message to the agent.
-    It is used to add the user to the database and send a verification email if required.
+    It is used to add the location of the user to the database and send a verification email if required.
+    A request for a location the user already subscribed to replaces its thresholds.
+    The request is stored as pending and acknowledged right away, geocoding and the
+    verification email are done by the registration workers.
 
     Args:
         ctx (Context): Context object
@@ -157,15 +517,8 @@ async def add_user(ctx: Context, sender: str, message: TemperatureRequest):
 
     ctx.logger.info(f"Received temperature request for location: {message.location}")
 
-    try:  # fetch lat and lon from openweathermap api
-        lat, lon = await request_handler.fetch_lat_and_lon(message.location)
-        # check if user wants to receive email alerts
-        if SendsTo.EMAIL in message.sends_to:
-            if message.email is None:  # check if email is provided
-                raise Exception("Email is required for email alerts !")
-
-            verify_regex(message.email)  # check if email has viable regex
-            await send_verifaction(message.email)
+    try:  # check if the request is valid before storing it
+        check_email(message)
     except Exception as e:
         ctx.logger.error(str(e))
         await ctx.send(
@@ -173,22 +526,254 @@ async def add_user(ctx: Context, sender: str, message: TemperatureRequest):
         )
         return
 
-    await database.insert(
-        address=sender,
-        email=message.email,
-        lat=lat,
-        lon=lon,
-        location=message.location,
-        min_temp=message.minimum_temperature,
-        max_temp=message.maximum_temperature,
-        sends_to=message.sends_to,
+    with registration_latency.measure("store"):
+        key = await database.insert_pending(
+            address=sender,
+            email=message.email,
+            location=message.location,
+            min_temp=message.minimum_temperature,
+            max_temp=message.maximum_temperature,
+            sends_to=message.sends_to,
+        )
+    await registrations.submit((ctx, key, time.perf_counter()))
+
+    await ctx.send(
+        sender,
+        UAgentResponse(
+            type=UAgentResponseType.MESSAGE,
+            message="Location received, verifying it !",
+        ),
+    )
+
+
+async def finish_registration(job: tuple[Context, str, float]):
+    """
+    This function is used to geocode and verify a pending registration in the background.
+    The registration is claimed first, so a registration queued by several instances
+    is finished once. A subscription with the same key keeps working until the
+    registration is activated. Failures of upstream services are retried later,
+    the user gets a second UAgentResponse with the final state of the registration,
+    or the BulkTemperatureResponse once every location of a bulk request is finished.
+
+    Args:
+        job (tuple[Context, str, float]): Context object, key of the registration and time it was queued
+
+    Returns:
+        None
+
+    """
+    ctx, key, queued = job
+    registration_latency.record("queue", time.perf_counter() - queued)
+    registration = await database.claim_registration(key, REGISTRATION_LEASE)
+    if registration is None:
+        return  # finished elsewhere, removed or not due yet
+
+    try:
+        with registration_latency.measure("geocode"):
+            # fetch lat and lon from openweathermap api
+            lat, lon = await request_handler.fetch_lat_and_lon(registration["location"])
+        if SendsTo.EMAIL in registration["sends_to"]:
+            with registration_latency.measure("verify"):
+                await verify_once(registration)
+    except Exception as e:
+        attempts = registration["attempts"] + 1
+        # a ValueError is an unknown location or email, trying again will not help
+        delay = None if isinstance(e, ValueError) else retry_delay(attempts)
+        if delay is not None:
+            ctx.logger.warning(f"Registration {key} failed, retrying: {e}")
+            await database.retry_registration(
+                key, attempts, time.time() + delay, str(e)
+            )
+            return
+        ctx.logger.error(str(e))
+        await database.remove_registration(key)
+        await reply(ctx, registration, UAgentResponseType.ERROR, str(e))
+        return
+
+    with registration_latency.measure("activate"):
+        record = await database.activate(key, lat, lon)
+    if record is None:
+        return  # removed while it was being finished
+    subscriptions.add(record, alert_cooldown.last_used(key))
+    registration_latency.record("total", time.perf_counter() - queued)
+
+    await reply(
+        ctx,
+        registration,
+        UAgentResponseType.MESSAGE,
+        "Location added successfully for updates !",
+    )
+
+
+async def verify_once(registration: dict[str, Any]):
+    """
+    This function is used to send the verification email of a registration.
+    The locations of a bulk request that share an email send it once.
+
+    Args:
+        registration (dict[str, Any]): Claimed registration
+
+    Returns:
+        None
+
+    Raises:
+        Exception: Unable to send verification email
+
+    """
+    batch = registration.get("batch")
+    email = registration["email"]
+    if batch is not None and not await database.claim_batch_email(batch, email):
+        return  # sent for another location of the request
+    try:
+        await send_verifaction(email)
+    except Exception:
+        if batch is not None:  # so a retry sends it again
+            await database.release_batch_email(batch, email)
+        raise
+
+
+async def reply(
+    ctx: Context, registration: dict[str, Any], type: UAgentResponseType, message: str
+):
+    """
+    This function is used to tell the user the final state of a registration.
+    The locations of a bulk request are answered together, by the last one finished.
+
+    Args:
+        ctx (Context): Context object
+        registration (dict[str, Any]): Claimed registration
+        type (UAgentResponseType): Type of response
+        message (str): Message sent to the user
+
+    Returns:
+        None
+
+    """
+    batch = registration.get("batch")
+    if batch is None:
+        await ctx.send(
+            registration["address"], UAgentResponse(type=type, message=message)
+        )
+        return
+    finished = await database.finish_batch_item(
+        batch, registration["item"], type.value, message
     )
+    if finished is not None:
+        await ctx.send(
+            finished["address"],
+            BulkTemperatureResponse(
+                results=[SubscriptionResult(**result) for result in finished["results"]]
+            ),
+        )
+
+
+# finishes registrations in the background
+registrations: WorkerPool[tuple[Context, str, float]] = WorkerPool(finish_registration)
+
+
+@temperate_agent.on_interval(period=REGISTRATION_TICK)
+async def resume_registrations(ctx: Context):
+    """
+    This function is called every REGISTRATION_TICK seconds.
+    It is used to queue the registrations that are due, retries and the ones
+    whose worker died. Every instance queues them, the claim lets one finish each.
+
+    Args:
+        ctx (Context): Context object
+
+    Returns:
+        None
+    """
+    try:
+        for key in await database.find_due_registrations():
+            await registrations.submit((ctx, key, time.perf_counter()))
+    except Exception as e:
+        ctx.logger.error(f"Unable to resume pending registrations: {e}")
+
+
+@temperate_agent.on_message(
+    model=BulkTemperatureRequest, replies={BulkTemperatureResponse, UAgentResponse}
+)
+async def add_users(ctx: Context, sender: str, message: BulkTemperatureRequest):
+    """
+    This function is called when a user sends a BulkTemperatureRequest message to the agent.
+    It is used to subscribe the user to many locations at once. The locations are
+    stored as pending in one bulk write and acknowledged right away, geocoding and
+    verification emails are done by the registration workers. A location given
+    twice, in any spelling, is only added once. The BulkTemperatureResponse with
+    the outcome of every location is sent once the last one is finished.
+
+    Args:
+        ctx (Context): Context object
+        sender (str): Address of the sender
+        message (BulkTemperatureRequest): BulkTemperatureRequest message sent by the user
+
+    Returns:
+        None
+    """
+    error = None
+    if update_cooldown.on_waiting(sender):  # check if user is on cooldown
+        error = "You are on cooldown, try again in 5 minutes !"
+    elif len(message.subscriptions) > BULK_MAX_SUBSCRIPTIONS:
+        error = f"At most {BULK_MAX_SUBSCRIPTIONS} locations can be added at once !"
+    if error is not None:
+        await ctx.send(
+            sender, UAgentResponse(type=UAgentResponseType.ERROR, message=error)
+        )
+        return
+    update_cooldown.update(sender)  # update cooldown
+
+    items = message.subscriptions
+    ctx.logger.info(f"Received bulk temperature request for {len(items)} locations")
+    results = [
+        {"location": item.location, "type": None, "message": None} for item in items
+    ]
+    pending = []
+    first: dict[str, int] = {}  # first index of every subscription key
+    for index, item in enumerate(items):
+        try:  # check if the request is valid before storing it
+            check_email(item)
+        except Exception as e:
+            results[index].update(type=UAgentResponseType.ERROR.value, message=str(e))
+            continue
+        key = subscription_key(sender, item.location)
+        if key in first:  # a second registration would replace the first one
+            results[index].update(
+                type=UAgentResponseType.ERROR.value,
+                message=f"Same location as {items[first[key]].location} !",
+            )
+            continue
+        first[key] = index
+        pending.append(
+            {
+                "email": item.email,
+                "location": item.location,
+                "min_temp": item.minimum_temperature,
+                "max_temp": item.maximum_temperature,
+                "sends_to": item.sends_to,
+                "item": index,
+            }
+        )
+
+    if not pending:  # nothing left for the workers
+        await ctx.send(
+            sender,
+            BulkTemperatureResponse(
+                results=[SubscriptionResult(**result) for result in results]
+            ),
+        )
+        return
+
+    with registration_latency.measure("store"):
+        keys = await database.insert_pending_many(sender, pending, results)
+    for key in keys:
+        await registrations.submit((ctx, key, time.perf_counter()))
 
     await ctx.send(
         sender,
         UAgentResponse(
             type=UAgentResponseType.MESSAGE,
-            message="Location added successfully for updates !",
+            message=f"{len(keys)} locations received, verifying them !",
         ),
     )
 
@@ -197,7 +782,7 @@ async def add_user(ctx: Context, sender: str, message: TemperatureRequest):
 async def remove_user(ctx: Context, sender: str, message: UAgentResponse):
     """
     This function is called when a user sends a UAgentResponse message to the agent.
-    It is used to remove the user from the database.
+    It is used to remove every location of the user from the database.
 
     Args:
         ctx (Context): Context object
@@ -224,6 +809,7 @@ async def remove_user(ctx: Context, sender: str, message: UAgentResponse):
     update_cooldown.update(sender)
     ctx.logger.info(f"Removing user {sender} !")
     await database.remove(sender)
+    subscriptions.remove(sender)
     await ctx.send(
         sender,
         UAgentResponse(
@@ -231,3 +817,41 @@ async def remove_user(ctx: Context, sender: str, message: UAgentResponse):
             message="Temperature updates removed successfully !",
         ),
     )
+
+
+@temperate_agent.on_message(
+    model=HistoryRequest, replies={TemperatureHistory, UAgentResponse}
+)
+async def send_history(ctx: Context, sender: str, message: HistoryRequest):
+    """
+    This function is called when a user sends a HistoryRequest message to the agent.
+    It is used to send the readings of a location from the last hours, read from
+    the local history without calling the weather api.
+
+    Args:
+        ctx (Context): Context object
+        sender (str): Address of the sender
+        message (HistoryRequest): HistoryRequest message sent by the user
+
+    Returns:
+        None
+    """
+    try:
+        lat, lon = await request_handler.fetch_lat_and_lon(message.location)
+    except Exception as e:
+        ctx.logger.error(str(e))
+        await ctx.send(
+            sender, UAgentResponse(type=UAgentResponseType.ERROR, message=str(e))
+        )
+        return
+
+    readings = history.read(to_cell(lat, lon), time.time() - message.hours * 60 * 60)
+    await ctx.send(
+        sender,
+        TemperatureHistory(
+            location=message.location,
+            times=readings["time"].tolist(),
+            # stored as float32, rounded so the values read like the api ones
+            temperatures=[round(value, 2) for value in readings["temperature"].tolist()],
+        ),
+    )
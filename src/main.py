@@ -2,13 +2,17 @@ from dotenv import load_dotenv
 
 load_dotenv()  # loads environment variables from .env file
 
+import os
+
 from uagents import Bureau
 
 from agents import temperate_agent
 
+AGENT_PORT = int(os.getenv("AGENT_PORT", "8000"))  # must differ between instances on a host
+
 # initialize bureau and add agents to it
 if __name__ == "__main__":
-    bureau = Bureau(endpoint=["http://localhost:8000/submit"], port=8000)
+    bureau = Bureau(endpoint=[f"http://localhost:{AGENT_PORT}/submit"], port=AGENT_PORT)
     bureau.add(temperate_agent)
     print("Address for temperature Agent: ", temperate_agent.address)
     bureau.run()
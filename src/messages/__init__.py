@@ -1,3 +1,14 @@
-from .general import UAgentResponse, UAgentResponseType
-from .request import SendsTo, TemperatureRequest
-from .warn import TemperatureCondition, TemperatureWarn
+from .general import (
+    BulkTemperatureResponse,
+    SubscriptionResult,
+    TemperatureHistory,
+    UAgentResponse,
+    UAgentResponseType,
+)
+from .request import (
+    BulkTemperatureRequest,
+    HistoryRequest,
+    SendsTo,
+    TemperatureRequest,
+)
+from .warn import TemperatureCondition, TemperatureWarn, TemperatureWarnList
@@ -29,3 +29,44 @@ class UAgentResponse(Model):
 
     type: UAgentResponseType
     message: Optional[str] = None
+
+
+class SubscriptionResult(Model):
+    """
+    This class is used to define the outcome of one location of a bulk request.
+
+    Attributes:
+        location (str): Location of the subscription
+        type (UAgentResponseType): Type of response
+        message (Optional[str]): Message sent by the agent
+    """
+
+    location: str
+    type: UAgentResponseType
+    message: Optional[str] = None
+
+
+class BulkTemperatureResponse(Model):
+    """
+    This class is used to define the response to a bulk request.
+
+    Attributes:
+        results (list[SubscriptionResult]): Outcome of every location, in request order
+    """
+
+    results: list[SubscriptionResult]
+
+
+class TemperatureHistory(Model):
+    """
+    This class is used to define the response to a history request.
+
+    Attributes:
+        location (str): Location of the history
+        times (list[float]): Time of every reading in seconds since epoch, oldest first
+        temperatures (list[float]): Temperature of every reading
+    """
+
+    location: str
+    times: list[float]
+    temperatures: list[float]
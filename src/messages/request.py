@@ -36,3 +36,27 @@ class TemperatureRequest(Model):
     minimum_temperature: int
     maximum_temperature: int
     sends_to: list[SendsTo] = Field(default=[SendsTo.AGENT])
+
+
+class BulkTemperatureRequest(Model):
+    """
+    This class is used to subscribe to many locations in one request.
+
+    Attributes:
+        subscriptions (list[TemperatureRequest]): Locations with their own thresholds and destinations
+    """
+
+    subscriptions: list[TemperatureRequest]
+
+
+class HistoryRequest(Model):
+    """
+    This class is used to request the recent temperatures of a location.
+
+    Attributes:
+        location (str): Location for which the history is requested
+        hours (float): How far back the history goes
+    """
+
+    location: str
+    hours: float = Field(default=24, gt=0)
@@ -34,3 +34,14 @@ class TemperatureWarn(Model):
     condition: TemperatureCondition
     minimum_temperature: float
     maximum_temperature: float
+
+
+class TemperatureWarnList(Model):
+    """
+    This class is used to send every temperature alert of a scan in one message.
+
+    Attributes:
+        warnings (list[TemperatureWarn]): Temperature alerts
+    """
+
+    warnings: list[TemperatureWarn]
@@ -0,0 +1,115 @@
+import time
+from enum import Enum
+
+
+class BreakerState(Enum):
+    """
+    This class is used to define the state of a circuit breaker.
+
+    Attributes:
+        CLOSED (str): Requests go through
+        OPEN (str): Requests fail right away
+        HALF_OPEN (str): One trial request goes through
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    This class is used to signal that a request was not made because the circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    This class is used to stop calling a degraded upstream for a while.
+    After threshold failures in a row the circuit opens, after reset_timeout one trial
+    request is let through, closing the circuit if it succeeds.
+
+    Attributes:
+        threshold (int): Failures in a row that open the circuit
+        reset_timeout (float): Seconds the circuit stays open before a trial
+        failures (int): Current failures in a row
+        _opened_at (float): Time the circuit opened
+        _trial (bool): True while the trial request is in flight
+
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+
+    @property
+    def state(self) -> BreakerState:
+        """
+        This function is used to get the state of the circuit.
+
+        Returns:
+            BreakerState: Current state
+
+        """
+        if self.failures < self.threshold:
+            return BreakerState.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return BreakerState.OPEN
+        return BreakerState.HALF_OPEN
+
+    def before_call(self) -> None:
+        """
+        This function is used to check if a request may be made.
+
+        Returns:
+            None
+
+        Raises:
+            CircuitOpenError: Circuit is open or its trial request is in flight
+
+        """
+        state = self.state
+        if state is BreakerState.CLOSED:
+            return
+        if state is BreakerState.HALF_OPEN and not self._trial:
+            self._trial = True  # let one request find out if the upstream is back
+            return
+        raise CircuitOpenError("Weather api is unavailable, circuit is open")
+
+    def on_success(self) -> None:
+        """
+        This function is used to close the circuit after a successful request.
+
+        Returns:
+            None
+
+        """
+        self.failures = 0
+        self._trial = False
+
+    def on_done(self) -> None:
+        """
+        This function is used to end a request however it ended, even if cancelled.
+        A trial request that neither succeeded nor failed lets the next request try again.
+
+        Returns:
+            None
+
+        """
+        self._trial = False
+
+    def on_failure(self) -> None:
+        """
+        This function is used to count a failed request, opening the circuit at the threshold.
+
+        Returns:
+            None
+
+        """
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.threshold:
+            self._opened_at = time.monotonic()  # (re)start the open period
@@ -0,0 +1,138 @@
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """
+    This class is used to cache values for a limited time with LRU eviction.
+    Entries older than ttl are stale, stale entries are still returned until
+    they are older than ttl + stale_ttl so callers can refresh them in the background.
+
+    Attributes:
+        maxsize (int): Maximum number of entries
+        ttl (float): Seconds an entry stays fresh
+        stale_ttl (float): Seconds a stale entry can still be served
+        hits (int): Number of lookups answered with a fresh entry
+        stale_hits (int): Number of lookups answered with a stale entry
+        misses (int): Number of lookups without a usable entry
+        evictions (int): Number of entries dropped to stay under maxsize
+        _data (OrderedDict[Hashable, tuple[float, V]]): Entries with the time they were stored, oldest used first
+
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float = 0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[tuple[V, bool]]:
+        """
+        This function is used to look up a key.
+
+        Args:
+            key (Hashable): Key to look up
+
+        Returns:
+            Optional[tuple[V, bool]]: Value and True if it is fresh, None if there is no usable entry
+
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored, value = entry
+        age = time.time() - stored
+        if age >= self.ttl + self.stale_ttl:
+            del self._data[key]  # too old to serve at all
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)  # mark as most recently used
+        if age < self.ttl:
+            self.hits += 1
+            return value, True
+        self.stale_hits += 1
+        return value, False
+
+    def peek(self, key: Hashable, max_age: Optional[float] = None) -> Optional[V]:
+        """
+        This function is used to get the last value of a key, regardless of its age unless max_age is set.
+        It does not change counters or LRU order.
+
+        Args:
+            key (Hashable): Key to look up
+            max_age (Optional[float]): Seconds after which the value is not returned, no limit if None
+
+        Returns:
+            Optional[V]: Last stored value, None if the key is not cached or too old
+
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if max_age is not None and time.time() - entry[0] >= max_age:
+            return None
+        return entry[1]
+
+    def stored_at(self, key: Hashable) -> Optional[float]:
+        """
+        This function is used to get the time the value of a key was observed.
+        It does not change counters or LRU order.
+
+        Args:
+            key (Hashable): Key to look up
+
+        Returns:
+            Optional[float]: Time in seconds since epoch, None if the key is not cached
+
+        """
+        entry = self._data.get(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key: Hashable, value: V, stored: Optional[float] = None) -> None:
+        """
+        This function is used to store a value.
+
+        Args:
+            key (Hashable): Key to store
+            value (V): Value to store
+            stored (Optional[float]): Time the value was observed, defaults to now
+
+        Returns:
+            None
+
+        """
+        self._data[key] = (time.time() if stored is None else stored, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)  # drop least recently used entry
+            self.evictions += 1
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """
+        This function is used to get the counters of the cache.
+
+        Returns:
+            dict[str, Any]: Size, hits, stale hits, misses and evictions
+
+        """
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
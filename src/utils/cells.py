@@ -0,0 +1,42 @@
+"""
+This file is responsible for mapping coordinates to geographic cells.
+Subscriptions in the same cell share a single weather reading.
+
+"""
+
+import os
+
+CELL_PRECISION = int(os.getenv("CELL_PRECISION", "1"))  # decimal places, 1 ~ 11 km
+
+
+def to_cell(lat: float, lon: float) -> str:
+    """
+    This function is used to get the cell a coordinate belongs to.
+
+    Args:
+        lat (float): Latitude of the location
+        lon (float): Longitude of the location
+
+    Returns:
+        str: Cell key in the form "<lat>:<lon>"
+
+    """
+    # adding 0.0 turns -0.0 into 0.0 so both map to the same cell
+    lat = round(lat, CELL_PRECISION) + 0.0
+    lon = round(lon, CELL_PRECISION) + 0.0
+    return f"{lat:.{CELL_PRECISION}f}:{lon:.{CELL_PRECISION}f}"
+
+
+def from_cell(cell: str) -> tuple[float, float]:
+    """
+    This function is used to get the coordinate a cell is fetched for.
+
+    Args:
+        cell (str): Cell key
+
+    Returns:
+        tuple[float, float]: Latitude and longitude of the cell
+
+    """
+    lat, lon = cell.split(":")
+    return float(lat), float(lon)
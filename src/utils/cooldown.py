@@ -1,19 +1,42 @@
+from __future__ import annotations
+
+import heapq
 import time
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:  # to avoid circular imports
+    from utils.storage import Storage
 
 
 class Cooldown:
     """
     This class is used to create cooldowns for the agent.
+    Keys are forgotten once their cooldown is over so memory stays bounded by the
+    number of keys used within one period. If a database is given, the cooldowns
+    can be persisted and loaded back after a restart.
 
     Attributes:
         per (int): Cooldown period
+        name (Optional[str]): Name the cooldowns are persisted under
+        database (Optional[Storage]): Database the cooldowns are persisted to
         _cooldown (dict[str, float]): Dictionary containing the key and the time when the key was last used
+        _expiries (list[tuple[float, str]]): Heap of the time every key stops waiting
+        _dirty (set[str]): Keys updated since the last persist
 
     """
 
-    def __init__(self, per: int) -> None:
+    def __init__(
+        self, per: int, name: Optional[str] = None, database: Optional[Storage] = None
+    ) -> None:
         self.per = per
+        self.name = name
+        self.database = database
         self._cooldown: dict[str, float] = {}
+        self._expiries: list[tuple[float, str]] = []
+        self._dirty: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._cooldown)
 
     def on_waiting(self, key: str) -> bool:
         """
@@ -27,19 +50,106 @@ class Cooldown:
 
         """
         current = time.time()  # get current time in seconds since epoch
+        self._expire(current)
         if current - self._cooldown.get(key, 0) < self.per:
             return True
         return False
 
-    def update(self, key: str) -> None:
+    def on_waiting_many(self, keys: Iterable[str]) -> list[bool]:
+        """
+        This function is used to check many keys at once, for example every user of a scan.
+
+        Args:
+            keys (Iterable[str]): Keys to check
+
+        Returns:
+            list[bool]: True for every key on cooldown, False otherwise
+
+        """
+        current = time.time()
+        self._expire(current)
+        cooldown = self._cooldown
+        return [current - cooldown.get(key, 0) < self.per for key in keys]
+
+    def last_used(self, key: str) -> float:
+        """
+        This function is used to get the time the key was last used.
+
+        Args:
+            key (str): Key to check
+
+        Returns:
+            float: Time in seconds since epoch, 0 if the key is not on cooldown
+
+        """
+        self._expire(time.time())
+        return self._cooldown.get(key, 0)
+
+    def update(self, key: str, used: Optional[float] = None) -> None:
         """
         This function is used to update the cooldown for the key.
 
         Args:
             key (str): Key to update
+            used (Optional[float]): Time the key was used, defaults to now
+
+        Returns:
+            None
+
+        """
+        used = time.time() if used is None else used
+        self._cooldown[key] = used
+        heapq.heappush(self._expiries, (used + self.per, key))
+        if self.database is not None:
+            self._dirty.add(key)
+
+    async def load(self):
+        """
+        This function is used to load the persisted cooldowns that are not over yet.
+
+        Returns:
+            None
+
+        """
+        if self.database is None or self.name is None:
+            return
+        for key, used in (await self.database.load_cooldowns(self.name)).items():
+            if used > self._cooldown.get(key, 0):
+                self._cooldown[key] = used
+                heapq.heappush(self._expiries, (used + self.per, key))
+        self._expire(time.time())
+
+    async def persist(self):
+        """
+        This function is used to write the cooldowns updated since the last call to the database.
+
+        Returns:
+            None
+
+        """
+        if self.database is None or self.name is None or not self._dirty:
+            return
+        entries = {
+            key: self._cooldown[key] for key in self._dirty if key in self._cooldown
+        }
+        self._dirty = set()
+        await self.database.save_cooldowns(self.name, entries, self.per)
+
+    def _expire(self, current: float) -> None:
+        """
+        This function is used to forget keys whose cooldown is over.
+
+        Args:
+            current (float): Current time in seconds since epoch
 
         Returns:
             None
 
         """
-        self._cooldown[key] = time.time()
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= current:
+            expiry, key = heapq.heappop(expiries)
+            # a key updated again has a newer entry further down the heap
+            if self._cooldown.get(key, 0) + self.per == expiry:
+                del self._cooldown[key]
+                self._dirty.discard(key)
@@ -1,51 +1,82 @@
 """
 This file is responsible for connecting to the database and performing CRUD operations on it.
-It also contains the Data class which is used to define the data stored in the database.
+The records it stores are defined in utils.models, shared with the other backends.
 
 """
 
 import asyncio
 import os
-from typing import Optional
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient  # motor is an async mongodb driver
 from odmantic.engine import AIOEngine
 from odmantic.field import Field
 from odmantic.model import Model
+from pymongo import DeleteMany, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 from messages import SendsTo
+from utils.cells import to_cell
+from utils.models import (
+    BATCH_RETENTION,
+    OUTBOX_RETENTION,
+    VIOLATION_QUERY_CELLS,
+    WRITE_BATCH_DELAY,
+    WRITE_BATCH_SIZE,
+    Data,
+    ScanRecord,
+    build_subscription,
+    subscription_key,
+)
+from utils.write_buffer import WriteBuffer
 
 # odmantic is a ODM (object document mapper) for pymongo,motor
 
 
 MONGODB_URL = os.getenv("MONGODB_URL")
-assert MONGODB_URL, "Please set the MONGODB_URL environment variable"
+SUBSCRIPTION_COLLECTION = "data"  # named after the Data model
+COOLDOWN_COLLECTION = "cooldowns"
+OUTBOX_COLLECTION = "outbox"
+MEMBER_COLLECTION = "members"
+LEASE_COLLECTION = "leases"
+REGISTRATION_COLLECTION = "registrations"
+BATCH_COLLECTION = "batches"
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "1000"))  # documents per cursor batch
 
 
-class Data(Model):
+class Geocode(Model):
     """
-    This class is used to define the data stored in the database.
+    This class is used to define a cached geocoding result.
 
     Attributes:
-        address (str): Address of the agent
-        email (Optional[str]): Email of the user
+        name (str): Normalized location name
         lat (float): Latitude of the location
         lon (float): Longitude of the location
-        location (str): Location
-        minimum_temperature (float): Minimum temperature
-        maximum_temperature (float): Maximum temperature
-        sends_to (list[SendsTo]): List of destinations where the user wants to receive the temperature alert
 
     """
 
-    address: str = Field(primary_field=True)
-    email: Optional[str] = Field(default=None)
+    name: str = Field(primary_field=True)
     lat: float
     lon: float
-    location: str
-    minimum_temperature: float
-    maximum_temperature: float
-    sends_to: list[SendsTo] = Field(default=[SendsTo.AGENT])
+
+
+def _document(data: Data) -> dict[str, Any]:
+    """
+    This function is used to get the document of a Data object, keyed by "_id".
+
+    Args:
+        data (Data): Data object of the user
+
+    Returns:
+        dict[str, Any]: Document of the user
+
+    """
+    document = data.dict(exclude={"key"})
+    document["_id"] = data.key
+    return document
 
 
 class Database:
@@ -55,12 +86,14 @@ class Database:
     Attributes:
         client (AsyncIOMotorClient): AsyncIOMotorClient object
         engine (AIOEngine): AIOEngine object
+        writes (WriteBuffer): Buffer batching user inserts and removes into bulk writes
         _started (bool): True if the database is connected, False otherwise
 
     """
 
     def __init__(self) -> None:
         self._started = False
+        self.writes = WriteBuffer(self._bulk_write, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY)
 
     async def connect(self):
         """
@@ -72,6 +105,7 @@ class Database:
         """
         if self._started:
             return  # do not proceed if database is already connected
+        assert MONGODB_URL, "Please set the MONGODB_URL environment variable"
 
         # connect to the database
         self.client = AsyncIOMotorClient(
@@ -82,6 +116,43 @@ class Database:
         )  # create engine
         self._started = True
 
+        collection = self.engine.database[SUBSCRIPTION_COLLECTION]
+        # users added before agents could subscribe to several locations were keyed by address
+        async for document in collection.find({"address": {"$exists": False}}):
+            address = document["_id"]
+            document["_id"] = subscription_key(address, document["location"])
+            document["address"] = address
+            await collection.replace_one({"_id": document["_id"]}, document, upsert=True)
+            await collection.delete_one({"_id": address})
+        await collection.create_index("address")
+        # backfill the cell of users added before cells were stored
+        async for document in collection.find(
+            {"cell": {"$exists": False}}, {"lat": 1, "lon": 1}
+        ):
+            await collection.update_one(
+                {"_id": document["_id"]},
+                {"$set": {"cell": to_cell(document["lat"], document["lon"])}},
+            )
+        # indexes used by find_violations, one per threshold direction
+        await collection.create_index([("cell", 1), ("minimum_temperature", 1)])
+        await collection.create_index([("cell", 1), ("maximum_temperature", 1)])
+        # mongodb deletes cooldowns on its own once expires_at has passed
+        await self.engine.database[COOLDOWN_COLLECTION].create_index(
+            "expires_at", expireAfterSeconds=0
+        )
+        outbox = self.engine.database[OUTBOX_COLLECTION]
+        await outbox.create_index([("status", 1), ("next_attempt", 1)])
+        await outbox.create_index("expires_at", expireAfterSeconds=0)
+        await self.engine.database[MEMBER_COLLECTION].create_index(
+            "expires_at", expireAfterSeconds=0
+        )
+        registrations = self.engine.database[REGISTRATION_COLLECTION]
+        await registrations.create_index("next_attempt")
+        await registrations.create_index("address")
+        batches = self.engine.database[BATCH_COLLECTION]
+        await batches.create_index("address")
+        await batches.create_index("expires_at", expireAfterSeconds=0)
+
     async def find_all(self):
         """
         This function is used to fetch all the users from the database.
@@ -91,8 +162,90 @@ class Database:
 
         """
         await self.connect()  # connect to the database
-        async for data in self.engine.find(Data):  # fetch all users from database
-            yield data
+        # fetch all users from database
+        async for document in self.engine.database[SUBSCRIPTION_COLLECTION].find():
+            yield Data(key=document.pop("_id"), **document)
+
+    async def find_records(self, query: Optional[dict[str, Any]] = None):
+        """
+        This function is used to fetch users as ScanRecord objects straight from the cursor.
+        Only the fields scans need are read and no model is validated, odmantic
+        models are kept for writes.
+
+        Args:
+            query (Optional[dict[str, Any]]): Filter of the users, all users if None
+
+        Yields:
+            ScanRecord: Record of a user
+
+        """
+        await self.connect()  # connect to the database
+        cursor = self.engine.database[SUBSCRIPTION_COLLECTION].find(
+            query or {},
+            ScanRecord.PROJECTION,
+            batch_size=SCAN_BATCH_SIZE,
+        )
+        async for document in cursor:
+            yield ScanRecord.from_document(document)
+
+    async def find_cells(self) -> list[str]:
+        """
+        This function is used to fetch the cells that have at least one user.
+
+        Returns:
+            list[str]: Distinct cells
+
+        """
+        await self.connect()  # connect to the database
+        return await self.engine.database[SUBSCRIPTION_COLLECTION].distinct("cell")
+
+    async def find_keys(self, keys: list[str]) -> set[str]:
+        """
+        This function is used to check which subscriptions still exist.
+
+        Args:
+            keys (list[str]): Keys of the subscriptions
+
+        Returns:
+            set[str]: Keys of the subscriptions still in the database
+
+        """
+        await self.connect()  # connect to the database
+        collection = self.engine.database[SUBSCRIPTION_COLLECTION]
+        return {
+            document["_id"]
+            async for document in collection.find({"_id": {"$in": keys}}, {"_id": 1})
+        }
+
+    async def find_violations(self, temperatures: dict[str, float]):
+        """
+        This function is used to fetch only the users whose thresholds are breached.
+        Every cell becomes two index range queries, one per threshold direction.
+        Users whose last alert is not over yet are fetched too, so they can go back in range.
+
+        Args:
+            temperatures (dict[str, float]): Current temperature of every cell
+
+        Yields:
+            ScanRecord: Record of a user whose location is out of range
+
+        """
+        await self.connect()  # connect to the database
+        cells = list(temperatures.items())
+        for start in range(0, len(cells), VIOLATION_QUERY_CELLS):
+            batch = cells[start : start + VIOLATION_QUERY_CELLS]
+            conditions = [
+                {"cell": {"$in": [cell for cell, _ in batch]}, "condition": {"$ne": None}}
+            ]
+            for cell, temperature in batch:
+                conditions.append(
+                    {"cell": cell, "minimum_temperature": {"$gt": temperature}}
+                )
+                conditions.append(
+                    {"cell": cell, "maximum_temperature": {"$lt": temperature}}
+                )
+            async for record in self.find_records({"$or": conditions}):
+                yield record
 
     async def insert(
         self,
@@ -119,27 +272,314 @@ class Database:
             email (Optional[str]): Email of the user
 
         Returns:
-            None
+            Data: Data object of the inserted user
+
+        """
+        data = build_subscription(
+            address, location, min_temp, max_temp, sends_to, email, lat, lon
+        )
+        # insert user into database, batched with other writes
+        await self.writes.submit(ReplaceOne({"_id": data.key}, _document(data), upsert=True))
+        return data
+
+    async def insert_pending(
+        self,
+        address: str,
+        location: str,
+        min_temp: float,
+        max_temp: float,
+        sends_to: list[SendsTo],
+        email: Optional[str] = None,
+    ) -> str:
+        """
+        This function is used to store a registration before it is geocoded and verified.
+        Registrations are kept apart from the subscriptions, so a subscription
+        registered again keeps working until the new registration is finished.
+
+        Args:
+            address (str): Address of the agent
+            location (str): Location
+            min_temp (float): Minimum temperature
+            max_temp (float): Maximum temperature
+            sends_to (list[SendsTo]): List of destinations where the user wants to receive the temperature alert
+            email (Optional[str]): Email of the user
+
+        Returns:
+            str: Key of the registration, the key of the subscription once finished
+
+        """
+        await self.connect()  # connect to the database
+        key = subscription_key(address, location)
+        await self.engine.database[REGISTRATION_COLLECTION].replace_one(
+            {"_id": key},
+            {
+                "address": address,
+                "location": location,
+                "min_temp": min_temp,
+                "max_temp": max_temp,
+                "sends_to": list(set(sends_to)),
+                "email": email,
+                "attempts": 0,
+                "next_attempt": time.time(),
+            },
+            upsert=True,
+        )
+        return key
+
+    async def insert_pending_many(
+        self,
+        address: str,
+        subscriptions: list[dict[str, Any]],
+        results: list[dict[str, Any]],
+    ) -> list[str]:
+        """
+        This function is used to store the registrations of a bulk request in one bulk write.
+        A batch keeps the outcome of every location of the request, so the reply
+        can be sent once the last registration is finished.
+
+        Args:
+            address (str): Address of the agent
+            subscriptions (list[dict[str, Any]]): Keyword arguments of insert_pending and index in the request of every registration
+            results (list[dict[str, Any]]): Location, type and message of every location of the request, type None while pending
+
+        Returns:
+            list[str]: Key of every registration
 
         """
-        sends_to = list(set(sends_to))  # remove duplicates from sends_to list
         await self.connect()  # connect to the database
-        await self.engine.save(
-            Data(
-                address=address,
-                email=email,
-                lat=lat,
-                lon=lon,
-                location=location,
-                minimum_temperature=min_temp,
-                maximum_temperature=max_temp,
-                sends_to=sends_to,
+        batch = uuid.uuid4().hex
+        await self.engine.database[BATCH_COLLECTION].insert_one(
+            {
+                "_id": batch,
+                "address": address,
+                "results": results,
+                "remaining": len(subscriptions),
+                "verified": [],
+                "expires_at": datetime.now(timezone.utc) + BATCH_RETENTION,
+            }
+        )
+        now = time.time()
+        keys = []
+        operations = []
+        for subscription in subscriptions:
+            key = subscription_key(address, subscription["location"])
+            keys.append(key)
+            operations.append(
+                ReplaceOne(
+                    {"_id": key},
+                    {
+                        "address": address,
+                        "location": subscription["location"],
+                        "min_temp": subscription["min_temp"],
+                        "max_temp": subscription["max_temp"],
+                        "sends_to": list(set(subscription["sends_to"])),
+                        "email": subscription.get("email"),
+                        "attempts": 0,
+                        "next_attempt": now,
+                        "batch": batch,
+                        "item": subscription["item"],
+                    },
+                    upsert=True,
+                )
+            )
+        if operations:
+            await self.engine.database[REGISTRATION_COLLECTION].bulk_write(
+                operations, ordered=False
             )
-        )  # insert user into database
+        return keys
+
+    async def find_due_registrations(self) -> list[str]:
+        """
+        This function is used to fetch the registrations that are due for an attempt.
+
+        Returns:
+            list[str]: Keys of the registrations
+
+        """
+        await self.connect()  # connect to the database
+        cursor = self.engine.database[REGISTRATION_COLLECTION].find(
+            {"next_attempt": {"$lte": time.time()}}, {"_id": 1}
+        )
+        return [document["_id"] async for document in cursor]
+
+    async def claim_registration(
+        self, key: str, lease: float
+    ) -> Optional[dict[str, Any]]:
+        """
+        This function is used to claim a due registration so only one worker finishes it.
+        Registrations whose lease ran out are claimed again, their worker is assumed dead.
+
+        Args:
+            key (str): Key of the registration
+            lease (float): Seconds the registration is hidden from other workers
+
+        Returns:
+            Optional[dict[str, Any]]: Claimed registration, None if it is not due or gone
+
+        """
+        await self.connect()  # connect to the database
+        now = time.time()
+        return await self.engine.database[
+            REGISTRATION_COLLECTION
+        ].find_one_and_update(
+            {"_id": key, "next_attempt": {"$lte": now}},
+            {"$set": {"next_attempt": now + lease}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def activate(self, key: str, lat: float, lon: float) -> Optional[ScanRecord]:
+        """
+        This function is used to turn a registration into a subscription so scans pick it up.
+        An existing subscription with the same key is replaced.
+
+        Args:
+            key (str): Key of the registration
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            Optional[ScanRecord]: Record of the subscription, None if the registration was removed meanwhile
+
+        """
+        await self.connect()  # connect to the database
+        registrations = self.engine.database[REGISTRATION_COLLECTION]
+        registration = await registrations.find_one({"_id": key})
+        if registration is None:
+            return None
+        data = build_subscription(
+            registration["address"],
+            registration["location"],
+            registration["min_temp"],
+            registration["max_temp"],
+            registration["sends_to"],
+            registration.get("email"),
+            lat,
+            lon,
+        )
+        await self.writes.submit(ReplaceOne({"_id": data.key}, _document(data), upsert=True))
+        # a registration sent again meanwhile has a new next_attempt and is kept
+        await registrations.delete_one(
+            {"_id": key, "next_attempt": registration["next_attempt"]}
+        )
+        return ScanRecord.from_data(data)
+
+    async def retry_registration(
+        self, key: str, attempts: int, next_attempt: float, error: str
+    ):
+        """
+        This function is used to schedule another attempt of a registration.
+
+        Args:
+            key (str): Key of the registration
+            attempts (int): Number of failed attempts
+            next_attempt (float): Time of the next attempt in seconds since epoch
+            error (str): Error of the last attempt
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[REGISTRATION_COLLECTION].update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "attempts": attempts,
+                    "next_attempt": next_attempt,
+                    "error": error,
+                }
+            },
+        )
+
+    async def remove_registration(self, key: str):
+        """
+        This function is used to drop a registration that can not be finished.
+        The subscription with the same key, if any, is kept.
+
+        Args:
+            key (str): Key of the registration
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[REGISTRATION_COLLECTION].delete_one({"_id": key})
+
+    async def claim_batch_email(self, batch: str, email: str) -> bool:
+        """
+        This function is used to claim the verification of an email for a bulk request.
+        The locations of a request that share an email send one verification email.
+
+        Args:
+            batch (str): Id of the batch
+            email (str): Email of the user
+
+        Returns:
+            bool: True if the email is not verified for the batch yet, False otherwise
+
+        """
+        await self.connect()  # connect to the database
+        result = await self.engine.database[BATCH_COLLECTION].update_one(
+            {"_id": batch, "verified": {"$ne": email}}, {"$push": {"verified": email}}
+        )
+        return result.modified_count == 1
+
+    async def release_batch_email(self, batch: str, email: str):
+        """
+        This function is used to give up the verification of an email that could not be sent.
+
+        Args:
+            batch (str): Id of the batch
+            email (str): Email of the user
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[BATCH_COLLECTION].update_one(
+            {"_id": batch}, {"$pull": {"verified": email}}
+        )
+
+    async def finish_batch_item(
+        self, batch: str, item: int, type: str, message: str
+    ) -> Optional[dict[str, Any]]:
+        """
+        This function is used to store the outcome of one location of a bulk request.
+        An outcome already stored is kept, so a registration finished twice counts once.
+
+        Args:
+            batch (str): Id of the batch
+            item (int): Index of the location in the request
+            type (str): UAgentResponseType value of the outcome
+            message (str): Message of the outcome
+
+        Returns:
+            Optional[dict[str, Any]]: Finished batch with its address and results, None while locations are pending
+
+        """
+        await self.connect()  # connect to the database
+        batches = self.engine.database[BATCH_COLLECTION]
+        document = await batches.find_one_and_update(
+            {"_id": batch, f"results.{item}.type": None},
+            {
+                "$set": {
+                    f"results.{item}.type": type,
+                    f"results.{item}.message": message,
+                },
+                "$inc": {"remaining": -1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if document is None or document["remaining"] > 0:
+            return None
+        await batches.delete_one({"_id": batch})
+        return document
 
     async def remove(self, address: str):
         """
-        This function is used to remove a user from the database.
+        This function is used to remove every subscription, registration and bulk request of a user from the database.
 
         Args:
             address (str): Address of the agent
@@ -148,6 +588,390 @@ class Database:
             None
 
         """
+        # remove user from database, batched with other writes
+        await self.writes.submit(DeleteMany({"address": address}))
         await self.connect()  # connect to the database
-        await self.engine.database[Data.__collection__].delete_one({"_id": address})
-        # remove user from database
+        await self.engine.database[REGISTRATION_COLLECTION].delete_many(
+            {"address": address}
+        )
+        await self.engine.database[BATCH_COLLECTION].delete_many({"address": address})
+
+    async def flush(self):
+        """
+        This function is used to write every buffered insert and remove.
+
+        Returns:
+            None
+
+        """
+        await self.writes.close()
+
+    async def _bulk_write(self, operations: list[Any]):
+        """
+        This function is used to write a batch of user inserts and removes in one round trip.
+        The batch is ordered so a remove after an insert of the same user stays last.
+
+        Args:
+            operations (list[Any]): ReplaceOne and DeleteMany operations
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[SUBSCRIPTION_COLLECTION].bulk_write(
+            operations, ordered=True
+        )
+
+    async def save_alert_states(
+        self, states: dict[str, tuple[Optional[str], Optional[float], int]]
+    ):
+        """
+        This function is used to persist the alert state of many subscriptions in one bulk write.
+        Subscriptions removed meanwhile are not created again.
+
+        Args:
+            states (dict[str, tuple[Optional[str], Optional[float], int]]): Condition, alerted temperature and alert count, keyed by subscription key
+
+        Returns:
+            None
+
+        """
+        if not states:
+            return
+        await self.connect()  # connect to the database
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$set": {
+                        "condition": condition,
+                        "alerted_temperature": temperature,
+                        "alert_count": count,
+                    }
+                },
+            )
+            for key, (condition, temperature, count) in states.items()
+        ]
+        await self.engine.database[SUBSCRIPTION_COLLECTION].bulk_write(
+            operations, ordered=False
+        )
+
+    async def find_geocode(self, name: str) -> Optional[tuple[float, float]]:
+        """
+        This function is used to fetch a cached geocoding result.
+
+        Args:
+            name (str): Normalized location name
+
+        Returns:
+            Optional[tuple[float, float]]: Latitude and longitude, None if not cached
+
+        """
+        await self.connect()  # connect to the database
+        geocode = await self.engine.find_one(Geocode, Geocode.name == name)
+        if geocode is None:
+            return None
+        return geocode.lat, geocode.lon
+
+    async def save_geocode(self, name: str, lat: float, lon: float):
+        """
+        This function is used to cache a geocoding result.
+
+        Args:
+            name (str): Normalized location name
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.save(Geocode(name=name, lat=lat, lon=lon))
+
+    async def load_cooldowns(self, name: str) -> dict[str, float]:
+        """
+        This function is used to fetch the persisted cooldowns that are not over yet.
+
+        Args:
+            name (str): Name of the cooldown
+
+        Returns:
+            dict[str, float]: Time every key was last used
+
+        """
+        await self.connect()  # connect to the database
+        cursor = self.engine.database[COOLDOWN_COLLECTION].find(
+            {"name": name, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"key": 1, "used": 1},
+        )
+        return {document["key"]: document["used"] async for document in cursor}
+
+    async def save_cooldowns(self, name: str, entries: dict[str, float], per: float):
+        """
+        This function is used to persist cooldowns in one bulk write.
+
+        Args:
+            name (str): Name of the cooldown
+            entries (dict[str, float]): Time every key was last used
+            per (float): Cooldown period, used to set when the entries expire
+
+        Returns:
+            None
+
+        """
+        if not entries:
+            return
+        await self.connect()  # connect to the database
+        operations = [
+            UpdateOne(
+                {"_id": f"{name}:{key}"},
+                {
+                    "$set": {
+                        "name": name,
+                        "key": key,
+                        "used": used,
+                        "expires_at": datetime.fromtimestamp(used + per, timezone.utc),
+                    }
+                },
+                upsert=True,
+            )
+            for key, used in entries.items()
+        ]
+        await self.engine.database[COOLDOWN_COLLECTION].bulk_write(
+            operations, ordered=False
+        )
+
+    async def enqueue_outbox(self, key: str, payload: dict[str, Any]):
+        """
+        This function is used to queue an outbox message unless its key was already queued.
+
+        Args:
+            key (str): Idempotency key of the message
+            payload (dict[str, Any]): Payload of the message
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[OUTBOX_COLLECTION].update_one(
+            {"_id": key},
+            {
+                "$setOnInsert": {
+                    "payload": payload,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt": time.time(),
+                }
+            },
+            upsert=True,
+        )
+
+    async def claim_outbox(self, lease: float) -> Optional[dict[str, Any]]:
+        """
+        This function is used to claim the next due outbox message.
+        Messages whose lease ran out are claimed again, their worker is assumed dead.
+
+        Args:
+            lease (float): Seconds the message is hidden from other workers
+
+        Returns:
+            Optional[dict[str, Any]]: Claimed message, None if nothing is due
+
+        """
+        await self.connect()  # connect to the database
+        now = time.time()
+        return await self.engine.database[OUTBOX_COLLECTION].find_one_and_update(
+            {
+                "status": {"$in": ["pending", "processing"]},
+                "next_attempt": {"$lte": now},
+            },
+            {"$set": {"status": "processing", "next_attempt": now + lease}},
+            sort=[("next_attempt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def complete_outbox(self, key: str):
+        """
+        This function is used to mark an outbox message as delivered.
+
+        Args:
+            key (str): Idempotency key of the message
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[OUTBOX_COLLECTION].update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "status": "done",
+                    "expires_at": datetime.now(timezone.utc) + OUTBOX_RETENTION,
+                },
+                "$unset": {"payload": ""},
+            },
+        )
+
+    async def retry_outbox(
+        self, key: str, attempts: int, next_attempt: float, error: str
+    ):
+        """
+        This function is used to schedule another attempt of an outbox message.
+
+        Args:
+            key (str): Idempotency key of the message
+            attempts (int): Number of failed attempts
+            next_attempt (float): Time of the next attempt in seconds since epoch
+            error (str): Error of the last attempt
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[OUTBOX_COLLECTION].update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "status": "pending",
+                    "attempts": attempts,
+                    "next_attempt": next_attempt,
+                    "error": error,
+                }
+            },
+        )
+
+    async def dead_letter_outbox(self, key: str, attempts: int, error: str):
+        """
+        This function is used to give up on an outbox message.
+        The message stays in the collection with status "dead" for inspection.
+
+        Args:
+            key (str): Idempotency key of the message
+            attempts (int): Number of failed attempts
+            error (str): Error of the last attempt
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[OUTBOX_COLLECTION].update_one(
+            {"_id": key},
+            {"$set": {"status": "dead", "attempts": attempts, "error": error}},
+        )
+
+    async def renew_member(self, instance_id: str, lease: float):
+        """
+        This function is used to renew the lease of an agent instance.
+
+        Args:
+            instance_id (str): Id of the instance
+            lease (float): Seconds the lease is valid for
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease)
+        await self.engine.database[MEMBER_COLLECTION].update_one(
+            {"_id": instance_id}, {"$set": {"expires_at": expires_at}}, upsert=True
+        )
+
+    async def find_members(self) -> list[str]:
+        """
+        This function is used to fetch the agent instances whose lease is valid.
+
+        Returns:
+            list[str]: Ids of the live instances
+
+        """
+        await self.connect()  # connect to the database
+        # the ttl monitor only runs every minute, so filter expired leases too
+        cursor = self.engine.database[MEMBER_COLLECTION].find(
+            {"expires_at": {"$gt": datetime.now(timezone.utc)}}, {"_id": 1}
+        )
+        return [document["_id"] async for document in cursor]
+
+    async def remove_member(self, instance_id: str):
+        """
+        This function is used to drop the lease of an agent instance.
+
+        Args:
+            instance_id (str): Id of the instance
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[MEMBER_COLLECTION].delete_one({"_id": instance_id})
+
+    async def acquire_lease(
+        self, name: str, holder: str, lease: float
+    ) -> Optional[dict[str, Any]]:
+        """
+        This function is used to take or renew a named lease.
+        The lease is taken if it is free, expired or already held by the holder.
+
+        Args:
+            name (str): Name of the lease
+            holder (str): Id of the process taking the lease
+            lease (float): Seconds the lease is valid for
+
+        Returns:
+            Optional[dict[str, Any]]: Lease document with the last checkpoint, None if another process holds it
+
+        """
+        await self.connect()  # connect to the database
+        now = datetime.now(timezone.utc)
+        try:
+            return await self.engine.database[LEASE_COLLECTION].find_one_and_update(
+                {"_id": name, "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"holder": holder, "expires_at": now + timedelta(seconds=lease)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:  # the lease exists and is held by another process
+            return None
+
+    async def save_checkpoint(self, name: str, holder: str, remaining: list[str]):
+        """
+        This function is used to store the progress of the holder of a lease.
+
+        Args:
+            name (str): Name of the lease
+            holder (str): Id of the process holding the lease
+            remaining (list[str]): Items still to be processed
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[LEASE_COLLECTION].update_one(
+            {"_id": name, "holder": holder}, {"$set": {"remaining": remaining}}
+        )
+
+    async def release_lease(self, name: str, holder: str):
+        """
+        This function is used to give up a lease, keeping its checkpoint.
+
+        Args:
+            name (str): Name of the lease
+            holder (str): Id of the process holding the lease
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self.engine.database[LEASE_COLLECTION].update_one(
+            {"_id": name, "holder": holder},
+            {"$set": {"expires_at": datetime.now(timezone.utc)}},
+        )
@@ -0,0 +1,101 @@
+"""
+This file is responsible for grouping the alerts of a scan per receiver.
+Every email address gets one email and every agent gets one message per scan,
+however many of their locations are out of range.
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+from messages import SendsTo, TemperatureCondition, TemperatureWarn
+
+if TYPE_CHECKING:  # to avoid useless imports
+    from utils.models import ScanRecord
+
+SUBJECT = "TEMPERATURE ALERT !"
+SEPARATOR = "\n" + "-" * 40 + "\n\n"
+
+
+class Digest:
+    """
+    This class is used to collect the alerts of a scan grouped by receiver.
+
+    Attributes:
+        emails (defaultdict[str, list[tuple[str, str]]]): Id and alert body of every alert, keyed by email
+        keys (defaultdict[str, list[str]]): Subscription key of every alert, keyed by email
+        warnings (defaultdict[str, list[TemperatureWarn]]): Warnings keyed by agent address
+
+    """
+
+    def __init__(self) -> None:
+        self.emails: defaultdict[str, list[tuple[str, str]]] = defaultdict(list)
+        self.keys: defaultdict[str, list[str]] = defaultdict(list)
+        self.warnings: defaultdict[str, list[TemperatureWarn]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self.emails) + len(self.warnings)
+
+    def add(
+        self,
+        data: ScanRecord,
+        temperature: float,
+        condition: TemperatureCondition,
+        body: str,
+        alert_count: int,
+    ) -> None:
+        """
+        This function is used to add an alert to the digest of its receivers.
+
+        Args:
+            data (ScanRecord): Record of the user
+            temperature (float): Current temperature of the user's location
+            condition (TemperatureCondition): Temperature condition
+            body (str): Body of the alert email
+            alert_count (int): Number of alerts of the subscription, this one included
+
+        Returns:
+            None
+
+        """
+        if (SendsTo.EMAIL in data.sends_to) and data.email:
+            # check if user wants to receive email alerts
+            # the count makes every alert a new digest, a replay of the same alert is not
+            alert = f"{data.key}:{condition.value}:{alert_count}"
+            self.emails[data.email].append((alert, body))
+            self.keys[data.email].append(data.key)
+        if SendsTo.AGENT in data.sends_to:
+            # check if user wants to receive agent alerts
+            self.warnings[data.address].append(
+                TemperatureWarn(
+                    location=data.location,
+                    temperature=temperature,
+                    condition=condition,
+                    minimum_temperature=data.minimum_temperature,
+                    maximum_temperature=data.maximum_temperature,
+                )
+            )
+
+
+def render_email(alerts: list[tuple[str, str]]) -> tuple[str, str, str]:
+    """
+    This function is used to render the digest email of one receiver.
+
+    Args:
+        alerts (list[tuple[str, str]]): Id and alert body of every alert
+
+    Returns:
+        tuple[str, str, str]: Subject, body and a key identifying the set of alerts
+
+    """
+    subject = SUBJECT
+    if len(alerts) > 1:
+        subject = f"{SUBJECT} ({len(alerts)} locations)"
+    body = SEPARATOR.join(body for _, body in alerts)
+    # same alerts give the same key, so a replayed digest is queued once
+    keys = "\n".join(sorted(key for key, _ in alerts))
+    key = hashlib.sha1(keys.encode()).hexdigest()
+    return subject, body, key
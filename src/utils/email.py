@@ -1,6 +1,8 @@
+import asyncio
 import os
 import re
 from email.message import EmailMessage  # Python's email module
+from typing import Optional
 
 import aiosmtplib  # Async SMTP client
 
@@ -11,6 +13,99 @@ EMAIL_SENDER = os.getenv("EMAIL_SENDER")
 PASSWORD = os.getenv("EMAIL_PASSWORD")
 assert EMAIL_SENDER, "EMAIL_SENDER environment variable not set"
 assert PASSWORD, "EMAIL_PASSWORD environment variable not set"
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "3"))  # long-lived smtp sessions
+
+# errors after which a session is thrown away and the message is retried on a new one
+RECONNECT_ERRORS = (
+    aiosmtplib.SMTPServerDisconnected,
+    aiosmtplib.SMTPConnectError,
+    aiosmtplib.SMTPTimeoutError,
+    ConnectionError,
+)
+
+
+class SMTPPool:
+    """
+    This class is used to reuse a few authenticated smtp sessions for every email.
+    Sessions are opened lazily, at most size of them are in use at the same time.
+
+    Attributes:
+        size (int): Maximum number of sessions
+        hostname (str): Hostname of the smtp server
+        port (int): Port of the smtp server
+        _idle (list[aiosmtplib.SMTP]): Connected sessions not in use
+        _semaphore (Optional[asyncio.Semaphore]): Limits the sessions in use, created on first use
+
+    """
+
+    def __init__(self, size: int, hostname: str = "smtp.gmail.com", port: int = 465):
+        self.size = size
+        self.hostname = hostname
+        self.port = port
+        self._idle: list[aiosmtplib.SMTP] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def send(self, message: EmailMessage):
+        """
+        This function is used to send a message on a pooled session.
+        If the session was dropped by the server, the message is retried once on a new session.
+
+        Args:
+            message (EmailMessage): Message to send
+
+        Returns:
+            None
+
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+
+        async with self._semaphore:
+            client = self._idle.pop() if self._idle else await self._connect()
+            try:
+                try:
+                    if not client.is_connected:
+                        raise aiosmtplib.SMTPServerDisconnected("Session closed")
+                    await client.send_message(message)
+                except RECONNECT_ERRORS:
+                    client.close()
+                    client = await self._connect()
+                    await client.send_message(message)
+            except Exception:
+                client.close()  # do not return a broken session to the pool
+                raise
+            self._idle.append(client)
+
+    async def close(self):
+        """
+        This function is used to close every idle session.
+
+        Returns:
+            None
+
+        """
+        while self._idle:
+            client = self._idle.pop()
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        """
+        This function is used to open and authenticate a new session.
+
+        Returns:
+            aiosmtplib.SMTP: Connected session
+
+        """
+        client = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, use_tls=True)
+        await client.connect()
+        await client.login(EMAIL_SENDER, PASSWORD)
+        return client
+
+
+smtp_pool = SMTPPool(SMTP_POOL_SIZE)  # shared by send_email and send_verifaction
 
 
 def verify_regex(email: str):
@@ -55,7 +150,7 @@ async def send_verifaction(email: str):
 
 async def send_email(send_to: str, subject: str, body: str):
     """
-    This function is used to send an email.
+    This function is used to send an email on the shared smtp pool.
 
     Args:
         send_to (str): Email address of the receiver
@@ -72,12 +167,4 @@ async def send_email(send_to: str, subject: str, body: str):
     message["Subject"] = subject
     message.set_content(body)
 
-    # send email
-    await aiosmtplib.send(
-        message=message,
-        hostname="smtp.gmail.com",
-        port=465,
-        username=EMAIL_SENDER,
-        password=PASSWORD,
-        use_tls=True,
-    )
+    await smtp_pool.send(message)  # send email
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+import unicodedata
+from typing import TYPE_CHECKING, Optional
+
+from utils.cache import TTLCache
+
+if TYPE_CHECKING:  # to avoid circular imports
+    from utils.storage import Storage
+
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "50000"))
+GEOCODE_CACHE_TTL = 30 * 24 * 60 * 60  # locations do not move, keep them for a month
+
+
+def normalize_location(location: str) -> str:
+    """
+    This function is used to normalize a location name so spellings of the same place share a key.
+    Case, surrounding and repeated whitespace and accents are ignored.
+
+    Args:
+        location (str): Location name
+
+    Returns:
+        str: Normalized location name
+
+    """
+    decomposed = unicodedata.normalize("NFKD", location)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+class GeocodeCache:
+    """
+    This class is used to cache geocoding results in memory and in the database.
+
+    Attributes:
+        database (Storage): Database the results are persisted to
+        _memory (TTLCache[tuple[float, float]]): In-memory tier keyed by normalized location
+
+    """
+
+    def __init__(self, database: Storage) -> None:
+        self.database = database
+        self._memory: TTLCache[tuple[float, float]] = TTLCache(
+            GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL
+        )
+
+    async def get(self, location: str) -> Optional[tuple[float, float]]:
+        """
+        This function is used to look up the coordinates of a location.
+
+        Args:
+            location (str): Location name
+
+        Returns:
+            Optional[tuple[float, float]]: Latitude and longitude, None if not cached
+
+        """
+        key = normalize_location(location)
+        cached = self._memory.get(key)
+        if cached is not None:
+            return cached[0]
+
+        coordinates = await self.database.find_geocode(key)
+        if coordinates is not None:
+            self._memory.set(key, coordinates)  # promote to the memory tier
+        return coordinates
+
+    async def set(self, location: str, lat: float, lon: float):
+        """
+        This function is used to store the coordinates of a location.
+
+        Args:
+            location (str): Location name
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            None
+
+        """
+        key = normalize_location(location)
+        self._memory.set(key, (lat, lon))
+        await self.database.save_geocode(key, lat, lon)
+
+    @property
+    def stats(self):
+        """
+        This function is used to get the counters of the memory tier.
+
+        Returns:
+            dict[str, Any]: Size, hits, stale hits, misses and evictions
+
+        """
+        return self._memory.stats
@@ -0,0 +1,257 @@
+"""
+This file is responsible for keeping the recent readings of every cell on disk.
+Every cell gets a fixed size ring buffer, a row of a memory-mapped NumPy array,
+so appending is a single write and the history survives restarts without a database.
+
+Files in the history directory:
+    cells.txt: One cell per line, the line number is the row of the cell
+    readings-<capacity>.dat: Ring buffers, capacity readings per row
+    counts-<capacity>.dat: Number of readings ever appended to every row
+
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY", "1024"))  # readings kept per cell
+INITIAL_ROWS = 1024
+READING = np.dtype([("time", "<f8"), ("temperature", "<f4")])
+
+
+class HistoryStore:
+    """
+    This class is used to store the readings of every cell in ring buffers mapped to disk.
+    Readings of a cell are appended in time order, older readings are overwritten
+    once the buffer of the cell is full.
+
+    Attributes:
+        directory (str): Directory of the history files
+        capacity (int): Readings kept per cell
+        readings (Optional[np.memmap]): Ring buffer of every row, created on open
+        counts (Optional[np.memmap]): Readings appended to every row, created on open
+        _rows (dict[str, int]): Row of every cell
+        _index (Optional[TextIO]): cells.txt opened for appending
+
+    """
+
+    def __init__(
+        self, directory: str = HISTORY_DIR, capacity: int = HISTORY_CAPACITY
+    ) -> None:
+        self.directory = directory
+        self.capacity = capacity
+        self.readings = None
+        self.counts = None
+        self._rows: dict[str, int] = {}
+        self._index = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def opened(self) -> bool:
+        """
+        This function is used to check if the history files are open.
+
+        Returns:
+            bool: True if readings can be appended, False otherwise
+
+        """
+        return self.readings is not None
+
+    @property
+    def cells(self) -> list[str]:
+        """
+        This function is used to get the cells that have a history.
+
+        Returns:
+            list[str]: Cells with at least one reading
+
+        """
+        return list(self._rows)
+
+    def open(self):
+        """
+        This function is used to open the history files, creating them if needed.
+
+        Returns:
+            None
+
+        """
+        if self.readings is not None:
+            return  # do not proceed if already open
+        os.makedirs(self.directory, exist_ok=True)
+
+        index = os.path.join(self.directory, "cells.txt")
+        if os.path.exists(index):
+            with open(index, encoding="utf-8") as file:
+                for row, cell in enumerate(file.read().splitlines()):
+                    self._rows[cell] = row
+        self._index = open(index, "a", encoding="utf-8")
+
+        rows = INITIAL_ROWS
+        counts = os.path.join(self.directory, f"counts-{self.capacity}.dat")
+        if os.path.exists(counts):
+            rows = max(rows, os.path.getsize(counts) // 8)
+        while rows < len(self._rows):
+            rows *= 2
+        self._map(rows)
+
+    def close(self):
+        """
+        This function is used to write every reading to disk and close the files.
+
+        Returns:
+            None
+
+        """
+        if self.readings is None:
+            return
+        self.flush()
+        self._index.close()
+        self.readings = self.counts = self._index = None
+
+    def flush(self):
+        """
+        This function is used to write the readings changed in memory to disk.
+
+        Returns:
+            None
+
+        """
+        if self.readings is not None:
+            self.readings.flush()
+            self.counts.flush()
+
+    def append(self, cell: str, time: float, temperature: float) -> bool:
+        """
+        This function is used to add a reading to the ring buffer of a cell.
+
+        Args:
+            cell (str): Cell of the reading
+            time (float): Time of the reading in seconds since epoch
+            temperature (float): Temperature of the reading
+
+        Returns:
+            bool: False if the reading is not newer than the last one of the cell
+
+        """
+        row = self._rows.get(cell)
+        if row is None:
+            row = self._add_cell(cell)
+        count = int(self.counts[row])
+        if count and self.readings[row, (count - 1) % self.capacity]["time"] >= time:
+            return False  # same reading served again from the cache
+        self.readings[row, count % self.capacity] = (time, temperature)
+        self.counts[row] = count + 1  # only count the reading once it is written
+        return True
+
+    def read(
+        self, cell: str, start: Optional[float] = None, end: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        This function is used to get the readings of a cell within a time range.
+
+        Args:
+            cell (str): Cell to read
+            start (Optional[float]): Oldest time to include, from the first reading if None
+            end (Optional[float]): Newest time to include, up to the last reading if None
+
+        Returns:
+            np.ndarray: Readings with time and temperature fields, oldest first
+
+        """
+        row = self._rows.get(cell)
+        if row is None:
+            return np.empty(0, dtype=READING)
+        count = int(self.counts[row])
+        buffer = self.readings[row]
+        if count <= self.capacity:
+            readings = np.array(buffer[:count])
+        else:  # the oldest reading is right after the newest one
+            head = count % self.capacity
+            readings = np.concatenate((buffer[head:], buffer[:head]))
+
+        times = readings["time"]  # sorted, so the range is two binary searches
+        first = 0 if start is None else np.searchsorted(times, start, side="left")
+        last = len(times) if end is None else np.searchsorted(times, end, side="right")
+        return readings[first:last]
+
+    def latest(self, cell: str) -> Optional[tuple[float, float]]:
+        """
+        This function is used to get the last reading of a cell.
+
+        Args:
+            cell (str): Cell to read
+
+        Returns:
+            Optional[tuple[float, float]]: Time and temperature, None if the cell has no reading
+
+        """
+        row = self._rows.get(cell)
+        if row is None or not self.counts[row]:
+            return None
+        reading = self.readings[row, (int(self.counts[row]) - 1) % self.capacity]
+        return float(reading["time"]), float(reading["temperature"])
+
+    def _add_cell(self, cell: str) -> int:
+        """
+        This function is used to give a cell the next free row.
+
+        Args:
+            cell (str): Cell to add
+
+        Returns:
+            int: Row of the cell
+
+        """
+        row = len(self._rows)
+        if row == len(self.counts):
+            self.flush()
+            self._map(row * 2)  # the files only grow at the end, rows stay in place
+        self._rows[cell] = row
+        self._index.write(cell + "\n")
+        self._index.flush()
+        return row
+
+    def _map(self, rows: int):
+        """
+        This function is used to map the history files with room for a number of rows.
+
+        Args:
+            rows (int): Number of rows
+
+        Returns:
+            None
+
+        """
+        # a different capacity starts new ring buffers instead of misreading the old ones
+        readings = os.path.join(self.directory, f"readings-{self.capacity}.dat")
+        self.readings = _memmap(readings, READING, (rows, self.capacity))
+        self.counts = _memmap(
+            os.path.join(self.directory, f"counts-{self.capacity}.dat"),
+            np.dtype("<i8"),
+            (rows,),
+        )
+
+
+def _memmap(path: str, dtype: np.dtype, shape: tuple[int, ...]) -> np.memmap:
+    """
+    This function is used to map a file, extending it with zeros to the given shape.
+
+    Args:
+        path (str): Path of the file
+        dtype (np.dtype): Type of the elements
+        shape (tuple[int, ...]): Shape of the array
+
+    Returns:
+        np.memmap: Array backed by the file
+
+    """
+    size = int(np.prod(shape)) * dtype.itemsize
+    with open(path, "ab") as file:
+        if file.tell() < size:
+            file.truncate(size)
+    return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
@@ -0,0 +1,242 @@
+"""
+This file is responsible for the records shared by every storage backend.
+It holds the subscription models and the storage settings, without depending
+on the driver of any backend.
+
+"""
+
+import os
+from datetime import timedelta
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+
+from messages import SendsTo
+from utils.cells import to_cell
+from utils.geocode import normalize_location
+
+VIOLATION_QUERY_CELLS = 500  # cells per find_violations query
+OUTBOX_RETENTION = timedelta(days=1)  # delivered messages are kept to dedupe keys
+BATCH_RETENTION = timedelta(days=1)  # bulk requests not finished by then get no reply
+# inserts and removes are flushed in bulk at this size or after this delay
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.05"))
+
+
+def subscription_key(address: str, location: str) -> str:
+    """
+    This function is used to get the key of the subscription of an agent to a location.
+
+    Args:
+        address (str): Address of the agent
+        location (str): Location
+
+    Returns:
+        str: Key of the subscription
+
+    """
+    return f"{address}:{normalize_location(location)}"
+
+
+class Data(BaseModel):
+    """
+    This class is used to define the data stored in the database.
+    An agent has one Data object per subscribed location.
+
+    Attributes:
+        key (str): Key of the subscription, see subscription_key
+        address (str): Address of the agent
+        email (Optional[str]): Email of the user
+        lat (float): Latitude of the location
+        lon (float): Longitude of the location
+        location (str): Location
+        cell (str): Cell the location belongs to
+        minimum_temperature (float): Minimum temperature
+        maximum_temperature (float): Maximum temperature
+        sends_to (list[SendsTo]): List of destinations where the user wants to receive the temperature alert
+        condition (Optional[str]): TemperatureCondition value of the last alert, None while in range
+        alerted_temperature (Optional[float]): Temperature of the last alert, None while in range
+        alert_count (int): Number of alerts sent, tells an alert apart from a replay of it
+
+    """
+
+    key: str
+    address: str
+    email: Optional[str] = Field(default=None)
+    lat: float
+    lon: float
+    location: str
+    cell: str = Field(default="")
+    minimum_temperature: float
+    maximum_temperature: float
+    sends_to: list[SendsTo] = Field(default=[SendsTo.AGENT])
+    condition: Optional[str] = Field(default=None)
+    alerted_temperature: Optional[float] = Field(default=None)
+    alert_count: int = Field(default=0)
+
+
+def build_subscription(
+    address: str,
+    location: str,
+    min_temp: float,
+    max_temp: float,
+    sends_to: list[SendsTo],
+    email: Optional[str] = None,
+    lat: float = 0,
+    lon: float = 0,
+) -> Data:
+    """
+    This function is used to build the Data object of a new subscription.
+
+    Args:
+        address (str): Address of the agent
+        location (str): Location
+        min_temp (float): Minimum temperature
+        max_temp (float): Maximum temperature
+        sends_to (list[SendsTo]): List of destinations where the user wants to receive the temperature alert
+        email (Optional[str]): Email of the user
+        lat (float): Latitude of the location
+        lon (float): Longitude of the location
+
+    Returns:
+        Data: Data object of the subscription
+
+    """
+    return Data(
+        key=subscription_key(address, location),
+        address=address,
+        email=email,
+        lat=lat,
+        lon=lon,
+        location=location,
+        cell=to_cell(lat, lon),
+        minimum_temperature=min_temp,
+        maximum_temperature=max_temp,
+        sends_to=list(set(sends_to)),  # remove duplicates from sends_to list
+    )
+
+
+class ScanRecord:
+    """
+    This class is used to hold the fields of a user that scans need, without model validation.
+
+    Attributes:
+        key (str): Key of the subscription
+        address (str): Address of the agent
+        email (Optional[str]): Email of the user
+        location (str): Location
+        cell (str): Cell the location belongs to
+        minimum_temperature (float): Minimum temperature
+        maximum_temperature (float): Maximum temperature
+        sends_to (list[str]): List of destinations where the user wants to receive the temperature alert
+        condition (Optional[str]): TemperatureCondition value of the last alert, None while in range
+        alerted_temperature (Optional[float]): Temperature of the last alert, None while in range
+        alert_count (int): Number of alerts sent
+
+    """
+
+    __slots__ = (
+        "key",
+        "address",
+        "email",
+        "location",
+        "cell",
+        "minimum_temperature",
+        "maximum_temperature",
+        "sends_to",
+        "condition",
+        "alerted_temperature",
+        "alert_count",
+    )
+
+    # fields read from the database, "_id" is the key
+    PROJECTION = {
+        "address": 1,
+        "email": 1,
+        "location": 1,
+        "cell": 1,
+        "minimum_temperature": 1,
+        "maximum_temperature": 1,
+        "sends_to": 1,
+        "condition": 1,
+        "alerted_temperature": 1,
+        "alert_count": 1,
+    }
+
+    def __init__(
+        self,
+        key: str,
+        address: str,
+        email: Optional[str],
+        location: str,
+        cell: str,
+        minimum_temperature: float,
+        maximum_temperature: float,
+        sends_to: list[str],
+        condition: Optional[str] = None,
+        alerted_temperature: Optional[float] = None,
+        alert_count: int = 0,
+    ) -> None:
+        self.key = key
+        self.address = address
+        self.email = email
+        self.location = location
+        self.cell = cell
+        self.minimum_temperature = minimum_temperature
+        self.maximum_temperature = maximum_temperature
+        self.sends_to = sends_to
+        self.condition = condition
+        self.alerted_temperature = alerted_temperature
+        self.alert_count = alert_count
+
+    @classmethod
+    def from_document(cls, document: dict[str, Any]) -> "ScanRecord":
+        """
+        This function is used to build a record from a raw projected document.
+
+        Args:
+            document (dict[str, Any]): Document with the fields of PROJECTION
+
+        Returns:
+            ScanRecord: Record of the user
+
+        """
+        return cls(
+            document["_id"],
+            document["address"],
+            document.get("email"),
+            document["location"],
+            document["cell"],
+            document["minimum_temperature"],
+            document["maximum_temperature"],
+            document.get("sends_to", [SendsTo.AGENT]),
+            document.get("condition"),
+            document.get("alerted_temperature"),
+            document.get("alert_count", 0),
+        )
+
+    @classmethod
+    def from_data(cls, data: Data) -> "ScanRecord":
+        """
+        This function is used to build a record from a Data object.
+
+        Args:
+            data (Data): Data object of the user
+
+        Returns:
+            ScanRecord: Record of the user
+
+        """
+        return cls(
+            data.key,
+            data.address,
+            data.email,
+            data.location,
+            data.cell,
+            data.minimum_temperature,
+            data.maximum_temperature,
+            data.sends_to,
+            data.condition,
+            data.alerted_temperature,
+            data.alert_count,
+        )
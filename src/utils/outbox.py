@@ -0,0 +1,154 @@
+"""
+This file is responsible for delivering queued messages in the background.
+Messages are stored in the database first, so a crash does not lose them,
+then a pool of workers delivers them with exponential backoff.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:  # to avoid circular imports
+    from utils.storage import Storage
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BASE_DELAY = 30  # seconds before the first retry, doubled on every attempt
+OUTBOX_LEASE = 5 * 60  # seconds a claimed message is hidden from other workers
+OUTBOX_POLL = 2  # seconds an idle worker waits before looking again
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """
+    This class is used to queue messages in the database and deliver them with a pool of workers.
+    A message whose worker crashed becomes visible again once its lease is over,
+    a message that failed max_attempts times is dead-lettered.
+
+    Attributes:
+        database (Storage): Database the queue is stored in
+        handler (Callable[[dict[str, Any]], Awaitable[None]]): Coroutine function delivering a payload
+        workers (int): Number of workers
+        max_attempts (int): Attempts before a message is dead-lettered
+        _tasks (list[asyncio.Task]): Running workers
+
+    """
+
+    def __init__(
+        self,
+        database: Storage,
+        handler: Callable[[dict[str, Any]], Awaitable[None]],
+        workers: int = OUTBOX_WORKERS,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ) -> None:
+        self.database = database
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._tasks: list[asyncio.Task] = []
+
+    async def enqueue(self, key: str, payload: dict[str, Any]):
+        """
+        This function is used to queue a message.
+        A message with the same key is only queued once.
+
+        Args:
+            key (str): Idempotency key of the message
+            payload (dict[str, Any]): Payload passed to the handler
+
+        Returns:
+            None
+
+        """
+        await self.database.enqueue_outbox(key, payload)
+
+    def start(self):
+        """
+        This function is used to start the workers.
+
+        Returns:
+            None
+
+        """
+        if self._tasks:
+            return  # do not proceed if workers are already running
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        This function is used to stop the workers.
+        Messages being delivered become visible again once their lease is over.
+
+        Returns:
+            None
+
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        """
+        This function is used to claim and deliver messages until the worker is stopped.
+
+        Returns:
+            None
+
+        """
+        while True:
+            try:
+                message = await self.database.claim_outbox(OUTBOX_LEASE)
+            except Exception as e:
+                logger.error(f"Unable to claim outbox message: {e}")
+                message = None
+            if message is None:
+                await asyncio.sleep(OUTBOX_POLL)
+                continue
+
+            try:
+                await self.handler(message["payload"])
+            except Exception as e:
+                error = str(e)
+            else:
+                error = None
+
+            try:  # the message is claimed again once its lease runs out
+                if error is None:
+                    await self.database.complete_outbox(message["_id"])
+                else:
+                    await self._fail(message, error)
+            except Exception as e:
+                logger.error(f"Unable to update outbox message {message['_id']}: {e}")
+
+    async def _fail(self, message: dict[str, Any], error: str):
+        """
+        This function is used to schedule a retry of a message or dead-letter it.
+
+        Args:
+            message (dict[str, Any]): Claimed message
+            error (str): Error raised by the handler
+
+        Returns:
+            None
+
+        """
+        attempts = message["attempts"] + 1
+        if attempts >= self.max_attempts:
+            logger.error(f"Dead-lettering outbox message {message['_id']}: {error}")
+            await self.database.dead_letter_outbox(message["_id"], attempts, error)
+            return
+
+        delay = OUTBOX_BASE_DELAY * 2 ** (attempts - 1)
+        delay *= random.uniform(0.8, 1.2)  # jitter so retries do not line up
+        await self.database.retry_outbox(
+            message["_id"], attempts, time.time() + delay, error
+        )
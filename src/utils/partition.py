@@ -0,0 +1,125 @@
+"""
+This file is responsible for splitting the cells between several agent instances.
+Instances hold a lease in the database and every live instance owns a consistent-hash
+slice of the cells, so a cell is scanned by one instance only.
+
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # to avoid circular imports
+    from utils.storage import Storage
+
+PARTITION_LEASE = float(os.getenv("PARTITION_LEASE", "30"))  # seconds without heartbeat before an instance is dead
+VIRTUAL_NODES = 64  # points per instance on the ring, evens out the slices
+
+
+def _hash(key: str) -> int:
+    """
+    This function is used to place a key on the ring.
+
+    Args:
+        key (str): Key to place
+
+    Returns:
+        int: Position of the key
+
+    """
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    This class is used to map keys to members so that a member joining or leaving
+    only moves the keys of its own slices.
+
+    Attributes:
+        members (frozenset[str]): Members on the ring
+        _points (list[int]): Sorted positions of the virtual nodes
+        _owners (list[str]): Member of every position
+
+    """
+
+    def __init__(self, members: frozenset[str]) -> None:
+        self.members = members
+        nodes = sorted(
+            (_hash(f"{member}#{index}"), member)
+            for member in members
+            for index in range(VIRTUAL_NODES)
+        )
+        self._points = [point for point, _ in nodes]
+        self._owners = [member for _, member in nodes]
+
+    def owner(self, key: str) -> str:
+        """
+        This function is used to get the member owning a key.
+
+        Args:
+            key (str): Key to look up
+
+        Returns:
+            str: Member owning the key
+
+        """
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class Membership:
+    """
+    This class is used to keep the lease of this instance and the ring of live instances.
+
+    Attributes:
+        database (Storage): Database the leases are stored in
+        instance_id (str): Id of this instance
+        ring (HashRing): Ring of the live instances, only this instance until the first heartbeat
+
+    """
+
+    def __init__(self, database: Storage, instance_id: str) -> None:
+        self.database = database
+        self.instance_id = instance_id
+        self.ring = HashRing(frozenset([instance_id]))
+
+    async def heartbeat(self) -> bool:
+        """
+        This function is used to renew the lease of this instance and rebuild the ring.
+
+        Returns:
+            bool: True if the live instances changed since the last heartbeat
+
+        """
+        await self.database.renew_member(self.instance_id, PARTITION_LEASE)
+        members = frozenset(await self.database.find_members()) | {self.instance_id}
+        if members == self.ring.members:
+            return False
+        self.ring = HashRing(members)
+        return True
+
+    async def leave(self):
+        """
+        This function is used to give up the lease so other instances take over right away.
+
+        Returns:
+            None
+
+        """
+        await self.database.remove_member(self.instance_id)
+
+    def owns(self, cell: str) -> bool:
+        """
+        This function is used to check if this instance scans a cell.
+
+        Args:
+            cell (str): Cell to check
+
+        Returns:
+            bool: True if this instance owns the cell
+
+        """
+        return self.ring.owner(cell) == self.instance_id
@@ -0,0 +1,54 @@
+import asyncio
+from collections.abc import AsyncIterable, Awaitable, Callable, Iterable
+from typing import TypeVar, Union
+
+T = TypeVar("T")
+
+
+async def run_concurrently(
+    items: Union[Iterable[T], AsyncIterable[T]],
+    func: Callable[[T], Awaitable[None]],
+    limit: int,
+):
+    """
+    This function is used to run a coroutine function over items with bounded parallelism.
+    A fixed number of workers pull from a bounded queue, so neither the number of
+    running coroutines nor the number of buffered items grows past the limit.
+
+    Args:
+        items (Union[Iterable[T], AsyncIterable[T]]): Items to process
+        func (Callable[[T], Awaitable[None]]): Coroutine function called for every item
+        limit (int): Maximum number of items processed at the same time
+
+    Returns:
+        None
+
+    """
+    limit = max(1, limit)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=limit * 2)
+    done = object()  # sentinel telling a worker to exit
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            await func(item)
+
+    async def producer():
+        if isinstance(items, AsyncIterable):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        for _ in range(limit):
+            await queue.put(done)  # one sentinel per worker
+
+    tasks = [asyncio.create_task(producer())]
+    tasks += [asyncio.create_task(worker()) for _ in range(limit)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()  # no-op for finished tasks, stops the rest on error
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    This class is used to keep requests under a rate shared by every caller.
+    The rate is halved, down to min_rate, whenever the server says it is exceeded
+    and grows back by a small step after every successful request.
+
+    Attributes:
+        max_rate (float): Allowed requests per second
+        min_rate (float): Lowest rate the bucket backs off to
+        rate (float): Current requests per second
+        capacity (float): Largest burst of requests
+        waiting (int): Number of callers waiting for a token
+        _tokens (float): Tokens available at _updated
+        _updated (float): Time the tokens were last refilled
+        _paused_until (float): No tokens are handed out before this time
+        _lock (Optional[asyncio.Lock]): Hands out tokens in arrival order, created on first use
+
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: float = 0) -> None:
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 10
+        self.rate = rate
+        self.capacity = capacity
+        self.waiting = 0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+
+    @property
+    def budget(self) -> float:
+        """
+        This function is used to get the number of requests that can be made right away.
+
+        Returns:
+            float: Available tokens
+
+        """
+        self._refill()
+        if time.monotonic() < self._paused_until:
+            return 0
+        return self._tokens
+
+    async def acquire(self):
+        """
+        This function is used to wait for a token.
+
+        Returns:
+            None
+
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        self.waiting += 1
+        try:
+            async with self._lock:  # one caller at a time, in order of arrival
+                while True:
+                    self._refill()
+                    now = time.monotonic()
+                    if now < self._paused_until:
+                        await asyncio.sleep(self._paused_until - now)
+                    elif self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    else:
+                        await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def on_success(self) -> None:
+        """
+        This function is used to let the rate grow back after a successful request.
+
+        Returns:
+            None
+
+        """
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def penalize(self, retry_after: float) -> None:
+        """
+        This function is used to back off after the server reported the rate as exceeded.
+
+        Args:
+            retry_after (float): Seconds the server asked to wait
+
+        Returns:
+            None
+
+        """
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def _refill(self) -> None:
+        """
+        This function is used to add the tokens earned since the last refill.
+
+        Returns:
+            None
+
+        """
+        now = time.monotonic()
+        earned = (now - self._updated) * self.rate
+        self._tokens = min(self.capacity, self._tokens + earned)
+        self._updated = now
@@ -0,0 +1,190 @@
+"""
+This file is responsible for finishing registrations in the background.
+The agent acknowledges a registration right away and a pool of workers does the
+slow geocoding and verification email afterwards. Registrations are claimed in the
+database, so only one worker of one instance finishes each of them, and failures
+caused by upstream services are retried with exponential backoff.
+
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import contextmanager
+from typing import Any, Generic, Optional, TypeVar
+
+REGISTRATION_WORKERS = int(os.getenv("REGISTRATION_WORKERS", "4"))
+REGISTRATION_QUEUE = 10000  # jobs waiting before new registrations wait too
+REGISTRATION_MAX_ATTEMPTS = int(os.getenv("REGISTRATION_MAX_ATTEMPTS", "5"))
+REGISTRATION_BASE_DELAY = 30  # seconds before the first retry, doubled on every attempt
+REGISTRATION_LEASE = 5 * 60  # seconds a claimed registration is hidden from other workers
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts: int) -> Optional[float]:
+    """
+    This function is used to get how long to wait before the next attempt of a registration.
+
+    Args:
+        attempts (int): Number of failed attempts
+
+    Returns:
+        Optional[float]: Seconds to wait, None if the registration should be given up
+
+    """
+    if attempts >= REGISTRATION_MAX_ATTEMPTS:
+        return None
+    delay = REGISTRATION_BASE_DELAY * 2 ** (attempts - 1)
+    return delay * random.uniform(0.8, 1.2)  # jitter so retries do not line up
+
+
+class LatencyStats:
+    """
+    This class is used to record how long every stage of a pipeline takes.
+
+    Attributes:
+        _stages (dict[str, list[float]]): Count, total and maximum seconds of every stage
+
+    """
+
+    def __init__(self) -> None:
+        self._stages: dict[str, list[float]] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        This function is used to time the block of a with statement as a stage.
+
+        Args:
+            stage (str): Name of the stage
+
+        Yields:
+            None
+
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        This function is used to record one run of a stage.
+
+        Args:
+            stage (str): Name of the stage
+            seconds (float): Duration of the run
+
+        Returns:
+            None
+
+        """
+        stats = self._stages.setdefault(stage, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    @property
+    def summary(self) -> dict[str, dict[str, Any]]:
+        """
+        This function is used to get the recorded latencies.
+
+        Returns:
+            dict[str, dict[str, Any]]: Count, mean and maximum seconds of every stage
+
+        """
+        return {
+            stage: {
+                "count": int(count),
+                "mean": round(total / count, 3),
+                "max": round(longest, 3),
+            }
+            for stage, (count, total, longest) in self._stages.items()
+        }
+
+
+class WorkerPool(Generic[T]):
+    """
+    This class is used to run jobs in the background with a fixed number of workers.
+
+    Attributes:
+        handler (Callable[[T], Awaitable[None]]): Coroutine function running a job
+        workers (int): Number of workers
+        _queue (Optional[asyncio.Queue]): Jobs waiting for a worker, created on start
+        _tasks (list[asyncio.Task]): Running workers
+
+    """
+
+    def __init__(
+        self, handler: Callable[[T], Awaitable[None]], workers: int = REGISTRATION_WORKERS
+    ) -> None:
+        self.handler = handler
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        """
+        This function is used to start the workers.
+
+        Returns:
+            None
+
+        """
+        if self._tasks:
+            return  # do not proceed if workers are already running
+        self._queue = asyncio.Queue(maxsize=REGISTRATION_QUEUE)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        This function is used to stop the workers, jobs still queued are dropped.
+
+        Returns:
+            None
+
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job: T):
+        """
+        This function is used to queue a job.
+
+        Args:
+            job (T): Job to run
+
+        Returns:
+            None
+
+        Raises:
+            RuntimeError: Workers not started
+
+        """
+        if self._queue is None:
+            raise RuntimeError("Worker pool not started")
+        await self._queue.put(job)
+
+    async def _work(self):
+        """
+        This function is used to run queued jobs until the worker is stopped.
+
+        Returns:
+            None
+
+        """
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.handler(job)
+            except Exception as e:  # a failing job must not kill the worker
+                logger.error(f"Background job failed: {e}")
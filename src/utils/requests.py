@@ -1,12 +1,71 @@
 from __future__ import annotations
 
+import asyncio
 import os
-from typing import Optional
+import time
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Optional
 
 import aiohttp  # for making http requests
 
+from utils.breaker import BreakerState, CircuitBreaker
+from utils.cache import TTLCache
+from utils.cells import from_cell, to_cell
+from utils.geocode import normalize_location
+from utils.ratelimit import TokenBucket
+from utils.singleflight import SingleFlight
+
+if TYPE_CHECKING:  # to avoid useless imports
+    from utils.geocode import GeocodeCache
+
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
 assert WEATHER_API_KEY, "Please set the WEATHER_API_KEY environment variable"
+# can point to a local stand-in server for testing
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.openweathermap.org")
+GROUP_SIZE = 20  # most city ids the group endpoint accepts per request
+
+# geocoding and weather requests share one limit, per minute as in the api plans
+WEATHER_RATE_LIMIT = float(os.getenv("WEATHER_RATE_LIMIT", "60"))
+WEATHER_RATE_BURST = float(os.getenv("WEATHER_RATE_BURST", "10"))
+RATE_LIMIT_RETRIES = 3
+
+# a hung socket must not stall a scan
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "10"))
+WEATHER_CONNECT_TIMEOUT = float(os.getenv("WEATHER_CONNECT_TIMEOUT", "3"))
+WEATHER_CONNECTIONS = int(os.getenv("WEATHER_CONNECTIONS", "20"))  # keep-alive pool size
+DNS_CACHE_TTL = 5 * 60
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))  # failures in a row
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "60"))  # seconds before a trial request
+DEFAULT_RETRY_AFTER = 60  # seconds to back off when a 429 has no Retry-After
+
+# weather readings are cached per cell
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "10000"))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", str(10 * 60)))
+WEATHER_CACHE_STALE = float(os.getenv("WEATHER_CACHE_STALE", str(30 * 60)))
+
+
+def retry_after(response: aiohttp.ClientResponse) -> float:
+    """
+    This function is used to read how long the server asked to back off.
+
+    Args:
+        response (aiohttp.ClientResponse): 429 response
+
+    Returns:
+        float: Seconds to wait
+
+    """
+    header = response.headers.get("Retry-After")
+    if header is None:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(header))
+    except ValueError:  # an http date instead of seconds
+        try:
+            date = parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+        return max(0.0, date.timestamp() - time.time())
 
 
 class RequestHandler:
@@ -15,14 +74,32 @@ class RequestHandler:
 
     Attributes:
         _session (Optional[aiohttp.ClientSession]): aiohttp.ClientSession object
+        geocode_cache (Optional[GeocodeCache]): Cache of geocoding results
+        temperature_cache (TTLCache[float]): Temperatures keyed by cell
+        _refreshing (dict[str, asyncio.Task]): Background refresh of every stale cell
+        _geocode_flight (SingleFlight[tuple[float, float]]): Geocoding requests in flight
+        _temperature_flight (SingleFlight[float]): Temperature requests in flight
+        _city_ids (dict[str, int]): OpenWeather city id of every cell fetched before
+        limiter (TokenBucket): Rate limiter shared by every request
+        breaker (CircuitBreaker): Fails requests fast while the api is degraded
 
     Properties:
         session (aiohttp.ClientSession): aiohttp.ClientSession object
     """
 
-    def __init__(self) -> None:
+    def __init__(self, geocode_cache: Optional[GeocodeCache] = None) -> None:
         self._session: Optional[aiohttp.ClientSession] = None
         # initialize session to None
+        self.geocode_cache = geocode_cache
+        self.temperature_cache: TTLCache[float] = TTLCache(
+            WEATHER_CACHE_SIZE, WEATHER_CACHE_TTL, WEATHER_CACHE_STALE
+        )
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._geocode_flight: SingleFlight[tuple[float, float]] = SingleFlight()
+        self._temperature_flight: SingleFlight[float] = SingleFlight()
+        self._city_ids: dict[str, int] = {}
+        self.limiter = TokenBucket(WEATHER_RATE_LIMIT / 60, WEATHER_RATE_BURST)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
 
     async def start(self):
         """
@@ -34,7 +111,14 @@ class RequestHandler:
         """
         if self._session and not self._session.closed:
             return  # do not proceed if session is already started
-        self._session = aiohttp.ClientSession()  # start session
+        self._session = aiohttp.ClientSession(  # start session
+            timeout=aiohttp.ClientTimeout(
+                total=WEATHER_TIMEOUT, sock_connect=WEATHER_CONNECT_TIMEOUT
+            ),
+            connector=aiohttp.TCPConnector(
+                limit=WEATHER_CONNECTIONS, ttl_dns_cache=DNS_CACHE_TTL
+            ),
+        )
 
     async def stop(self):
         """
@@ -44,6 +128,9 @@ class RequestHandler:
             None
 
         """
+        for task in self._refreshing.values():
+            task.cancel()  # stop background refreshes before closing the session
+        self._refreshing.clear()
         if self._session is None:
             return  # do not proceed if session is None
         if not self._session.closed:
@@ -71,6 +158,7 @@ class RequestHandler:
     async def fetch_lat_and_lon(self, location: str) -> tuple[float, float]:
         """
         This function is used to fetch the latitude and longitude of the location.
+        Results are looked up in and stored to the geocode cache if one is set.
 
         Args:
             location (str): Location to fetch latitude and longitude of
@@ -82,20 +170,123 @@ class RequestHandler:
             ValueError: Location not found
 
         """
-        async with self.session.get(  # make http request to fetch latitude and longitude
-            f"http://api.openweathermap.org/geo/1.0/direct?q={location}&appid={WEATHER_API_KEY}"
-        ) as response:
-            data = await response.json()
-            try:
-                return data[0]["lat"], data[0]["lon"]  # return latitude and longitude
-            except Exception:
-                raise ValueError(
-                    f"Location: {location} not found"
-                )  # raise exception if location is not found
+        # concurrent lookups of the same place share one cache lookup and request
+        return await self._geocode_flight.do(
+            normalize_location(location), lambda: self._lookup_lat_and_lon(location)
+        )
+
+    async def _lookup_lat_and_lon(self, location: str) -> tuple[float, float]:
+        """
+        This function is used to resolve a location through the geocode cache and the api.
+
+        Args:
+            location (str): Location to fetch latitude and longitude of
+
+        Returns:
+            tuple[float, float]: Latitude and longitude of the location
+
+        Raises:
+            ValueError: Location not found
+
+        """
+        if self.geocode_cache is not None:
+            cached = await self.geocode_cache.get(location)
+            if cached is not None:
+                return cached
+
+        lat, lon = await self._request_lat_and_lon(location)
+        if self.geocode_cache is not None:
+            await self.geocode_cache.set(location, lat, lon)
+        return lat, lon
+
+    async def _request_lat_and_lon(self, location: str) -> tuple[float, float]:
+        """
+        This function is used to fetch the latitude and longitude of the location from the api.
+
+        Args:
+            location (str): Location to fetch latitude and longitude of
+
+        Returns:
+            tuple[float, float]: Latitude and longitude of the location
+
+        Raises:
+            ValueError: Location not found
+
+        """
+        data = await self._get_json(  # make http request to fetch latitude and longitude
+            f"{WEATHER_API_URL}/geo/1.0/direct?q={location}&appid={WEATHER_API_KEY}"
+        )
+        try:
+            return data[0]["lat"], data[0]["lon"]  # return latitude and longitude
+        except Exception:
+            raise ValueError(
+                f"Location: {location} not found"
+            )  # raise exception if location is not found
 
     async def fetch_temperature(self, lat: float, lon: float) -> float:
         """
         This function is used to fetch the temperature of the location.
+        It goes through fetch_temperatures, so a stale reading is returned right away
+        while a background task refreshes it, and concurrent misses for the same
+        cell share one request.
+
+        Args:
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            float: Temperature of the location
+
+        Raises:
+            LookupError: Temperature could not be fetched and nothing is cached
+
+        """
+        cell = to_cell(lat, lon)
+        temperatures = await self.fetch_temperatures([cell], 1)
+        if cell not in temperatures:
+            raise LookupError(f"Unable to fetch temperature for {lat}, {lon}")
+        return temperatures[cell]
+
+    async def _load_temperature(self, cell: str, lat: float, lon: float) -> float:
+        """
+        This function is used to fetch the temperature of a cell and cache it.
+
+        Args:
+            cell (str): Cell of the location
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            float: Temperature of the location
+
+        """
+        temperature = await self._request_temperature(lat, lon)
+        self.temperature_cache.set(cell, temperature)
+        return temperature
+
+    async def _refresh_temperatures(self, cells: list[str], limit: int):
+        """
+        This function is used to refresh stale cells in the background.
+
+        Args:
+            cells (list[str]): Cells to refresh
+            limit (int): Maximum number of requests at the same time
+
+        Returns:
+            None
+
+        """
+        try:
+            await self._load_temperatures(cells, limit)
+        except Exception:
+            pass  # keep serving the stale readings, the next lookup retries
+        finally:
+            for cell in cells:
+                self._refreshing.pop(cell, None)
+
+    async def _request_temperature(self, lat: float, lon: float) -> float:
+        """
+        This function is used to fetch the temperature of the location from the api.
 
         Args:
             lat (float): Latitude of the location
@@ -105,8 +296,201 @@ class RequestHandler:
             float: Temperature of the location
 
         """
-        async with self.session.get(  # make http request to fetch temperature
-            f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
-        ) as response:
-            data = await response.json()
-            return data["main"]["temp"]  # return temperature
+        data = await self._get_json(  # make http request to fetch temperature
+            f"{WEATHER_API_URL}/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
+        )
+        if data.get("id"):  # remember the city so the cell can be batched later
+            self._city_ids[to_cell(lat, lon)] = data["id"]
+        return data["main"]["temp"]  # return temperature
+
+    async def fetch_temperatures(self, cells: list[str], limit: int) -> dict[str, float]:
+        """
+        This function is used to fetch the temperature of many cells at once.
+        Cached cells are not fetched, a stale reading is returned right away while
+        one background task refreshes every stale cell. The rest is fetched, see
+        _load_temperatures. While the circuit is open, readings at most
+        max_stale_age seconds old are used without any request.
+
+        Args:
+            cells (list[str]): Cells to fetch
+            limit (int): Maximum number of requests at the same time
+
+        Returns:
+            dict[str, float]: Temperature of every cell that could be fetched
+
+        """
+        temperatures: dict[str, float] = {}
+        if self.breaker.state is BreakerState.OPEN:
+            for cell in cells:  # fall back to the last readings without any request
+                stale = self.temperature_cache.peek(cell, self.max_stale_age)
+                if stale is not None:
+                    temperatures[cell] = stale
+            return temperatures
+
+        missing: list[str] = []
+        stale: list[str] = []
+        for cell in cells:
+            cached = self.temperature_cache.get(cell)
+            if cached is None:
+                missing.append(cell)
+                continue
+            temperatures[cell] = cached[0]
+            if not cached[1] and cell not in self._refreshing:
+                stale.append(cell)
+
+        if stale:  # one task refreshes them all, batched like a scan
+            task = asyncio.create_task(self._refresh_temperatures(stale, limit))
+            for cell in stale:
+                self._refreshing[cell] = task
+        temperatures.update(await self._load_temperatures(missing, limit))
+        return temperatures
+
+    async def _load_temperatures(self, cells: list[str], limit: int) -> dict[str, float]:
+        """
+        This function is used to fetch the temperature of cells and cache them.
+        Cells whose city id is known are fetched GROUP_SIZE cities at a time from the
+        group endpoint, the rest, and cities missing from a group response, with
+        concurrent single requests. Cells already being fetched are awaited instead.
+
+        Args:
+            cells (list[str]): Cells to fetch
+            limit (int): Maximum number of requests at the same time
+
+        Returns:
+            dict[str, float]: Temperature of every cell that could be fetched
+
+        """
+        temperatures: dict[str, float] = {}
+        grouped: dict[int, list[str]] = {}  # cells sharing a city share a reading
+        single: list[str] = []
+        for cell in cells:
+            if cell in self._city_ids:
+                grouped.setdefault(self._city_ids[cell], []).append(cell)
+            else:
+                single.append(cell)
+
+        semaphore = asyncio.Semaphore(max(1, limit))
+        city_ids = list(grouped)
+
+        async def load_group(group: list[str]) -> dict[str, float]:
+            ids = list(dict.fromkeys(self._city_ids[cell] for cell in group))
+            async with semaphore:
+                readings = await self._request_group(ids)
+            loaded = {}
+            for cell in group:
+                if self._city_ids[cell] in readings:
+                    loaded[cell] = readings[self._city_ids[cell]]
+                    self.temperature_cache.set(cell, loaded[cell])
+            return loaded
+
+        async def fetch_group(start: int):
+            chunk = [
+                cell
+                for city_id in city_ids[start : start + GROUP_SIZE]
+                for cell in grouped[city_id]
+            ]
+            # cells in flight elsewhere are awaited, the others share one request
+            readings = await self._temperature_flight.do_many(chunk, load_group)
+            temperatures.update(readings)
+            # failed or not in the response, try the cells one by one
+            single.extend(cell for cell in chunk if cell not in readings)
+
+        async def fetch_single(cell: str):
+            try:
+                async with semaphore:
+                    temperatures[cell] = await self._temperature_flight.do(
+                        cell, lambda: self._load_temperature(cell, *from_cell(cell))
+                    )
+            except Exception:
+                pass  # left out, the scan retries the cell
+
+        await asyncio.gather(
+            *(fetch_group(start) for start in range(0, len(city_ids), GROUP_SIZE))
+        )
+        await asyncio.gather(*(fetch_single(cell) for cell in single))
+        return temperatures
+
+    async def _request_group(self, city_ids: list[int]) -> dict[int, float]:
+        """
+        This function is used to fetch the temperature of several cities in one request.
+
+        Args:
+            city_ids (list[int]): OpenWeather city ids, at most GROUP_SIZE
+
+        Returns:
+            dict[int, float]: Temperature of every city in the response
+
+        """
+        ids = ",".join(str(city_id) for city_id in city_ids)
+        data = await self._get_json(  # make http request to fetch temperatures
+            f"{WEATHER_API_URL}/data/2.5/group?id={ids}&appid={WEATHER_API_KEY}&units=metric"
+        )
+        return {city["id"]: city["main"]["temp"] for city in data["list"]}
+
+    async def _get_json(self, url: str):
+        """
+        This function is used to make a rate limited GET request through the circuit breaker.
+        A 429 response slows the shared limiter down for as long as the server asks
+        and the request is retried up to RATE_LIMIT_RETRIES times. Timeouts,
+        connection errors and 5xx responses count as failures of the breaker.
+
+        Args:
+            url (str): Url to request
+
+        Returns:
+            Any: Decoded json body
+
+        Raises:
+            CircuitOpenError: Circuit is open
+            RuntimeError: Rate limit still exceeded after every retry
+
+        """
+        for _ in range(RATE_LIMIT_RETRIES + 1):
+            self.breaker.before_call()
+            try:
+                await self.limiter.acquire()
+                async with self.session.get(url) as response:
+                    if response.status == 429:
+                        self.breaker.on_success()  # the api answered, it is up
+                        self.limiter.penalize(retry_after(response))
+                        continue
+                    if response.status >= 500:
+                        response.raise_for_status()  # upstream degraded
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.breaker.on_failure()
+                raise
+            finally:  # also on cancellation and unexpected errors, or the trial never ends
+                self.breaker.on_done()
+            self.breaker.on_success()
+            self.limiter.on_success()
+            return data
+        raise RuntimeError("Weather api rate limit exceeded")
+
+    @property
+    def max_stale_age(self) -> float:
+        """
+        This function is used to get the age of the oldest reading that may still be served.
+
+        Returns:
+            float: Seconds
+
+        """
+        return self.temperature_cache.ttl + self.temperature_cache.stale_ttl
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """
+        This function is used to get the state of the breaker, the weather cache and the rate limiter.
+
+        Returns:
+            dict[str, Any]: Breaker state, cache counters, current rate, request budget and queued requests
+
+        """
+        return {
+            "breaker": self.breaker.state.value,
+            "cache": self.temperature_cache.stats,
+            "rate": round(self.limiter.rate * 60, 1),  # requests per minute
+            "budget": int(self.limiter.budget),
+            "waiting": self.limiter.waiting,
+        }
@@ -0,0 +1,135 @@
+"""
+This file is responsible for running scan passes one at a time.
+A pass holds a lease in the database so no other process runs the same scan,
+ticks arriving during a pass are merged into one follow-up pass, and a pass
+checkpoints the cells it still has to process so a crash resumes where it stopped.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # to avoid circular imports
+    from utils.storage import Storage
+
+SCAN_LEASE = float(os.getenv("SCAN_LEASE", "120"))  # seconds a pass holds the scan without renewing
+
+logger = logging.getLogger(__name__)
+
+
+class ScanRunner:
+    """
+    This class is used to make sure a scan never overlaps with itself.
+
+    Attributes:
+        database (Storage): Database holding the lease and the checkpoint
+        name (str): Name of the lease, processes using the same name never scan at once
+        holder (str): Id of this process
+        resumed (list[str]): Cells left over by the pass that last held the lease
+        late_ticks (int): Ticks merged into a follow-up pass
+        skipped (int): Passes skipped because another process held the lease
+        _lock (Optional[asyncio.Lock]): Held during a pass, created on first use
+        _again (bool): True if a tick arrived during the current pass
+
+    """
+
+    def __init__(self, database: Storage, name: str) -> None:
+        self.database = database
+        self.name = name
+        self.holder = uuid.uuid4().hex
+        self.resumed: list[str] = []
+        self.late_ticks = 0
+        self.skipped = 0
+        self._lock = None
+        self._again = False
+
+    async def run(self, scan: Callable[[ScanRunner], Awaitable[None]]):
+        """
+        This function is used to run a pass, or to merge the tick into the running one.
+
+        Args:
+            scan (Callable[[ScanRunner], Awaitable[None]]): Coroutine function running one pass
+
+        Returns:
+            None
+
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            self.late_ticks += 1
+            self._again = True  # run once more when the current pass ends
+            logger.warning(f"Scan {self.name} is still running, tick merged")
+            return
+
+        async with self._lock:
+            while True:
+                self._again = False
+                if not await self._run_once(scan):
+                    return
+                if not self._again:
+                    return
+
+    async def checkpoint(self, remaining: list[str]):
+        """
+        This function is used to store the cells the current pass still has to process.
+
+        Args:
+            remaining (list[str]): Cells not processed yet
+
+        Returns:
+            None
+
+        """
+        await self.database.save_checkpoint(self.name, self.holder, remaining)
+
+    async def _run_once(self, scan: Callable[[ScanRunner], Awaitable[None]]) -> bool:
+        """
+        This function is used to run one pass while holding the lease.
+
+        Args:
+            scan (Callable[[ScanRunner], Awaitable[None]]): Coroutine function running one pass
+
+        Returns:
+            bool: False if another process holds the lease
+
+        """
+        lease = await self.database.acquire_lease(self.name, self.holder, SCAN_LEASE)
+        if lease is None:
+            self.skipped += 1
+            return False
+        self.resumed = lease.get("remaining", [])
+
+        renewal = asyncio.create_task(self._renew())
+        try:
+            await scan(self)
+            await self.checkpoint([])  # the pass is complete
+        finally:
+            renewal.cancel()
+            self.resumed = []
+            try:
+                await self.database.release_lease(self.name, self.holder)
+            except Exception as e:  # the lease runs out on its own
+                logger.error(f"Unable to release scan lease: {e}")
+        return True
+
+    async def _renew(self):
+        """
+        This function is used to keep the lease while a pass runs.
+
+        Returns:
+            None
+
+        """
+        while True:
+            await asyncio.sleep(SCAN_LEASE / 3)
+            try:
+                await self.database.acquire_lease(self.name, self.holder, SCAN_LEASE)
+            except Exception as e:  # try again before the lease runs out
+                logger.error(f"Unable to renew scan lease: {e}")
@@ -0,0 +1,235 @@
+"""
+This file is responsible for deciding when every cell is polled next.
+Cells close to a threshold, or changing fast, are polled often and the others rarely.
+Polls are spread over time so the weather api, the database and smtp see a flat load.
+
+"""
+
+import heapq
+import math
+import os
+import random
+import zlib
+from typing import Optional
+
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", str(10 * 60)))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", str(3 * 60 * 60)))
+POLL_DEFAULT_INTERVAL = 30 * 60  # used when the margin of a cell is unknown
+MIN_RATE = 1 / (60 * 60)  # assume at least 1 degree per hour of change
+RATE_SMOOTHING = 0.5  # weight of the newest rate in the moving average
+SAFETY = 0.5  # poll twice before the predicted crossing
+SCAN_SHARDS = int(os.getenv("SCAN_SHARDS", "30"))  # slots the first polls are spread over
+JITTER = 0.1  # intervals are randomly stretched or shrunk by up to 10%
+
+
+def shard_of(cell: str, shards: int = SCAN_SHARDS) -> int:
+    """
+    This function is used to get the shard of a cell, stable across restarts.
+
+    Args:
+        cell (str): Cell key
+        shards (int): Number of shards
+
+    Returns:
+        int: Shard of the cell, from 0 to shards - 1
+
+    """
+    return zlib.crc32(cell.encode()) % shards
+
+
+class PollScheduler:
+    """
+    This class is used to keep a priority queue of the next poll time of every cell.
+    The interval of a cell is the time its temperature needs to cover the margin to
+    the nearest threshold at its recent rate of change, clamped to
+    [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL].
+
+    Attributes:
+        _queue (list[tuple[float, str]]): Heap of poll times, may hold outdated entries
+        _due (dict[str, float]): Current poll time of every cell
+        _last (dict[str, tuple[float, float]]): Time and temperature of the last reading of every cell
+        _rate (dict[str, float]): Smoothed rate of change of every cell in degrees per second
+
+    """
+
+    def __init__(self) -> None:
+        self._queue: list[tuple[float, str]] = []
+        self._due: dict[str, float] = {}
+        self._last: dict[str, tuple[float, float]] = {}
+        self._rate: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def sync(self, cells: list[str], now: float) -> None:
+        """
+        This function is used to add new cells and drop cells without subscriptions.
+        A new cell is first due in the slot of its shard, so after a restart the
+        cells are polled evenly over POLL_DEFAULT_INTERVAL instead of all at once.
+
+        Args:
+            cells (list[str]): Cells that have at least one subscription
+            now (float): Current time in seconds since epoch
+
+        Returns:
+            None
+
+        """
+        current = set(cells)
+        for cell in list(self._due):
+            if cell not in current:
+                del self._due[cell]
+                self._last.pop(cell, None)
+                self._rate.pop(cell, None)
+        slot = POLL_DEFAULT_INTERVAL / SCAN_SHARDS
+        for cell in cells:
+            if cell not in self._due:
+                self.schedule(cell, now + shard_of(cell) * slot)
+
+    def warm(self, cell: str, times: list[float], temperatures: list[float]) -> None:
+        """
+        This function is used to restore the last reading and rate of change of a cell from its history.
+
+        Args:
+            cell (str): Cell of the readings
+            times (list[float]): Time of every reading, oldest first
+            temperatures (list[float]): Temperature of every reading
+
+        Returns:
+            None
+
+        """
+        for now, temperature in zip(times, temperatures):
+            self._observe(cell, temperature, now)
+
+    def schedule(self, cell: str, due: float) -> None:
+        """
+        This function is used to set the next poll time of a cell.
+
+        Args:
+            cell (str): Cell to schedule
+            due (float): Poll time in seconds since epoch
+
+        Returns:
+            None
+
+        """
+        self._due[cell] = due
+        heapq.heappush(self._queue, (due, cell))
+
+    def tick_limit(self, tick: float) -> int:
+        """
+        This function is used to get how many cells a tick may poll.
+        It is just enough to poll every cell at POLL_MIN_INTERVAL, so bursts are
+        bounded while a backlog can never build up.
+
+        Args:
+            tick (float): Seconds between two ticks
+
+        Returns:
+            int: Maximum number of cells per tick
+
+        """
+        return max(1, math.ceil(len(self._due) * tick / POLL_MIN_INTERVAL))
+
+    def pop_due(self, now: float, limit: Optional[int] = None) -> list[str]:
+        """
+        This function is used to take the cells whose poll time has come, earliest first.
+        Taken cells are not due again until record or schedule is called for them,
+        cells over the limit stay due for the next tick.
+
+        Args:
+            now (float): Current time in seconds since epoch
+            limit (Optional[int]): Maximum number of cells to take
+
+        Returns:
+            list[str]: Cells to poll
+
+        """
+        cells = []
+        queue = self._queue
+        while queue and queue[0][0] <= now and (limit is None or len(cells) < limit):
+            due, cell = heapq.heappop(queue)
+            if self._due.get(cell) == due:  # skip outdated entries
+                self._due[cell] = float("inf")
+                cells.append(cell)
+        return cells
+
+    def record(
+        self,
+        cell: str,
+        temperature: float,
+        margin: Optional[float],
+        now: float,
+        observed: Optional[float] = None,
+    ) -> float:
+        """
+        This function is used to store a reading and schedule the next poll of its cell.
+        A reading served again from the cache is not a new observation, its cell is
+        retried instead. The interval of an old reading counts from when it was observed.
+
+        Args:
+            cell (str): Cell of the reading
+            temperature (float): Temperature of the reading
+            margin (Optional[float]): Degrees to the nearest threshold, negative if breached, None if unknown
+            now (float): Current time in seconds since epoch
+            observed (Optional[float]): Time the reading was observed, now if None
+
+        Returns:
+            float: Seconds until the next poll
+
+        """
+        observed = now if observed is None else observed
+        last = self._last.get(cell)
+        if last is not None and observed <= last[0]:
+            self.retry(cell, now)  # nothing new, a rate of 0 would slow the cell down
+            return POLL_MIN_INTERVAL
+
+        self._observe(cell, temperature, observed)
+        if margin is None:
+            interval = POLL_DEFAULT_INTERVAL
+        else:
+            rate = max(self._rate.get(cell, MIN_RATE), MIN_RATE)
+            interval = max(margin, 0) / rate * SAFETY
+        interval = min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+        interval *= random.uniform(1 - JITTER, 1 + JITTER)  # keep cells from lining up
+        # an old reading may already be past its interval, poll it again soon then
+        due = max(observed + interval, now + POLL_MIN_INTERVAL * (1 - JITTER))
+        if cell in self._due:  # do not bring back a cell dropped by sync
+            self.schedule(cell, due)
+        return due - now
+
+    def retry(self, cell: str, now: float) -> None:
+        """
+        This function is used to poll a cell again soon after its fetch failed.
+
+        Args:
+            cell (str): Cell whose fetch failed
+            now (float): Current time in seconds since epoch
+
+        Returns:
+            None
+
+        """
+        if cell in self._due:
+            self.schedule(cell, now + POLL_MIN_INTERVAL)
+
+    def _observe(self, cell: str, temperature: float, now: float) -> None:
+        """
+        This function is used to store a reading and update the rate of change of its cell.
+
+        Args:
+            cell (str): Cell of the reading
+            temperature (float): Temperature of the reading
+            now (float): Time of the reading in seconds since epoch
+
+        Returns:
+            None
+
+        """
+        last = self._last.get(cell)
+        if last is not None and now > last[0]:
+            rate = abs(temperature - last[1]) / (now - last[0])
+            previous = self._rate.get(cell, rate)
+            self._rate[cell] = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * previous
+        self._last[cell] = (now, temperature)
@@ -0,0 +1,117 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Generic, Hashable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    This class is used to coalesce concurrent calls for the same key.
+    While a call for a key is in flight, other callers for that key await its result
+    instead of starting their own.
+
+    Attributes:
+        _calls (dict[Hashable, asyncio.Future[T]]): Calls in flight keyed by their key
+
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Future[T]] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        This function is used to run func once for all concurrent callers of a key.
+
+        Args:
+            key (Hashable): Key identifying the call
+            func (Callable[[], Awaitable[T]]): Coroutine function making the call
+
+        Returns:
+            T: Result of the call
+
+        Raises:
+            Exception: Whatever func raised, for every waiting caller
+
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            # shield so a cancelled waiter does not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(func())
+        self._calls[key] = future
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def do_many(
+        self,
+        keys: Sequence[Hashable],
+        func: Callable[[list[Hashable]], Awaitable[dict[Hashable, T]]],
+    ) -> dict[Hashable, T]:
+        """
+        This function is used to make one call for many keys, joining the calls already in flight.
+        Keys in flight are awaited, the others are passed to a single call of func
+        and are in flight for other callers until it returns.
+
+        Args:
+            keys (Sequence[Hashable]): Keys to get
+            func (Callable[[list[Hashable]], Awaitable[dict[Hashable, T]]]): Coroutine function making the call for the keys not in flight
+
+        Returns:
+            dict[Hashable, T]: Result of every key, keys that failed or are missing from the result are left out
+
+        """
+        futures = {key: self._calls[key] for key in keys if key in self._calls}
+        own = [key for key in dict.fromkeys(keys) if key not in futures]
+        if own:
+            loop = asyncio.get_running_loop()
+            for key in own:
+                futures[key] = self._calls[key] = loop.create_future()
+            call = asyncio.ensure_future(func(own))
+            call.add_done_callback(lambda _: self._settle(own, futures, call))
+
+        results = {}
+        for key, future in futures.items():
+            try:
+                # shield so a cancelled waiter does not cancel the shared call
+                results[key] = await asyncio.shield(future)
+            except Exception:
+                pass  # the caller decides what to do with the keys left out
+        return results
+
+    def _settle(
+        self,
+        keys: list[Hashable],
+        futures: dict[Hashable, asyncio.Future[T]],
+        call: asyncio.Future[dict[Hashable, T]],
+    ) -> None:
+        """
+        This function is used to hand the result of a call for many keys to the future of every key.
+
+        Args:
+            keys (list[Hashable]): Keys of the call
+            futures (dict[Hashable, asyncio.Future[T]]): Future of every key
+            call (asyncio.Future[dict[Hashable, T]]): Finished call
+
+        Returns:
+            None
+
+        """
+        for key in keys:
+            future = futures[key]
+            if self._calls.get(key) is future:
+                del self._calls[key]
+            if call.cancelled():
+                future.cancel()
+            elif call.exception() is not None:
+                future.set_exception(call.exception())
+            elif key in call.result():
+                future.set_result(call.result()[key])
+            else:
+                future.set_exception(KeyError(key))
+            if not future.cancelled():
+                future.exception()  # its waiters may be gone, do not log it as unhandled
+
+    def __len__(self) -> int:
+        return len(self._calls)
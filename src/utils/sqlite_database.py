@@ -0,0 +1,1116 @@
+"""
+This file is responsible for storing the agent's data in an embedded SQLite database.
+It offers the same operations as utils.database.Database for single node deployments
+that do not want to run MongoDB. The database runs in WAL mode so reads never wait
+for writes, and every query runs on one background thread so the event loop never blocks.
+
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from messages import SendsTo
+from utils.models import (
+    BATCH_RETENTION,
+    OUTBOX_RETENTION,
+    VIOLATION_QUERY_CELLS,
+    WRITE_BATCH_DELAY,
+    WRITE_BATCH_SIZE,
+    Data,
+    ScanRecord,
+    build_subscription,
+    subscription_key,
+)
+from utils.write_buffer import WriteBuffer
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "temperature_agent.db")
+
+# columns of a subscription in the order of the Data fields
+COLUMNS = (
+    "key",
+    "address",
+    "email",
+    "lat",
+    "lon",
+    "location",
+    "cell",
+    "minimum_temperature",
+    "maximum_temperature",
+    "sends_to",
+    "condition",
+    "alerted_temperature",
+    "alert_count",
+)
+# columns read by scans, in the order of the ScanRecord arguments
+RECORD_COLUMNS = (
+    "key, address, email, location, cell, minimum_temperature, maximum_temperature, "
+    "sends_to, condition, alerted_temperature, alert_count"
+)
+# columns of a registration, in the order of the claimed registration fields
+REGISTRATION_COLUMNS = (
+    "key",
+    "address",
+    "location",
+    "min_temp",
+    "max_temp",
+    "sends_to",
+    "email",
+    "attempts",
+    "next_attempt",
+    "batch",
+    "item",
+)
+UPSERT_SUBSCRIPTION = (
+    f"INSERT OR REPLACE INTO subscriptions ({', '.join(COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(COLUMNS))})"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    key TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    email TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    location TEXT NOT NULL,
+    cell TEXT NOT NULL,
+    minimum_temperature REAL NOT NULL,
+    maximum_temperature REAL NOT NULL,
+    sends_to TEXT NOT NULL,
+    condition TEXT,
+    alerted_temperature REAL,
+    alert_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS subscriptions_address ON subscriptions (address);
+CREATE INDEX IF NOT EXISTS subscriptions_minimum ON subscriptions (cell, minimum_temperature);
+CREATE INDEX IF NOT EXISTS subscriptions_maximum ON subscriptions (cell, maximum_temperature);
+CREATE TABLE IF NOT EXISTS registrations (
+    key TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    location TEXT NOT NULL,
+    min_temp REAL NOT NULL,
+    max_temp REAL NOT NULL,
+    sends_to TEXT NOT NULL,
+    email TEXT,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    error TEXT,
+    batch TEXT,
+    item INTEGER
+);
+CREATE INDEX IF NOT EXISTS registrations_due ON registrations (next_attempt);
+CREATE INDEX IF NOT EXISTS registrations_address ON registrations (address);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    results TEXT NOT NULL,
+    remaining INTEGER NOT NULL,
+    verified TEXT NOT NULL DEFAULT '[]',
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batches_address ON batches (address);
+CREATE TABLE IF NOT EXISTS geocodes (
+    name TEXT PRIMARY KEY,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cooldowns (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    used REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    payload TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    error TEXT,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+CREATE TABLE IF NOT EXISTS members (
+    instance_id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    remaining TEXT NOT NULL DEFAULT '[]'
+);
+"""
+
+
+def _record(row: tuple) -> ScanRecord:
+    """
+    This function is used to build a record from a row of RECORD_COLUMNS.
+
+    Args:
+        row (tuple): Row of the subscriptions table
+
+    Returns:
+        ScanRecord: Record of the user
+
+    """
+    *fields, sends_to, condition, alerted_temperature, alert_count = row
+    return ScanRecord(
+        *fields, json.loads(sends_to), condition, alerted_temperature, alert_count
+    )
+
+
+def _data(row: tuple) -> Data:
+    """
+    This function is used to build a Data object from a row of COLUMNS.
+
+    Args:
+        row (tuple): Row of the subscriptions table
+
+    Returns:
+        Data: Data object of the user
+
+    """
+    fields = dict(zip(COLUMNS, row))
+    fields["sends_to"] = json.loads(fields["sends_to"])
+    return Data(**fields)
+
+
+def _registration(row: tuple) -> dict[str, Any]:
+    """
+    This function is used to build a registration from a row of REGISTRATION_COLUMNS.
+
+    Args:
+        row (tuple): Row of the registrations table
+
+    Returns:
+        dict[str, Any]: Registration, keyed like the MongoDB document
+
+    """
+    registration = dict(zip(REGISTRATION_COLUMNS, row))
+    registration["_id"] = registration.pop("key")
+    registration["sends_to"] = json.loads(registration["sends_to"])
+    return registration
+
+
+def _row(data: Data) -> tuple:
+    """
+    This function is used to get the values of a Data object in the order of COLUMNS.
+
+    Args:
+        data (Data): Data object of the user
+
+    Returns:
+        tuple: Values of the row
+
+    """
+    return (
+        data.key,
+        data.address,
+        data.email,
+        data.lat,
+        data.lon,
+        data.location,
+        data.cell,
+        data.minimum_temperature,
+        data.maximum_temperature,
+        json.dumps(data.sends_to),
+        data.condition,
+        data.alerted_temperature,
+        data.alert_count,
+    )
+
+
+class SQLiteDatabase:
+    """
+    This class is used to store the agent's data in a local SQLite database.
+    It implements utils.storage.Storage, like utils.database.Database.
+
+    Attributes:
+        path (str): Path of the database file
+        connection (sqlite3.Connection): Connection used by every query
+        writes (WriteBuffer): Buffer batching user inserts and removes into one transaction
+        _executor (ThreadPoolExecutor): Single thread running every query
+        _started (bool): True if the database is connected, False otherwise
+
+    """
+
+    def __init__(self, path: str = SQLITE_PATH) -> None:
+        self.path = path
+        self._started = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.writes = WriteBuffer(self._bulk_write, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY)
+
+    async def connect(self):
+        """
+        This function is used to open the database and create its tables.
+
+        Returns:
+            None
+
+        """
+        if self._started:
+            return  # do not proceed if database is already connected
+        self._started = True
+        await self._run(self._open)
+
+    def _open(self):
+        """
+        This function is used to open the database, on the query thread.
+
+        Returns:
+            None
+
+        """
+        self.connection = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")  # readers never wait for writers
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, no fsync per commit
+        self.connection.execute("PRAGMA busy_timeout=5000")  # other processes sharing the file
+        self.connection.executescript(SCHEMA)
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        This function is used to run a function on the query thread.
+
+        Args:
+            func (Callable[..., Any]): Function using the connection
+            *args (Any): Arguments of the function
+
+        Returns:
+            Any: Result of the function
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """
+        This function is used to run one statement and fetch its rows.
+
+        Args:
+            sql (str): Statement to run
+            params (tuple): Parameters of the statement
+
+        Returns:
+            list[tuple]: Rows returned by the statement
+
+        """
+        await self.connect()  # connect to the database
+        return await self._run(lambda: self.connection.execute(sql, params).fetchall())
+
+    async def find_all(self):
+        """
+        This function is used to fetch all the users from the database.
+
+        Yields:
+            Data: Data object
+
+        """
+        rows = await self._execute(f"SELECT {', '.join(COLUMNS)} FROM subscriptions")
+        for row in rows:
+            yield _data(row)
+
+    async def find_records(self):
+        """
+        This function is used to fetch users as ScanRecord objects.
+
+        Yields:
+            ScanRecord: Record of a user
+
+        """
+        rows = await self._execute(f"SELECT {RECORD_COLUMNS} FROM subscriptions")
+        for row in rows:
+            yield _record(row)
+
+    async def find_cells(self) -> list[str]:
+        """
+        This function is used to fetch the cells that have at least one user.
+
+        Returns:
+            list[str]: Distinct cells
+
+        """
+        rows = await self._execute("SELECT DISTINCT cell FROM subscriptions")
+        return [cell for (cell,) in rows]
+
+    async def find_keys(self, keys: list[str]) -> set[str]:
+        """
+        This function is used to check which subscriptions still exist.
+
+        Args:
+            keys (list[str]): Keys of the subscriptions
+
+        Returns:
+            set[str]: Keys of the subscriptions still in the database
+
+        """
+        found = set()
+        for start in range(0, len(keys), VIOLATION_QUERY_CELLS):
+            batch = keys[start : start + VIOLATION_QUERY_CELLS]
+            rows = await self._execute(
+                "SELECT key FROM subscriptions "
+                f"WHERE key IN ({', '.join('?' for _ in batch)})",
+                tuple(batch),
+            )
+            found.update(key for (key,) in rows)
+        return found
+
+    async def find_violations(self, temperatures: dict[str, float]):
+        """
+        This function is used to fetch only the users whose thresholds are breached.
+        The readings are joined to the subscriptions on the cell index.
+        Users whose last alert is not over yet are fetched too, so they can go back in range.
+
+        Args:
+            temperatures (dict[str, float]): Current temperature of every cell
+
+        Yields:
+            ScanRecord: Record of a user whose location is out of range
+
+        """
+        cells = list(temperatures.items())
+        for start in range(0, len(cells), VIOLATION_QUERY_CELLS):
+            batch = cells[start : start + VIOLATION_QUERY_CELLS]
+            readings = ", ".join("(?, ?)" for _ in batch)
+            rows = await self._execute(
+                f"WITH readings (cell, temperature) AS (VALUES {readings}) "
+                f"SELECT {RECORD_COLUMNS} FROM subscriptions "
+                "JOIN readings USING (cell) "
+                "WHERE minimum_temperature > temperature "
+                "OR maximum_temperature < temperature OR condition IS NOT NULL",
+                tuple(value for reading in batch for value in reading),
+            )
+            for row in rows:
+                yield _record(row)
+
+    async def insert(
+        self,
+        address: str,
+        lat: float,
+        lon: float,
+        location: str,
+        min_temp: float,
+        max_temp: float,
+        sends_to: list[SendsTo],
+        email: Optional[str] = None,
+    ):
+        """
+        This function is used to insert a user into the database.
+
+        Args:
+            address (str): Address of the agent
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+            location (str): Location
+            min_temp (float): Minimum temperature
+            max_temp (float): Maximum temperature
+            sends_to (list[SendsTo]): List of destinations where the user wants to receive the temperature alert
+            email (Optional[str]): Email of the user
+
+        Returns:
+            Data: Data object of the inserted user
+
+        """
+        data = build_subscription(
+            address, location, min_temp, max_temp, sends_to, email, lat, lon
+        )
+        # insert user into database, batched with other writes
+        await self.writes.submit((UPSERT_SUBSCRIPTION, _row(data)))
+        return data
+
+    async def insert_pending(
+        self,
+        address: str,
+        location: str,
+        min_temp: float,
+        max_temp: float,
+        sends_to: list[SendsTo],
+        email: Optional[str] = None,
+    ) -> str:
+        """
+        This function is used to store a registration before it is geocoded and verified.
+        Registrations are kept apart from the subscriptions, so a subscription
+        registered again keeps working until the new registration is finished.
+
+        Args:
+            address (str): Address of the agent
+            location (str): Location
+            min_temp (float): Minimum temperature
+            max_temp (float): Maximum temperature
+            sends_to (list[SendsTo]): List of destinations where the user wants to receive the temperature alert
+            email (Optional[str]): Email of the user
+
+        Returns:
+            str: Key of the registration, the key of the subscription once finished
+
+        """
+        key = subscription_key(address, location)
+        await self._execute(
+            f"INSERT OR REPLACE INTO registrations ({', '.join(REGISTRATION_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(REGISTRATION_COLUMNS))})",
+            (
+                key,
+                address,
+                location,
+                min_temp,
+                max_temp,
+                json.dumps(list(set(sends_to))),
+                email,
+                0,
+                time.time(),
+                None,
+                None,
+            ),
+        )
+        return key
+
+    async def insert_pending_many(
+        self,
+        address: str,
+        subscriptions: list[dict[str, Any]],
+        results: list[dict[str, Any]],
+    ) -> list[str]:
+        """
+        This function is used to store the registrations of a bulk request in one transaction.
+        A batch keeps the outcome of every location of the request, so the reply
+        can be sent once the last registration is finished. Batches past their
+        retention are deleted on the way.
+
+        Args:
+            address (str): Address of the agent
+            subscriptions (list[dict[str, Any]]): Keyword arguments of insert_pending and index in the request of every registration
+            results (list[dict[str, Any]]): Location, type and message of every location of the request, type None while pending
+
+        Returns:
+            list[str]: Key of every registration
+
+        """
+        now = time.time()
+        batch = uuid.uuid4().hex
+        keys = []
+        operations = [
+            ("DELETE FROM batches WHERE expires_at <= ?", (now,)),
+            (
+                "INSERT INTO batches (id, address, results, remaining, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    batch,
+                    address,
+                    json.dumps(results),
+                    len(subscriptions),
+                    now + BATCH_RETENTION.total_seconds(),
+                ),
+            ),
+        ]
+        for subscription in subscriptions:
+            key = subscription_key(address, subscription["location"])
+            keys.append(key)
+            operations.append(
+                (
+                    "INSERT OR REPLACE INTO registrations "
+                    f"({', '.join(REGISTRATION_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(REGISTRATION_COLUMNS))})",
+                    (
+                        key,
+                        address,
+                        subscription["location"],
+                        subscription["min_temp"],
+                        subscription["max_temp"],
+                        json.dumps(list(set(subscription["sends_to"]))),
+                        subscription.get("email"),
+                        0,
+                        now,
+                        batch,
+                        subscription["item"],
+                    ),
+                )
+            )
+        await self._bulk_write(operations)
+        return keys
+
+    async def find_due_registrations(self) -> list[str]:
+        """
+        This function is used to fetch the registrations that are due for an attempt.
+
+        Returns:
+            list[str]: Keys of the registrations
+
+        """
+        rows = await self._execute(
+            "SELECT key FROM registrations WHERE next_attempt <= ?", (time.time(),)
+        )
+        return [key for (key,) in rows]
+
+    async def claim_registration(
+        self, key: str, lease: float
+    ) -> Optional[dict[str, Any]]:
+        """
+        This function is used to claim a due registration so only one worker finishes it.
+        Registrations whose lease ran out are claimed again, their worker is assumed dead.
+
+        Args:
+            key (str): Key of the registration
+            lease (float): Seconds the registration is hidden from other workers
+
+        Returns:
+            Optional[dict[str, Any]]: Claimed registration, None if it is not due or gone
+
+        """
+        now = time.time()
+        rows = await self._execute(
+            "UPDATE registrations SET next_attempt = ? "
+            "WHERE key = ? AND next_attempt <= ? "
+            f"RETURNING {', '.join(REGISTRATION_COLUMNS)}",
+            (now + lease, key, now),
+        )
+        return _registration(rows[0]) if rows else None
+
+    async def activate(self, key: str, lat: float, lon: float) -> Optional[ScanRecord]:
+        """
+        This function is used to turn a registration into a subscription so scans pick it up.
+        An existing subscription with the same key is replaced.
+
+        Args:
+            key (str): Key of the registration
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            Optional[ScanRecord]: Record of the subscription, None if the registration was removed meanwhile
+
+        """
+        rows = await self._execute(
+            f"SELECT {', '.join(REGISTRATION_COLUMNS)} FROM registrations "
+            "WHERE key = ?",
+            (key,),
+        )
+        if not rows:
+            return None
+        registration = _registration(rows[0])
+        data = build_subscription(
+            registration["address"],
+            registration["location"],
+            registration["min_temp"],
+            registration["max_temp"],
+            registration["sends_to"],
+            registration["email"],
+            lat,
+            lon,
+        )
+        await self.writes.submit((UPSERT_SUBSCRIPTION, _row(data)))
+        # a registration sent again meanwhile has a new next_attempt and is kept
+        await self._execute(
+            "DELETE FROM registrations WHERE key = ? AND next_attempt = ?",
+            (key, registration["next_attempt"]),
+        )
+        return ScanRecord.from_data(data)
+
+    async def retry_registration(
+        self, key: str, attempts: int, next_attempt: float, error: str
+    ):
+        """
+        This function is used to schedule another attempt of a registration.
+
+        Args:
+            key (str): Key of the registration
+            attempts (int): Number of failed attempts
+            next_attempt (float): Time of the next attempt in seconds since epoch
+            error (str): Error of the last attempt
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "UPDATE registrations SET attempts = ?, next_attempt = ?, error = ? "
+            "WHERE key = ?",
+            (attempts, next_attempt, error, key),
+        )
+
+    async def remove_registration(self, key: str):
+        """
+        This function is used to drop a registration that can not be finished.
+        The subscription with the same key, if any, is kept.
+
+        Args:
+            key (str): Key of the registration
+
+        Returns:
+            None
+
+        """
+        await self._execute("DELETE FROM registrations WHERE key = ?", (key,))
+
+    async def claim_batch_email(self, batch: str, email: str) -> bool:
+        """
+        This function is used to claim the verification of an email for a bulk request.
+        The locations of a request that share an email send one verification email.
+
+        Args:
+            batch (str): Id of the batch
+            email (str): Email of the user
+
+        Returns:
+            bool: True if the email is not verified for the batch yet, False otherwise
+
+        """
+        rows = await self._execute(
+            "UPDATE batches SET verified = json_insert(verified, '$[#]', ?) "
+            "WHERE id = ? AND NOT EXISTS "
+            "(SELECT 1 FROM json_each(verified) WHERE value = ?) RETURNING id",
+            (email, batch, email),
+        )
+        return bool(rows)
+
+    async def release_batch_email(self, batch: str, email: str):
+        """
+        This function is used to give up the verification of an email that could not be sent.
+
+        Args:
+            batch (str): Id of the batch
+            email (str): Email of the user
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "UPDATE batches SET verified = (SELECT json_group_array(value) "
+            "FROM json_each(verified) WHERE value != ?) WHERE id = ?",
+            (email, batch),
+        )
+
+    async def finish_batch_item(
+        self, batch: str, item: int, type: str, message: str
+    ) -> Optional[dict[str, Any]]:
+        """
+        This function is used to store the outcome of one location of a bulk request.
+        An outcome already stored is kept, so a registration finished twice counts once.
+
+        Args:
+            batch (str): Id of the batch
+            item (int): Index of the location in the request
+            type (str): UAgentResponseType value of the outcome
+            message (str): Message of the outcome
+
+        Returns:
+            Optional[dict[str, Any]]: Finished batch with its address and results, None while locations are pending
+
+        """
+        rows = await self._execute(
+            "UPDATE batches SET results = json_set(results, ?, ?, ?, ?), "
+            "remaining = remaining - 1 "
+            "WHERE id = ? AND json_extract(results, ?) IS NULL "
+            "RETURNING address, results, remaining",
+            (
+                f"$[{item}].type",
+                type,
+                f"$[{item}].message",
+                message,
+                batch,
+                f"$[{item}].type",
+            ),
+        )
+        if not rows or rows[0][2] > 0:
+            return None
+        await self._execute("DELETE FROM batches WHERE id = ?", (batch,))
+        address, results, _ = rows[0]
+        return {"_id": batch, "address": address, "results": json.loads(results)}
+
+    async def remove(self, address: str):
+        """
+        This function is used to remove every subscription, registration and bulk request of a user from the database.
+
+        Args:
+            address (str): Address of the agent
+
+        Returns:
+            None
+
+        """
+        # remove user from database, batched with other writes
+        await self.writes.submit(
+            ("DELETE FROM subscriptions WHERE address = ?", (address,))
+        )
+        await self._execute("DELETE FROM registrations WHERE address = ?", (address,))
+        await self._execute("DELETE FROM batches WHERE address = ?", (address,))
+
+    async def flush(self):
+        """
+        This function is used to write every buffered insert and remove.
+
+        Returns:
+            None
+
+        """
+        await self.writes.close()
+
+    async def _bulk_write(self, operations: list[tuple[str, tuple]]):
+        """
+        This function is used to write a batch of statements in one transaction.
+        Statements run in order so a remove after an insert of the same user stays last.
+
+        Args:
+            operations (list[tuple[str, tuple]]): Statements and their parameters
+
+        Returns:
+            None
+
+        """
+        await self.connect()  # connect to the database
+        await self._run(self._transaction, operations)
+
+    def _transaction(self, operations: list[tuple[str, tuple]]):
+        """
+        This function is used to run statements in one transaction, on the query thread.
+
+        Args:
+            operations (list[tuple[str, tuple]]): Statements and their parameters
+
+        Returns:
+            None
+
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in operations:
+                connection.execute(sql, params)
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    async def save_alert_states(
+        self, states: dict[str, tuple[Optional[str], Optional[float], int]]
+    ):
+        """
+        This function is used to persist the alert state of many subscriptions in one transaction.
+        Subscriptions removed meanwhile are not created again.
+
+        Args:
+            states (dict[str, tuple[Optional[str], Optional[float], int]]): Condition, alerted temperature and alert count, keyed by subscription key
+
+        Returns:
+            None
+
+        """
+        if not states:
+            return
+        await self._bulk_write(
+            [
+                (
+                    "UPDATE subscriptions SET condition = ?, alerted_temperature = ?, "
+                    "alert_count = ? WHERE key = ?",
+                    (condition, temperature, count, key),
+                )
+                for key, (condition, temperature, count) in states.items()
+            ]
+        )
+
+    async def find_geocode(self, name: str) -> Optional[tuple[float, float]]:
+        """
+        This function is used to fetch a cached geocoding result.
+
+        Args:
+            name (str): Normalized location name
+
+        Returns:
+            Optional[tuple[float, float]]: Latitude and longitude, None if not cached
+
+        """
+        rows = await self._execute(
+            "SELECT lat, lon FROM geocodes WHERE name = ?", (name,)
+        )
+        return rows[0] if rows else None
+
+    async def save_geocode(self, name: str, lat: float, lon: float):
+        """
+        This function is used to cache a geocoding result.
+
+        Args:
+            name (str): Normalized location name
+            lat (float): Latitude of the location
+            lon (float): Longitude of the location
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "INSERT OR REPLACE INTO geocodes (name, lat, lon) VALUES (?, ?, ?)",
+            (name, lat, lon),
+        )
+
+    async def load_cooldowns(self, name: str) -> dict[str, float]:
+        """
+        This function is used to fetch the persisted cooldowns that are not over yet.
+        Cooldowns that are over are deleted on the way.
+
+        Args:
+            name (str): Name of the cooldown
+
+        Returns:
+            dict[str, float]: Time every key was last used
+
+        """
+        now = time.time()
+        await self._execute("DELETE FROM cooldowns WHERE expires_at <= ?", (now,))
+        rows = await self._execute(
+            "SELECT key, used FROM cooldowns WHERE name = ? AND expires_at > ?",
+            (name, now),
+        )
+        return dict(rows)
+
+    async def save_cooldowns(self, name: str, entries: dict[str, float], per: float):
+        """
+        This function is used to persist cooldowns in one transaction.
+
+        Args:
+            name (str): Name of the cooldown
+            entries (dict[str, float]): Time every key was last used
+            per (float): Cooldown period, used to set when the entries expire
+
+        Returns:
+            None
+
+        """
+        if not entries:
+            return
+        await self._bulk_write(
+            [
+                (
+                    "INSERT OR REPLACE INTO cooldowns (name, key, used, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (name, key, used, used + per),
+                )
+                for key, used in entries.items()
+            ]
+        )
+
+    async def enqueue_outbox(self, key: str, payload: dict[str, Any]):
+        """
+        This function is used to queue an outbox message unless its key was already queued.
+
+        Args:
+            key (str): Idempotency key of the message
+            payload (dict[str, Any]): Payload of the message
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "INSERT OR IGNORE INTO outbox (key, payload, status, attempts, next_attempt) "
+            "VALUES (?, ?, 'pending', 0, ?)",
+            (key, json.dumps(payload), time.time()),
+        )
+
+    async def claim_outbox(self, lease: float) -> Optional[dict[str, Any]]:
+        """
+        This function is used to claim the next due outbox message.
+        Messages whose lease ran out are claimed again, their worker is assumed dead.
+
+        Args:
+            lease (float): Seconds the message is hidden from other workers
+
+        Returns:
+            Optional[dict[str, Any]]: Claimed message, None if nothing is due
+
+        """
+        now = time.time()
+        rows = await self._execute(
+            "UPDATE outbox SET status = 'processing', next_attempt = ? "
+            "WHERE key = (SELECT key FROM outbox WHERE status IN ('pending', 'processing') "
+            "AND next_attempt <= ? ORDER BY next_attempt LIMIT 1) "
+            "RETURNING key, payload, attempts",
+            (now + lease, now),
+        )
+        if not rows:
+            return None
+        key, payload, attempts = rows[0]
+        return {"_id": key, "payload": json.loads(payload), "attempts": attempts}
+
+    async def complete_outbox(self, key: str):
+        """
+        This function is used to mark an outbox message as delivered.
+        Delivered messages past their retention are deleted on the way.
+
+        Args:
+            key (str): Idempotency key of the message
+
+        Returns:
+            None
+
+        """
+        now = time.time()
+        await self._bulk_write(
+            [
+                (
+                    "UPDATE outbox SET status = 'done', payload = NULL, expires_at = ? "
+                    "WHERE key = ?",
+                    (now + OUTBOX_RETENTION.total_seconds(), key),
+                ),
+                (
+                    "DELETE FROM outbox WHERE status = 'done' AND expires_at <= ?",
+                    (now,),
+                ),
+            ]
+        )
+
+    async def retry_outbox(
+        self, key: str, attempts: int, next_attempt: float, error: str
+    ):
+        """
+        This function is used to schedule another attempt of an outbox message.
+
+        Args:
+            key (str): Idempotency key of the message
+            attempts (int): Number of failed attempts
+            next_attempt (float): Time of the next attempt in seconds since epoch
+            error (str): Error of the last attempt
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt = ?, "
+            "error = ? WHERE key = ?",
+            (attempts, next_attempt, error, key),
+        )
+
+    async def dead_letter_outbox(self, key: str, attempts: int, error: str):
+        """
+        This function is used to give up on an outbox message.
+        The message stays in the table with status "dead" for inspection.
+
+        Args:
+            key (str): Idempotency key of the message
+            attempts (int): Number of failed attempts
+            error (str): Error of the last attempt
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "UPDATE outbox SET status = 'dead', attempts = ?, error = ? WHERE key = ?",
+            (attempts, error, key),
+        )
+
+    async def renew_member(self, instance_id: str, lease: float):
+        """
+        This function is used to renew the lease of an agent instance.
+
+        Args:
+            instance_id (str): Id of the instance
+            lease (float): Seconds the lease is valid for
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "INSERT OR REPLACE INTO members (instance_id, expires_at) VALUES (?, ?)",
+            (instance_id, time.time() + lease),
+        )
+
+    async def find_members(self) -> list[str]:
+        """
+        This function is used to fetch the agent instances whose lease is valid.
+
+        Returns:
+            list[str]: Ids of the live instances
+
+        """
+        rows = await self._execute(
+            "SELECT instance_id FROM members WHERE expires_at > ?", (time.time(),)
+        )
+        return [instance_id for (instance_id,) in rows]
+
+    async def remove_member(self, instance_id: str):
+        """
+        This function is used to drop the lease of an agent instance.
+
+        Args:
+            instance_id (str): Id of the instance
+
+        Returns:
+            None
+
+        """
+        await self._execute("DELETE FROM members WHERE instance_id = ?", (instance_id,))
+
+    async def acquire_lease(
+        self, name: str, holder: str, lease: float
+    ) -> Optional[dict[str, Any]]:
+        """
+        This function is used to take or renew a named lease.
+        The lease is taken if it is free, expired or already held by the holder.
+
+        Args:
+            name (str): Name of the lease
+            holder (str): Id of the process taking the lease
+            lease (float): Seconds the lease is valid for
+
+        Returns:
+            Optional[dict[str, Any]]: Lease with the last checkpoint, None if another process holds it
+
+        """
+        now = time.time()
+        rows = await self._execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, "
+            "expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at <= ? "
+            "RETURNING remaining",
+            (name, holder, now + lease, now),
+        )
+        if not rows:
+            return None
+        return {"_id": name, "holder": holder, "remaining": json.loads(rows[0][0])}
+
+    async def save_checkpoint(self, name: str, holder: str, remaining: list[str]):
+        """
+        This function is used to store the progress of the holder of a lease.
+
+        Args:
+            name (str): Name of the lease
+            holder (str): Id of the process holding the lease
+            remaining (list[str]): Items still to be processed
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "UPDATE leases SET remaining = ? WHERE name = ? AND holder = ?",
+            (json.dumps(remaining), name, holder),
+        )
+
+    async def release_lease(self, name: str, holder: str):
+        """
+        This function is used to give up a lease, keeping its checkpoint.
+
+        Args:
+            name (str): Name of the lease
+            holder (str): Id of the process holding the lease
+
+        Returns:
+            None
+
+        """
+        await self._execute(
+            "UPDATE leases SET expires_at = ? WHERE name = ? AND holder = ?",
+            (time.time(), name, holder),
+        )
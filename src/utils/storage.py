@@ -0,0 +1,197 @@
+"""
+This file is responsible for choosing where the agent stores its data.
+Every backend implements the Storage protocol, the backend is picked with the
+STORAGE_BACKEND environment variable.
+
+Backends:
+    mongodb: MongoDB through motor, needs MONGODB_URL, shared by several instances
+    sqlite: Local SQLite file at SQLITE_PATH, for single node deployments
+
+"""
+
+import os
+from typing import Any, AsyncIterator, Optional, Protocol
+
+from messages import SendsTo
+from utils.models import Data, ScanRecord
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongodb")
+
+
+class Storage(Protocol):
+    """
+    This class is used to define the operations every storage backend offers.
+    See utils.database.Database for what every operation does.
+
+    """
+
+    async def connect(self) -> None:
+        ...
+
+    async def flush(self) -> None:
+        ...
+
+    # subscriptions
+    def find_all(self) -> AsyncIterator[Data]:
+        ...
+
+    def find_records(self) -> AsyncIterator[ScanRecord]:
+        ...
+
+    def find_violations(
+        self, temperatures: dict[str, float]
+    ) -> AsyncIterator[ScanRecord]:
+        ...
+
+    async def find_cells(self) -> list[str]:
+        ...
+
+    async def find_keys(self, keys: list[str]) -> set[str]:
+        ...
+
+    async def insert(
+        self,
+        address: str,
+        lat: float,
+        lon: float,
+        location: str,
+        min_temp: float,
+        max_temp: float,
+        sends_to: list[SendsTo],
+        email: Optional[str] = None,
+    ) -> Data:
+        ...
+
+    async def remove(self, address: str) -> None:
+        ...
+
+    async def save_alert_states(
+        self, states: dict[str, tuple[Optional[str], Optional[float], int]]
+    ) -> None:
+        ...
+
+    # registrations
+    async def insert_pending(
+        self,
+        address: str,
+        location: str,
+        min_temp: float,
+        max_temp: float,
+        sends_to: list[SendsTo],
+        email: Optional[str] = None,
+    ) -> str:
+        ...
+
+    async def insert_pending_many(
+        self,
+        address: str,
+        subscriptions: list[dict[str, Any]],
+        results: list[dict[str, Any]],
+    ) -> list[str]:
+        ...
+
+    async def find_due_registrations(self) -> list[str]:
+        ...
+
+    async def claim_registration(
+        self, key: str, lease: float
+    ) -> Optional[dict[str, Any]]:
+        ...
+
+    async def activate(self, key: str, lat: float, lon: float) -> Optional[ScanRecord]:
+        ...
+
+    async def retry_registration(
+        self, key: str, attempts: int, next_attempt: float, error: str
+    ) -> None:
+        ...
+
+    async def remove_registration(self, key: str) -> None:
+        ...
+
+    async def claim_batch_email(self, batch: str, email: str) -> bool:
+        ...
+
+    async def release_batch_email(self, batch: str, email: str) -> None:
+        ...
+
+    async def finish_batch_item(
+        self, batch: str, item: int, type: str, message: str
+    ) -> Optional[dict[str, Any]]:
+        ...
+
+    # geocodes and cooldowns
+    async def find_geocode(self, name: str) -> Optional[tuple[float, float]]:
+        ...
+
+    async def save_geocode(self, name: str, lat: float, lon: float) -> None:
+        ...
+
+    async def load_cooldowns(self, name: str) -> dict[str, float]:
+        ...
+
+    async def save_cooldowns(
+        self, name: str, entries: dict[str, float], per: float
+    ) -> None:
+        ...
+
+    # outbox
+    async def enqueue_outbox(self, key: str, payload: dict[str, Any]) -> None:
+        ...
+
+    async def claim_outbox(self, lease: float) -> Optional[dict[str, Any]]:
+        ...
+
+    async def complete_outbox(self, key: str) -> None:
+        ...
+
+    async def retry_outbox(
+        self, key: str, attempts: int, next_attempt: float, error: str
+    ) -> None:
+        ...
+
+    async def dead_letter_outbox(self, key: str, attempts: int, error: str) -> None:
+        ...
+
+    # instances and leases
+    async def renew_member(self, instance_id: str, lease: float) -> None:
+        ...
+
+    async def find_members(self) -> list[str]:
+        ...
+
+    async def remove_member(self, instance_id: str) -> None:
+        ...
+
+    async def acquire_lease(
+        self, name: str, holder: str, lease: float
+    ) -> Optional[dict[str, Any]]:
+        ...
+
+    async def save_checkpoint(self, name: str, holder: str, remaining: list[str]) -> None:
+        ...
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        ...
+
+
+def create_database() -> Storage:
+    """
+    This function is used to create the database of the configured backend.
+
+    Returns:
+        Storage: Database of the backend
+
+    Raises:
+        ValueError: Unknown backend
+
+    """
+    if STORAGE_BACKEND == "mongodb":
+        from utils.database import Database
+
+        return Database()
+    if STORAGE_BACKEND == "sqlite":
+        from utils.sqlite_database import SQLiteDatabase
+
+        return SQLiteDatabase()
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, use mongodb or sqlite")
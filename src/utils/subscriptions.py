@@ -0,0 +1,429 @@
+"""
+This file is responsible for keeping every subscription in memory as columns of NumPy arrays.
+Thresholds of a whole scan are checked with a few vectorized comparisons.
+Every subscription remembers the condition and temperature of its last alert, so
+alerts are only sent when the condition changes or the temperature moved a lot,
+and counts its alerts so every alert can be told apart from a replay of it.
+
+"""
+
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from messages import TemperatureCondition
+
+if TYPE_CHECKING:  # to avoid useless imports
+    from utils.cooldown import Cooldown
+    from utils.models import ScanRecord
+    from utils.storage import Storage
+
+INITIAL_CAPACITY = 1024
+# degrees a breached temperature has to come back inside the thresholds to count as in range
+ALERT_HYSTERESIS = float(os.getenv("ALERT_HYSTERESIS", "1"))
+# degrees a breached temperature has to move since the last alert to alert again
+ALERT_CHANGE = float(os.getenv("ALERT_CHANGE", "2"))
+
+# condition of every row, stored as int8
+IN_RANGE = 0
+LOW = 1
+HIGH = 2
+CONDITIONS = {LOW: TemperatureCondition.LOW.value, HIGH: TemperatureCondition.HIGH.value}
+CONDITION_IDS = {value: condition for condition, value in CONDITIONS.items()}
+COLUMNS = (
+    "minimum",
+    "maximum",
+    "cell_ids",
+    "alerted_at",
+    "condition",
+    "alerted_temperature",
+    "alert_count",
+)
+
+
+class SubscriptionTable:
+    """
+    This class is used to store subscriptions column wise for vectorized threshold checks.
+    Row i of every array and of records belongs to the same subscription.
+
+    Attributes:
+        loaded (bool): True once the table has been loaded from the database
+        minimum (np.ndarray): Minimum temperature of every row
+        maximum (np.ndarray): Maximum temperature of every row
+        cell_ids (np.ndarray): Id of the cell of every row
+        alerted_at (np.ndarray): Time of the last alert of every row, 0 if never alerted
+        condition (np.ndarray): IN_RANGE, LOW or HIGH of every row
+        alerted_temperature (np.ndarray): Temperature of the last alert of every row, nan while in range
+        alert_count (np.ndarray): Number of alerts of every row
+        records (list[ScanRecord]): Record of every row
+        _size (int): Number of rows in use
+        _rows (dict[str, int]): Row of every subscription key
+        _keys (dict[str, set[str]]): Subscription keys of every address
+        _cell_ids (dict[str, int]): Id of every cell
+        _cell_names (list[str]): Cell of every id
+        _cell_counts (list[int]): Number of rows in every cell
+        _journal (Optional[list[tuple[str, tuple]]]): Changes made while a reload runs, None otherwise
+
+    """
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self.minimum = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.maximum = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.cell_ids = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        self.alerted_at = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self.condition = np.zeros(INITIAL_CAPACITY, dtype=np.int8)
+        self.alerted_temperature = np.full(INITIAL_CAPACITY, np.nan, dtype=np.float64)
+        self.alert_count = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.records: list[ScanRecord] = []
+        self._size = 0
+        self._rows: dict[str, int] = {}
+        self._keys: dict[str, set[str]] = {}
+        self._cell_ids: dict[str, int] = {}
+        self._cell_names: list[str] = []
+        self._cell_counts: list[int] = []
+        self._journal: Optional[list[tuple[str, tuple]]] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    async def load(self, database: Storage, cooldown: Cooldown):
+        """
+        This function is used to fill the table with every subscription in the database.
+
+        Args:
+            database (Storage): Database to load from
+            cooldown (Cooldown): Alert cooldown the last alert times are taken from
+
+        Returns:
+            None
+
+        """
+        async for record in database.find_records():
+            self.add(record, cooldown.last_used(record.key))
+        self.loaded = True
+
+    async def reload(self, database: Storage, cooldown: Cooldown):
+        """
+        This function is used to replace the content of the table with a fresh load.
+        The table keeps serving the old content until the new one is complete, changes
+        made meanwhile are applied to the new content too, so none are lost.
+
+        Args:
+            database (Storage): Database to load from
+            cooldown (Cooldown): Alert cooldown the last alert times are taken from
+
+        Returns:
+            None
+
+        """
+        table = SubscriptionTable()
+        self._journal = []
+        try:
+            await table.load(database, cooldown)
+            for method, args in self._journal:
+                getattr(table, method)(*args)
+        finally:
+            self._journal = None
+        self.__dict__.update(table.__dict__)
+
+    def add(self, data: ScanRecord, alerted_at: float = 0) -> None:
+        """
+        This function is used to add a subscription or replace the one with the same key.
+
+        Args:
+            data (ScanRecord): Record of the subscription
+            alerted_at (float): Time of the last alert of the subscription
+
+        Returns:
+            None
+
+        """
+        if self._journal is not None:
+            self._journal.append(("add", (data, alerted_at)))
+        row = self._rows.get(data.key)
+        if row is None:
+            row = self._size
+            if row == len(self.minimum):
+                self._grow()
+            self._size += 1
+            self._rows[data.key] = row
+            self._keys.setdefault(data.address, set()).add(data.key)
+            self.records.append(data)
+        else:
+            self._release_cell(int(self.cell_ids[row]))
+            self.records[row] = data
+
+        self.minimum[row] = data.minimum_temperature
+        self.maximum[row] = data.maximum_temperature
+        self.cell_ids[row] = self._acquire_cell(data.cell)
+        self.alerted_at[row] = alerted_at
+        self.condition[row] = CONDITION_IDS.get(data.condition, IN_RANGE)
+        self.alerted_temperature[row] = (
+            np.nan if data.alerted_temperature is None else data.alerted_temperature
+        )
+        self.alert_count[row] = data.alert_count
+
+    def remove(self, address: str) -> None:
+        """
+        This function is used to remove every subscription of an address.
+
+        Args:
+            address (str): Address of the agent
+
+        Returns:
+            None
+
+        """
+        if self._journal is not None:
+            self._journal.append(("remove", (address,)))
+        for key in self._keys.pop(address, set()):
+            self._remove_row(self._rows.pop(key))
+
+    def discard(self, key: str) -> None:
+        """
+        This function is used to remove one subscription, if it is in the table.
+
+        Args:
+            key (str): Key of the subscription
+
+        Returns:
+            None
+
+        """
+        if self._journal is not None:
+            self._journal.append(("discard", (key,)))
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        keys = self._keys[self.records[row].address]
+        keys.discard(key)
+        if not keys:
+            del self._keys[self.records[row].address]
+        self._remove_row(row)
+
+    def _remove_row(self, row: int) -> None:
+        """
+        This function is used to remove a row.
+        The last row is moved into the freed row so the arrays stay dense.
+
+        Args:
+            row (int): Row to remove
+
+        Returns:
+            None
+
+        """
+        self._release_cell(int(self.cell_ids[row]))
+
+        last = self._size - 1
+        if row != last:  # move the last row into the hole
+            for column in self._columns:
+                column[row] = column[last]
+            self.records[row] = self.records[last]
+            self._rows[self.records[row].key] = row
+        self.records.pop()
+        self._size = last
+
+    @property
+    def cells(self) -> list[str]:
+        """
+        This function is used to get the cells that have at least one subscription.
+
+        Returns:
+            list[str]: Cells in use
+
+        """
+        return [
+            cell
+            for cell, count in zip(self._cell_names, self._cell_counts)
+            if count > 0
+        ]
+
+    def check_alerts(
+        self, temperatures: dict[str, float], now: float, cooldown: float
+    ) -> tuple[np.ndarray, dict[str, tuple[Optional[str], Optional[float], int]]]:
+        """
+        This function is used to find the rows to alert and the new alert state of every row.
+        A breached row goes back in range only once its temperature is ALERT_HYSTERESIS
+        inside the thresholds, so readings flapping around a threshold alert once.
+        A row is alerted when its condition changes to LOW or HIGH, or when it stays
+        breached, is not on cooldown and moved ALERT_CHANGE since its last alert.
+        The table is not changed, see apply_alerts.
+
+        Args:
+            temperatures (dict[str, float]): Current temperature of every cell, missing cells keep their state
+            now (float): Current time in seconds since epoch
+            cooldown (float): Seconds between two alerts of the same row in the same condition
+
+        Returns:
+            tuple[np.ndarray, dict[str, tuple[Optional[str], Optional[float], int]]]: Indices of the rows to alert, and condition, alerted temperature and alert count of every row whose state changed, keyed by subscription key
+
+        """
+        size = self._size
+        current = self._current(temperatures)  # nan compares False, so no change
+        minimum, maximum = self.minimum[:size], self.maximum[:size]
+        previous = self.condition[:size]
+
+        low = current < minimum
+        high = current > maximum
+        condition = np.select(
+            [
+                high,
+                low,
+                (previous == HIGH) & (current > maximum - ALERT_HYSTERESIS),
+                (previous == LOW) & (current < minimum + ALERT_HYSTERESIS),
+                np.isnan(current),
+            ],
+            [HIGH, LOW, HIGH, LOW, previous],
+            IN_RANGE,
+        ).astype(np.int8)
+
+        ready = (now - self.alerted_at[:size]) >= cooldown
+        moved = np.abs(current - self.alerted_temperature[:size]) >= ALERT_CHANGE
+        alerted = (low | high) & ((condition != previous) | (ready & moved))
+        rows = np.flatnonzero(alerted)
+
+        temperature = np.where(alerted, current, self.alerted_temperature[:size])
+        temperature[condition == IN_RANGE] = np.nan
+        count = self.alert_count[:size] + alerted
+
+        states = {}
+        for row in np.flatnonzero(alerted | (condition != previous)):
+            states[self.records[row].key] = (
+                CONDITIONS.get(int(condition[row])),
+                None if np.isnan(temperature[row]) else float(temperature[row]),
+                int(count[row]),
+            )
+        return rows, states
+
+    def apply_alerts(
+        self, states: dict[str, tuple[Optional[str], Optional[float], int]], now: float
+    ) -> None:
+        """
+        This function is used to store the alert state of subscriptions once their alerts are sent.
+        Rows are looked up by key, so rows moved or removed since check_alerts are handled.
+
+        Args:
+            states (dict[str, tuple[Optional[str], Optional[float], int]]): Condition, alerted temperature and alert count, keyed by subscription key
+            now (float): Time of the alerts in seconds since epoch
+
+        Returns:
+            None
+
+        """
+        if self._journal is not None:
+            self._journal.append(("apply_alerts", (states, now)))
+        for key, (condition, temperature, count) in states.items():
+            row = self._rows.get(key)
+            if row is None:
+                continue  # removed meanwhile
+            if count != self.alert_count[row]:
+                self.alerted_at[row] = now
+            self.condition[row] = CONDITION_IDS.get(condition, IN_RANGE)
+            self.alerted_temperature[row] = np.nan if temperature is None else temperature
+            self.alert_count[row] = count
+
+    def cell_margins(self, temperatures: dict[str, float]) -> dict[str, float]:
+        """
+        This function is used to find how far every cell is from its nearest threshold.
+
+        Args:
+            temperatures (dict[str, float]): Current temperature of every cell
+
+        Returns:
+            dict[str, float]: Smallest margin of every given cell in degrees, negative if a threshold is breached
+
+        """
+        size = self._size
+        current = self._current(temperatures)
+        margins = np.minimum(current - self.minimum[:size], self.maximum[:size] - current)
+
+        by_cell = np.full(len(self._cell_names), np.inf, dtype=np.float64)
+        known = ~np.isnan(margins)
+        np.minimum.at(by_cell, self.cell_ids[:size][known], margins[known])
+        return {
+            cell: float(by_cell[self._cell_ids[cell]])
+            for cell in temperatures
+            if cell in self._cell_ids
+        }
+
+    def _current(self, temperatures: dict[str, float]) -> np.ndarray:
+        """
+        This function is used to spread the temperature of every cell to its rows.
+
+        Args:
+            temperatures (dict[str, float]): Current temperature of every cell
+
+        Returns:
+            np.ndarray: Temperature of every row, nan for rows of missing cells
+
+        """
+        by_cell = np.full(len(self._cell_names), np.nan, dtype=np.float64)
+        for cell, temperature in temperatures.items():
+            cell_id = self._cell_ids.get(cell)
+            if cell_id is not None:
+                by_cell[cell_id] = temperature
+        return by_cell[self.cell_ids[: self._size]]
+
+    def _grow(self) -> None:
+        """
+        This function is used to double the capacity of every column.
+
+        Returns:
+            None
+
+        """
+        capacity = len(self.minimum) * 2
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[: len(column)] = column
+            setattr(self, name, grown)
+
+    @property
+    def _columns(self) -> list[np.ndarray]:
+        """
+        This function is used to get every column of the table.
+
+        Returns:
+            list[np.ndarray]: Columns in the order of COLUMNS
+
+        """
+        return [getattr(self, name) for name in COLUMNS]
+
+    def _acquire_cell(self, cell: str) -> int:
+        """
+        This function is used to get the id of a cell and count one more row in it.
+
+        Args:
+            cell (str): Cell key
+
+        Returns:
+            int: Id of the cell
+
+        """
+        cell_id = self._cell_ids.get(cell)
+        if cell_id is None:
+            cell_id = len(self._cell_names)
+            self._cell_ids[cell] = cell_id
+            self._cell_names.append(cell)
+            self._cell_counts.append(0)
+        self._cell_counts[cell_id] += 1
+        return cell_id
+
+    def _release_cell(self, cell_id: int) -> None:
+        """
+        This function is used to count one row less in a cell.
+
+        Args:
+            cell_id (int): Id of the cell
+
+        Returns:
+            None
+
+        """
+        self._cell_counts[cell_id] -= 1
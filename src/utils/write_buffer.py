@@ -0,0 +1,122 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class WriteBuffer(Generic[T]):
+    """
+    This class is used to collect write operations and flush them together.
+    A batch is flushed once it holds max_size operations or max_delay seconds after
+    its first operation, whichever comes first. Every caller awaits the outcome of
+    the batch its operation was part of.
+
+    Attributes:
+        flush_func (Callable[[list[T]], Awaitable[Any]]): Coroutine function writing a batch
+        max_size (int): Operations that trigger a flush
+        max_delay (float): Seconds an operation waits at most before its batch is flushed
+        _pending (list[tuple[T, asyncio.Future]]): Operations of the open batch and their futures
+        _timer (Optional[asyncio.Task]): Flushes the open batch after max_delay
+        _flushes (set[asyncio.Task]): Flushes in progress
+
+    """
+
+    def __init__(
+        self,
+        flush_func: Callable[[list[T]], Awaitable[Any]],
+        max_size: int,
+        max_delay: float,
+    ) -> None:
+        self.flush_func = flush_func
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending: list[tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def submit(self, operation: T):
+        """
+        This function is used to add an operation and wait until its batch is written.
+
+        Args:
+            operation (T): Operation to write
+
+        Returns:
+            None
+
+        Raises:
+            Exception: Whatever writing the batch raised
+
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        if len(self._pending) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        await future
+
+    async def close(self):
+        """
+        This function is used to write the open batch and wait for every flush in progress.
+
+        Returns:
+            None
+
+        """
+        if self._pending:
+            self._start_flush()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush_later(self):
+        """
+        This function is used to flush the open batch after max_delay.
+
+        Returns:
+            None
+
+        """
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        """
+        This function is used to close the open batch and write it in the background.
+
+        Returns:
+            None
+
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[T, asyncio.Future]]):
+        """
+        This function is used to write a batch and resolve the futures of its operations.
+
+        Args:
+            batch (list[tuple[T, asyncio.Future]]): Operations and their futures
+
+        Returns:
+            None
+
+        """
+        try:
+            await self.flush_func([operation for operation, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
@@ -0,0 +1,9 @@
+"""
+This file is responsible for the setup shared by every test.
+
+"""
+
+import os
+
+# utils.requests refuses to import without an api key
+os.environ.setdefault("WEATHER_API_KEY", "test")
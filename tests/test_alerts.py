@@ -0,0 +1,109 @@
+"""
+This file is responsible for testing that every alert gets its own email key.
+Keys are what the outbox deduplicates on, so two alerts must never share one
+and a replay of the same alert must always get the same one.
+
+"""
+
+from messages import SendsTo, TemperatureCondition
+from utils.digest import Digest, render_email
+from utils.models import ScanRecord
+from utils.subscriptions import SubscriptionTable
+
+CELL = "1.0:1.0"
+EMAIL = "user@example.com"
+COOLDOWN = 3 * 60 * 60
+
+
+def record(**fields) -> ScanRecord:
+    values = {
+        "key": "agent:paris",
+        "address": "agent",
+        "email": EMAIL,
+        "location": "paris",
+        "cell": CELL,
+        "minimum_temperature": 0.0,
+        "maximum_temperature": 30.0,
+        "sends_to": [SendsTo.EMAIL],
+        "condition": None,
+        "alerted_temperature": None,
+        "alert_count": 0,
+    }
+    values.update(fields)
+    return ScanRecord(**values)
+
+
+def scan(
+    table: SubscriptionTable, temperature: float, now: float, delivered: bool = True
+) -> list[str]:
+    """
+    This function is used to run the alert part of a scan and get the email keys it queues.
+    The alert state is only applied if the emails were delivered.
+
+    """
+    rows, states = table.check_alerts({CELL: temperature}, now, COOLDOWN)
+    digest = Digest()
+    for row in rows:
+        data = table.records[row]
+        condition = (
+            TemperatureCondition.HIGH
+            if temperature > data.maximum_temperature
+            else TemperatureCondition.LOW
+        )
+        digest.add(data, temperature, condition, "", states[data.key][2])
+    if delivered:
+        table.apply_alerts(states, now)
+    return [render_email(alerts)[2] for alerts in digest.emails.values()]
+
+
+def test_high_in_range_high_gets_two_keys():
+    table = SubscriptionTable()
+    table.add(record())
+
+    first = scan(table, 35.0, 1000.0)
+    assert scan(table, 20.0, 1600.0) == []  # back in range, no alert
+    second = scan(table, 35.0, 2200.0)  # same cooldown window as the first
+
+    assert len(first) == 1 and len(second) == 1
+    assert first != second
+
+
+def test_replayed_alert_gets_the_same_key():
+    table = SubscriptionTable()
+    table.add(record())
+    first = scan(table, 35.0, 1000.0)
+
+    # the scan is replayed before its alert state was saved
+    replayed = SubscriptionTable()
+    replayed.add(record())
+
+    assert scan(replayed, 35.0, 1100.0) == first
+
+
+def test_loaded_alert_count_continues():
+    table = SubscriptionTable()
+    table.add(record())
+    _, states = table.check_alerts({CELL: 35.0}, 1000.0, COOLDOWN)
+    table.apply_alerts(states, 1000.0)
+    condition, temperature, count = states["agent:paris"]
+    scan(table, 20.0, 1600.0)
+    second = scan(table, 35.0, 2200.0)
+
+    # a restart after the first alert loads its persisted state
+    restarted = SubscriptionTable()
+    restarted.add(
+        record(condition=condition, alerted_temperature=temperature, alert_count=count)
+    )
+    scan(restarted, 20.0, 1600.0)
+
+    assert scan(restarted, 35.0, 2200.0) == second
+
+
+def test_undelivered_alert_fires_again():
+    table = SubscriptionTable()
+    table.add(record())
+
+    first = scan(table, 35.0, 1000.0, delivered=False)
+
+    assert scan(table, 35.0, 1100.0) == first
+    assert scan(table, 35.0, 1200.0) == []  # delivered now, nothing changed since
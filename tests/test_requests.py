@@ -0,0 +1,219 @@
+"""
+This file is responsible for testing how RequestHandler.fetch_temperatures batches requests.
+The weather api is replaced by a local aiohttp server that records every request.
+
+"""
+
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+import utils.requests
+from utils.cells import to_cell
+from utils.ratelimit import TokenBucket
+from utils.requests import GROUP_SIZE, RequestHandler
+
+
+class WeatherServer:
+    """
+    This class is used to stand in for the OpenWeather api.
+    The city id of a location is its latitude and its temperature is the city id.
+
+    Attributes:
+        groups (list[list[int]]): City ids of every group request
+        singles (list[int]): City id of every single request
+        missing (set[int]): City ids left out of group responses
+        failing (bool): True if every request answers with a 503
+
+    """
+
+    def __init__(self) -> None:
+        self.groups: list[list[int]] = []
+        self.singles: list[int] = []
+        self.missing: set[int] = set()
+        self.failing = False
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self.weather)
+        app.router.add_get("/data/2.5/group", self.group)
+        return app
+
+    async def weather(self, request: web.Request) -> web.Response:
+        if self.failing:
+            return web.Response(status=503)
+        city_id = int(float(request.query["lat"]))
+        self.singles.append(city_id)
+        return web.json_response({"id": city_id, "main": {"temp": float(city_id)}})
+
+    async def group(self, request: web.Request) -> web.Response:
+        if self.failing:
+            return web.Response(status=503)
+        city_ids = [int(city_id) for city_id in request.query["id"].split(",")]
+        self.groups.append(city_ids)
+        cities = [
+            {"id": city_id, "main": {"temp": float(city_id)}}
+            for city_id in city_ids
+            if city_id not in self.missing
+        ]
+        return web.json_response({"list": cities})
+
+
+def cell_of(city_id: int) -> str:
+    return to_cell(city_id, city_id)
+
+
+def age(handler: RequestHandler, cells: list[str], seconds: float):
+    """
+    This function is used to make the cached readings of cells older.
+
+    """
+    stored = time.time() - seconds
+    for cell in cells:
+        handler.temperature_cache.set(cell, handler.temperature_cache.peek(cell), stored)
+
+
+def expire(handler: RequestHandler, cells: list[str]):
+    """
+    This function is used to make the cached readings of cells too old to serve.
+
+    """
+    age(handler, cells, handler.max_stale_age)
+
+
+async def refreshed(handler: RequestHandler):
+    """
+    This function is used to wait for the background refreshes of stale cells.
+
+    """
+    await asyncio.gather(*set(handler._refreshing.values()))
+
+
+@pytest.fixture
+def server() -> WeatherServer:
+    return WeatherServer()
+
+
+@pytest.fixture
+async def handler(server, aiohttp_server, monkeypatch):
+    test_server = await aiohttp_server(server.app())
+    url = str(test_server.make_url("")).rstrip("/")
+    monkeypatch.setattr(utils.requests, "WEATHER_API_URL", url)
+    handler = RequestHandler()
+    handler.limiter = TokenBucket(1000, 1000)  # the default limit would slow the tests down
+    await handler.start()
+    yield handler
+    await handler.stop()
+
+
+async def test_unknown_cities_are_fetched_one_by_one(server, handler):
+    cells = [cell_of(city_id) for city_id in range(1, 4)]
+
+    temperatures = await handler.fetch_temperatures(cells, limit=10)
+
+    assert temperatures == {cell_of(city_id): float(city_id) for city_id in range(1, 4)}
+    assert sorted(server.singles) == [1, 2, 3]
+    assert server.groups == []
+
+
+async def test_known_cities_are_packed_into_groups(server, handler):
+    count = GROUP_SIZE + 5
+    cells = [cell_of(city_id) for city_id in range(1, count + 1)]
+    await handler.fetch_temperatures(cells, limit=10)  # learns the city ids
+    server.singles.clear()
+    expire(handler, cells)
+
+    temperatures = await handler.fetch_temperatures(cells, limit=10)
+
+    assert temperatures == {
+        cell_of(city_id): float(city_id) for city_id in range(1, count + 1)
+    }
+    assert sorted(len(group) for group in server.groups) == [5, GROUP_SIZE]
+    assert sorted(city_id for group in server.groups for city_id in group) == list(
+        range(1, count + 1)
+    )
+    assert server.singles == []
+
+
+async def test_fresh_cells_are_not_fetched(server, handler):
+    cells = [cell_of(city_id) for city_id in range(1, 4)]
+    await handler.fetch_temperatures(cells, limit=10)
+    server.singles.clear()
+
+    temperatures = await handler.fetch_temperatures(cells, limit=10)
+
+    assert len(temperatures) == 3
+    assert server.singles == [] and server.groups == []
+
+
+async def test_cities_missing_from_the_group_fall_back_to_singles(server, handler):
+    cells = [cell_of(city_id) for city_id in range(1, 5)]
+    await handler.fetch_temperatures(cells, limit=10)
+    server.singles.clear()
+    expire(handler, cells)
+    server.missing = {2, 4}
+
+    temperatures = await handler.fetch_temperatures(cells, limit=10)
+
+    assert temperatures == {cell_of(city_id): float(city_id) for city_id in range(1, 5)}
+    assert [sorted(group) for group in server.groups] == [[1, 2, 3, 4]]
+    assert sorted(server.singles) == [2, 4]
+
+
+async def test_stale_readings_are_used_when_the_fetch_fails(server, handler):
+    known, unknown = cell_of(1), cell_of(2)
+    await handler.fetch_temperatures([known], limit=10)  # learns the city id of 1
+    stored = time.time() - handler.temperature_cache.ttl - 1  # stale but servable
+    handler.temperature_cache.set(known, 11.0, stored)
+    handler.temperature_cache.set(unknown, 12.0, stored)
+    server.failing = True
+
+    temperatures = await handler.fetch_temperatures([known, unknown], limit=10)
+
+    assert temperatures == {known: 11.0, unknown: 12.0}
+
+
+async def test_readings_past_the_stale_window_are_dropped_when_the_fetch_fails(
+    server, handler
+):
+    cell = cell_of(1)
+    handler.temperature_cache.set(cell, 11.0, time.time() - handler.max_stale_age - 1)
+    server.failing = True
+
+    temperatures = await handler.fetch_temperatures([cell], limit=10)
+
+    assert temperatures == {}
+
+
+async def test_stale_cells_are_served_and_refreshed_in_the_background(server, handler):
+    cells = [cell_of(city_id) for city_id in range(1, 4)]
+    await handler.fetch_temperatures(cells, limit=10)
+    server.singles.clear()
+    stored = time.time() - handler.temperature_cache.ttl
+    for cell in cells:
+        handler.temperature_cache.set(cell, 99.0, stored)
+
+    temperatures = await handler.fetch_temperatures(cells, limit=10)
+    assert temperatures == {cell: 99.0 for cell in cells}  # no request waited for
+
+    await refreshed(handler)
+    assert [sorted(group) for group in server.groups] == [[1, 2, 3]]
+    assert await handler.fetch_temperatures(cells, limit=10) == {
+        cell_of(city_id): float(city_id) for city_id in range(1, 4)
+    }
+
+
+async def test_concurrent_fetches_share_group_requests(server, handler):
+    cells = [cell_of(city_id) for city_id in range(1, 4)]
+    await handler.fetch_temperatures(cells, limit=10)
+    expire(handler, cells)
+
+    first, second = await asyncio.gather(
+        handler.fetch_temperatures(cells, limit=10),
+        handler.fetch_temperatures(cells[1:], limit=10),
+    )
+
+    assert len(first) == 3 and len(second) == 2
+    assert [sorted(group) for group in server.groups] == [[1, 2, 3]]
@@ -0,0 +1,40 @@
+"""
+This file is responsible for testing how PollScheduler treats cached and old readings.
+
+"""
+
+from utils.scheduler import JITTER, POLL_MIN_INTERVAL, PollScheduler
+
+CELL = "1.0:1.0"
+
+
+def scheduler_with(cell: str, now: float) -> PollScheduler:
+    scheduler = PollScheduler()
+    scheduler.sync([cell], now)
+    return scheduler
+
+
+def test_cached_reading_does_not_slow_the_cell_down():
+    scheduler = scheduler_with(CELL, 0)
+    scheduler.record(CELL, 10.0, 5.0, 0, observed=0)
+    scheduler.record(CELL, 12.0, 3.0, 1800, observed=1800)
+    rate = scheduler._rate[CELL]
+
+    # the same reading served again from the cache
+    interval = scheduler.record(CELL, 12.0, 3.0, 2340, observed=1800)
+
+    assert scheduler._rate[CELL] == rate
+    assert interval == POLL_MIN_INTERVAL
+    assert scheduler._due[CELL] == 2340 + POLL_MIN_INTERVAL
+
+
+def test_old_reading_counts_from_when_it_was_observed():
+    scheduler = scheduler_with(CELL, 0)
+    scheduler.record(CELL, 10.0, 50.0, 0, observed=0)
+
+    # a 40 minute old reading served while the weather api is down
+    now = 2 * 60 * 60
+    scheduler.record(CELL, 10.0, 50.0, now, observed=now - 40 * 60)
+
+    assert scheduler._due[CELL] <= now - 40 * 60 + 3 * 60 * 60 * (1 + JITTER)
+    assert scheduler._due[CELL] >= now + POLL_MIN_INTERVAL * (1 - JITTER)
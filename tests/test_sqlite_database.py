@@ -0,0 +1,160 @@
+"""
+This file is responsible for testing the SQLite backend against a database file
+in a temporary directory. It runs without the MongoDB drivers installed.
+
+"""
+
+import time
+
+import pytest
+
+from messages import SendsTo
+from utils.sqlite_database import SQLiteDatabase
+
+ADDRESS = "agent"
+
+
+@pytest.fixture
+async def database(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / "agent.db"))
+    yield database
+    await database.flush()
+
+
+async def records(database: SQLiteDatabase) -> dict:
+    return {record.key: record async for record in database.find_records()}
+
+
+async def test_registration_is_claimed_once_and_activated(database):
+    key = await database.insert_pending(
+        ADDRESS, "Paris", 0, 30, [SendsTo.EMAIL, SendsTo.EMAIL], "user@example.com"
+    )
+    assert key == "agent:paris"
+    assert await database.find_due_registrations() == [key]
+
+    registration = await database.claim_registration(key, 60)
+    assert registration["_id"] == key
+    assert registration["sends_to"] == [SendsTo.EMAIL]
+    assert registration["batch"] is None
+    assert await database.claim_registration(key, 60) is None  # leased
+    assert await database.find_due_registrations() == []
+
+    record = await database.activate(key, 48.85, 2.35)
+    assert record.key == key
+    assert record.cell == (await records(database))[key].cell
+    assert await database.claim_registration(key, 60) is None  # gone
+
+
+async def test_registration_retried_is_due_again(database):
+    key = await database.insert_pending(ADDRESS, "paris", 0, 30, [SendsTo.AGENT])
+    await database.claim_registration(key, 60)
+    await database.retry_registration(key, 1, time.time() - 1, "timeout")
+
+    registration = await database.claim_registration(key, 60)
+    assert registration["attempts"] == 1
+    await database.remove_registration(key)
+    assert await database.activate(key, 0, 0) is None
+
+
+async def test_bulk_registrations_finish_their_batch_once(database):
+    results = [
+        {"location": "paris", "type": None, "message": None},
+        {"location": "PARIS", "type": "error", "message": "Same location as paris !"},
+        {"location": "lyon", "type": None, "message": None},
+    ]
+    subscriptions = [
+        {"location": "paris", "min_temp": 0, "max_temp": 30, "sends_to": [], "item": 0},
+        {"location": "lyon", "min_temp": 0, "max_temp": 30, "sends_to": [], "item": 2},
+    ]
+    keys = await database.insert_pending_many(ADDRESS, subscriptions, results)
+    assert keys == ["agent:paris", "agent:lyon"]
+    registration = await database.claim_registration(keys[0], 60)
+    batch = registration["batch"]
+    assert registration["item"] == 0
+
+    assert await database.claim_batch_email(batch, "user@example.com")
+    assert not await database.claim_batch_email(batch, "user@example.com")
+    await database.release_batch_email(batch, "user@example.com")
+    assert await database.claim_batch_email(batch, "user@example.com")
+
+    assert await database.finish_batch_item(batch, 0, "message", "added") is None
+    assert await database.finish_batch_item(batch, 0, "message", "added") is None
+    finished = await database.finish_batch_item(batch, 2, "error", "unknown")
+    assert finished["address"] == ADDRESS
+    assert [result["type"] for result in finished["results"]] == [
+        "message",
+        "error",
+        "error",
+    ]
+    assert await database.finish_batch_item(batch, 2, "error", "unknown") is None
+
+
+async def test_lease_is_exclusive_and_keeps_its_checkpoint(database):
+    lease = await database.acquire_lease("scan", "first", 60)
+    assert lease["remaining"] == []
+    assert await database.acquire_lease("scan", "second", 60) is None
+
+    await database.save_checkpoint("scan", "first", ["a", "b"])
+    await database.save_checkpoint("scan", "second", ["ignored"])
+    await database.release_lease("scan", "first")
+
+    lease = await database.acquire_lease("scan", "second", 60)
+    assert lease["holder"] == "second"
+    assert lease["remaining"] == ["a", "b"]
+
+
+async def test_outbox_dedupes_keys_and_completes(database):
+    await database.enqueue_outbox("alert:1", {"receiver": "user@example.com"})
+    await database.enqueue_outbox("alert:1", {"receiver": "other@example.com"})
+
+    message = await database.claim_outbox(60)
+    assert message["payload"] == {"receiver": "user@example.com"}
+    assert await database.claim_outbox(60) is None  # leased
+
+    await database.complete_outbox("alert:1")
+    await database.enqueue_outbox("alert:1", {"receiver": "user@example.com"})
+    assert await database.claim_outbox(60) is None  # delivered keys are kept
+
+
+async def test_outbox_retry_and_dead_letter(database):
+    await database.enqueue_outbox("alert:1", {})
+    await database.claim_outbox(60)
+    await database.retry_outbox("alert:1", 1, time.time() - 1, "smtp down")
+    assert (await database.claim_outbox(60))["attempts"] == 1
+
+    await database.dead_letter_outbox("alert:1", 2, "smtp down")
+    assert await database.claim_outbox(0) is None
+
+
+async def test_find_violations_and_keys(database):
+    cell = (await database.insert(ADDRESS, 1, 1, "paris", 0, 30, [SendsTo.AGENT])).cell
+    await database.insert("other", 1, 1, "paris", -10, 40, [SendsTo.AGENT])
+    await database.insert("far", 50, 50, "oslo", 0, 30, [SendsTo.AGENT])
+    await database.save_alert_states({"far:oslo": ("high", 35.0, 1)})
+
+    found = [record.key async for record in database.find_violations({cell: 35.0})]
+    assert found == ["agent:paris"]
+    assert [record.key async for record in database.find_violations({cell: 20.0})] == []
+    # still alerted, so it can go back in range
+    far = (await records(database))["far:oslo"]
+    found = [
+        record.key async for record in database.find_violations({far.cell: 20.0})
+    ]
+    assert found == ["far:oslo"]
+    assert far.alert_count == 1
+
+    await database.remove("other")
+    assert await database.find_keys(["agent:paris", "other:paris"]) == {"agent:paris"}
+    assert sorted(await database.find_cells()) == sorted({cell, far.cell})
+    assert {data.key async for data in database.find_all()} == {
+        "agent:paris",
+        "far:oslo",
+    }
+
+
+async def test_cooldowns_expire(database):
+    now = time.time()
+    await database.save_cooldowns("alert", {"live": now, "over": now - 120}, 60)
+
+    assert await database.load_cooldowns("alert") == {"live": now}
+    assert await database.load_cooldowns("update") == {}
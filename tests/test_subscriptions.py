@@ -0,0 +1,76 @@
+"""
+This file is responsible for testing that a reload of the subscription table
+keeps the changes made while it was reading the database.
+
+"""
+
+import asyncio
+
+from messages import SendsTo
+from utils.models import ScanRecord
+from utils.subscriptions import SubscriptionTable
+
+
+def record(address: str, cell: str = "1.0:1.0", location: str = "paris") -> ScanRecord:
+    return ScanRecord(
+        key=f"{address}:{location}",
+        address=address,
+        email=None,
+        location=location,
+        cell=cell,
+        minimum_temperature=0.0,
+        maximum_temperature=30.0,
+        sends_to=[SendsTo.AGENT],
+        condition=None,
+        alerted_temperature=None,
+        alert_count=0,
+    )
+
+
+class SlowDatabase:
+    """
+    Database stand-in that yields to the event loop between records, like a cursor would.
+
+    """
+
+    def __init__(self, records: list[ScanRecord]) -> None:
+        self.records = records
+        self.started = asyncio.Event()
+
+    async def find_records(self):
+        for data in self.records:
+            self.started.set()
+            await asyncio.sleep(0)
+            yield data
+
+
+class NoCooldown:
+    def last_used(self, key: str) -> float:
+        return 0
+
+
+async def test_changes_during_reload_are_kept():
+    table = SubscriptionTable()
+    table.add(record("removed"))
+    # the database read still has the removed user, and not the added one
+    database = SlowDatabase([record("kept"), record("removed")])
+    reload = asyncio.create_task(table.reload(database, NoCooldown()))
+    await database.started.wait()
+    table.add(record("added", "2.0:2.0"))
+    table.remove("removed")
+    await reload
+
+    assert {data.address for data in table.records[: len(table)]} == {"kept", "added"}
+    assert sorted(table.cells) == ["1.0:1.0", "2.0:2.0"]
+
+
+async def test_discard_removes_one_subscription():
+    table = SubscriptionTable()
+    table.add(record("agent"))
+    table.add(record("agent", location="lyon"))
+    table.discard("agent:paris")
+    table.discard("agent:missing")
+
+    assert [data.key for data in table.records[: len(table)]] == ["agent:lyon"]
+    table.remove("agent")
+    assert len(table) == 0